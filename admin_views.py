@@ -0,0 +1,134 @@
+from flask import redirect, url_for
+from flask_admin import Admin, AdminIndexView
+from flask_admin.contrib.sqla import ModelView
+from flask_login import current_user
+from wtforms.validators import ValidationError
+
+from regras import separar_palavras_chave
+
+# Views do painel (flask-admin). Importado pelo app só com ENABLE_ADMIN=1.
+
+class MyAdminIndexView(AdminIndexView):
+    def is_accessible(self):
+        return current_user.is_authenticated
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for('login'))
+
+class JobModelView(ModelView):
+    column_list = ('id', 'user_id', 'resource', 'status', 'attempts', 'run_at', 'last_error', 'updated_at')
+    column_filters = ('status', 'user_id')
+    column_default_sort = ('id', True)
+    can_create = False
+    can_edit = False
+    can_delete = True
+
+    def is_accessible(self):
+        return current_user.is_authenticated
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for('login'))
+
+def _token_truncado(view, context, model, name):
+    token = getattr(model, name)
+    return f"{token[:12]}…" if token else ''
+
+class UserModelView(ModelView):
+    # Paginação e filtros no servidor (índices em is_active/updated_at/created_at)
+    column_list = ('user_id', 'is_active', 'access_token', 'expires_at', 'created_at', 'updated_at')
+    column_formatters = {'access_token': _token_truncado}
+    column_filters = ('user_id', 'is_active', 'expires_at', 'created_at', 'updated_at')
+    column_sortable_list = ('user_id', 'is_active', 'expires_at', 'created_at', 'updated_at')
+    column_default_sort = ('updated_at', True)
+    page_size = 50
+    can_set_page_size = True
+    # Tokens ficam fora do formulário: vêm do OAuth e não devem aparecer em claro
+    form_columns = ('user_id', 'is_active')
+    can_create = False # Geralmente criado via OAuth
+    can_delete = True
+    can_edit = True
+
+    # Definido em configurar_admin (invalidar_tenant do app)
+    ao_alterar = None
+
+    def after_model_change(self, form, model, is_created):
+        self.ao_alterar(model.user_id)
+
+    def after_model_delete(self, model):
+        self.ao_alterar(model.user_id)
+    
+    def is_accessible(self):
+        return current_user.is_authenticated
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for('login'))
+
+class TenantStatsModelView(ModelView):
+    column_list = ('user_id', 'answered', 'failed', 'ignored', 'avg_latency_ms', 'last_question_at', 'updated_at')
+    column_labels = {'avg_latency_ms': 'Latência média (ms)'}
+    column_filters = ('user_id', 'answered', 'failed', 'last_question_at')
+    column_sortable_list = ('user_id', 'answered', 'failed', 'ignored', 'last_question_at')
+    column_default_sort = ('last_question_at', True)
+    page_size = 50
+    can_create = False
+    can_edit = False
+    can_delete = False
+
+    def is_accessible(self):
+        return current_user.is_authenticated
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for('login'))
+
+class AutoReplyRuleModelView(ModelView):
+    column_list = ('id', 'user_id', 'keywords', 'answer', 'priority', 'is_active', 'updated_at')
+    column_labels = {'keywords': 'Palavras-chave', 'answer': 'Resposta', 'priority': 'Prioridade'}
+    column_descriptions = {
+        'keywords': 'Separadas por vírgula ou uma por linha. Casa palavra inteira, sem acento/maiúscula.',
+        'priority': 'Se mais de uma regra casar, vence a de maior prioridade.',
+    }
+    column_filters = ('user_id', 'is_active', 'priority')
+    column_searchable_list = ('keywords', 'answer')
+    column_sortable_list = ('id', 'user_id', 'priority', 'is_active', 'updated_at')
+    column_default_sort = ('updated_at', True)
+    page_size = 50
+    form_columns = ('user_id', 'keywords', 'answer', 'priority', 'is_active')
+    can_create = True
+    can_edit = True
+    can_delete = True
+
+    # Definido em configurar_admin (invalidar_regras do app)
+    ao_alterar = None
+
+    def on_model_change(self, form, model, is_created):
+        if not separar_palavras_chave(model.keywords):
+            raise ValidationError('Informe ao menos uma palavra-chave.')
+        if not (model.answer or '').strip() or len(model.answer) > 2000:
+            raise ValidationError('A resposta deve ter entre 1 e 2000 caracteres (limite do Mercado Livre).')
+
+    def after_model_change(self, form, model, is_created):
+        # Regra trocada de vendedor: o anterior também perde a regra
+        anterior = form.user_id.object_data
+        if anterior is not None and anterior != model.user_id:
+            self.ao_alterar(anterior)
+        self.ao_alterar(model.user_id)
+
+    def after_model_delete(self, model):
+        self.ao_alterar(model.user_id)
+
+    def is_accessible(self):
+        return current_user.is_authenticated
+
+    def inaccessible_callback(self, name, **kwargs):
+        return redirect(url_for('login'))
+
+def configurar_admin(app, db, User, Job, TenantStats, AutoReplyRule, ao_alterar_tenant, ao_alterar_regras):
+    UserModelView.ao_alterar = staticmethod(ao_alterar_tenant)
+    AutoReplyRuleModelView.ao_alterar = staticmethod(ao_alterar_regras)
+    # Inicialização do Admin com Bootstrap 4 e Template Customizado (via pasta templates/admin/master.html)
+    admin = Admin(app, name='Bot Admin', index_view=MyAdminIndexView())
+    admin.add_view(UserModelView(User, db.session))
+    admin.add_view(TenantStatsModelView(TenantStats, db.session, name='Estatísticas'))
+    admin.add_view(AutoReplyRuleModelView(AutoReplyRule, db.session, name='Respostas automáticas'))
+    admin.add_view(JobModelView(Job, db.session, name='Jobs'))
+    return admin
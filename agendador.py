@@ -0,0 +1,119 @@
+import heapq
+import os
+import random
+import threading
+import time
+
+
+class TarefaPeriodica:
+    """Executa `fn` a cada `intervalo` segundos numa thread daemon, com jitter.
+
+    O jitter espalha as execuções entre processos/nós para não sincronizarem.
+    Assim como o WorkerPool, a thread é criada por processo (seguro após fork).
+    """
+
+    def __init__(self, nome, intervalo, fn, jitter=0.1, atraso_inicial=None):
+        self.nome = nome
+        self.intervalo = intervalo
+        self.fn = fn
+        self.jitter = jitter
+        self.atraso_inicial = atraso_inicial
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._parando = threading.Event()
+        self.execucoes = 0
+        self.falhas = 0
+
+    def _espera(self):
+        return self.intervalo * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._parando.clear()
+            self._thread = threading.Thread(target=self._loop, name=self.nome, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._parando.set()
+
+    def _loop(self):
+        atraso = self.atraso_inicial
+        if atraso is None:
+            atraso = random.uniform(0, self.intervalo * self.jitter)
+        if self._parando.wait(atraso):
+            return
+        while not self._parando.is_set():
+            try:
+                self.fn()
+                self.execucoes += 1
+            except Exception as e:
+                self.falhas += 1
+                print(f"Erro na tarefa periódica {self.nome}: {e}")
+            self._parando.wait(self._espera())
+
+
+class Adiamentos:
+    """Executa `fn(*args)` depois de um atraso, com uma única thread para todos.
+
+    Usado para adiar perguntas (ex.: geração indisponível) sem prender um
+    worker dormindo nem criar uma thread por pergunta. Fica só em memória:
+    o que estiver pendente num restart é recuperado pela varredura.
+    """
+
+    def __init__(self, nome='adiamentos', max_pendentes=10000):
+        self.nome = nome
+        self.max_pendentes = max_pendentes
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._pid = None
+        self._thread = None
+        self.agendados = 0
+        self.recusados = 0
+        self.executados = 0
+
+    def start(self):
+        with self._cond:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name=self.nome, daemon=True)
+            self._thread.start()
+
+    def agendar(self, atraso, fn, *args):
+        self.start()
+        with self._cond:
+            if len(self._heap) >= self.max_pendentes:
+                self.recusados += 1
+                return False
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic() + atraso, self._seq, fn, args))
+            self.agendados += 1
+            self._cond.notify()
+        return True
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, fn, args = heapq.heappop(self._heap)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Erro em tarefa adiada de {self.nome}: {e}")
+            with self._cond:
+                self.executados += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._heap),
+                'scheduled': self.agendados,
+                'rejected': self.recusados,
+                'executed': self.executados,
+            }
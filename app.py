@@ -1,13 +1,39 @@
-from flask import Flask, request, jsonify, redirect, render_template_string, url_for, flash, render_template
+from flask import Flask, request, jsonify, redirect, render_template_string, url_for, flash, render_template, g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from flask_admin import Admin, AdminIndexView
-from flask_admin.contrib.sqla import ModelView
+from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user
 from dotenv import load_dotenv
-import requests
 import os
-from openai import OpenAI
+import time
+import random
+import atexit
+import asyncio
+import threading
 from sqlalchemy import text
+from workers import WorkerPool
+from escalonador import FairScheduler, espera_na_fila, parse_pesos
+from jobs import JobQueue, JobRunner
+from ml_client import MLApiError, LatencyStats, AsyncMercadoLivreClient, criar_cliente
+from pipeline_async import AsyncPool
+from cache import TTLCache
+from invalidacao import Invalidador
+from idempotencia import IdempotencyIndex
+from respostas_cache import AnswerCache
+from contexto_item import ContextoItem, estimar_tokens
+from intencoes import ClassificadorIntencoes, Roteador
+from regras import MotorRegras, Regra
+from tokens import TokenRefresher
+from agendador import TarefaPeriodica, Adiamentos
+from metricas import Registry, limpar_diretorio
+from estatisticas import EstatisticasTenants
+from historico import HistoryWriter
+from gravador import GravadorWebhooks
+from geracao import CircuitBreaker, Gerador, GeracaoIndisponivel
+from despacho import OutboxRespostas, ControleAIMD, Despachante, EnvioDescartado
+from prefetch import EstoqueItens, PrefetchAnuncios
+from migrations import Migrador
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -26,7 +52,142 @@ login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Criado no primeiro uso: só importar o SDK da OpenAI leva ~0,5 s do boot.
+# Os scripts verify_* trocam `app.client` por um mock, o que continua valendo.
+client = None
+_openai_lock = threading.Lock()
+
+def cliente_openai():
+    global client
+    if client is None:
+        with _openai_lock:
+            if client is None:
+                from openai import OpenAI
+                # Sem retries do SDK: prazo, hedge e adiamento ficam com o Gerador
+                client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return client
+
+_aquecimento = None
+
+def aquecer_openai():
+    # Importa o SDK fora do caminho da primeira pergunta: no master do gunicorn
+    # (herdado pelos workers) ou, fora dele, numa thread logo no primeiro request
+    global _aquecimento
+    if client is not None or (_aquecimento and _aquecimento.pid == os.getpid()):
+        return
+    _aquecimento = threading.Thread(target=cliente_openai, name='openai-warmup', daemon=True)
+    _aquecimento.pid = os.getpid()
+    _aquecimento.start()
+
+# --- Métricas (exportadas em /metrics, agregadas entre os workers) ---
+
+metricas = Registry()
+ESTAGIOS = metricas.histogram('bot_stage_seconds', 'Duração de cada estágio do pipeline de perguntas', ['stage'])
+WEBHOOK_SEGUNDOS = metricas.histogram('bot_webhook_seconds', 'Tempo de resposta do /notifications', ['topic'])
+WEBHOOKS = metricas.counter('bot_webhooks_total', 'Notificações recebidas por resultado do enfileiramento', ['topic', 'outcome'])
+NOTIFICACOES = metricas.counter('bot_notifications_total', 'Notificações processadas por status e motivo', ['status', 'reason'])
+ML_SEGUNDOS = metricas.histogram('bot_ml_request_seconds', 'Latência das chamadas à API do Mercado Livre', ['method', 'endpoint'])
+ML_ERROS = metricas.counter('bot_ml_errors_total', 'Respostas de erro (ou falha de rede) da API do ML', ['endpoint', 'status'])
+ML_RETRIES = metricas.counter('bot_ml_retries_total', 'Novas tentativas de chamadas à API do ML', ['endpoint'])
+OPENAI_ERROS = metricas.counter('bot_openai_errors_total', 'Falhas na geração de resposta pela OpenAI', ['error'])
+PROMPT_TOKENS = metricas.histogram(
+    'bot_openai_prompt_tokens', 'Tokens de prompt por chamada à OpenAI', [],
+    buckets=(50, 100, 150, 200, 300, 400, 600, 800, 1200, 2000, 4000)
+)
+OPENAI_TOKENS = metricas.counter('bot_openai_tokens_total', 'Tokens consumidos na OpenAI', ['kind'])
+ROTAS = metricas.counter('bot_routes_total', 'Perguntas por caminho de resposta (rule, template, cache, fast, strong)', ['route', 'intent'])
+ROTA_SEGUNDOS = metricas.histogram('bot_route_seconds', 'Tempo para obter a resposta em cada caminho', ['route'])
+ENTREGA_SEGUNDOS = metricas.histogram(
+    'bot_answer_delivery_seconds', 'Idade da resposta ao ser publicada pela outbox (pronta -> enviada)', [],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+)
+HISTORICO_DESCARTES = metricas.counter('bot_history_dropped_total', 'Registros de histórico perdidos (fila cheia ou erro de gravação)', ['reason'])
+ORIGEM_ITEM = metricas.counter('bot_item_source_total', 'Origem dos dados do item por pergunta (memory, store, api)', ['source'])
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+def _registrar_chamada_ml(endpoint, method, status, elapsed, attempt):
+    ML_SEGUNDOS.observe(elapsed, method=method, endpoint=endpoint)
+    if status is None or status >= 400:
+        ML_ERROS.inc(endpoint=endpoint, status=status or 'network')
+    if attempt > 1:
+        ML_RETRIES.inc(endpoint=endpoint)
+
+# Cliente único do Mercado Livre (pool de conexões, timeouts, rate limit e retry)
+ml = criar_cliente()
+ml_latencias = LatencyStats()
+ml.add_hook(ml_latencias)
+ml.add_hook(_registrar_chamada_ml)
+
+# Cache de respostas por item + pergunta normalizada (com match de perguntas parecidas).
+# ANSWER_CACHE_SIMILARITY=0 desliga o match aproximado e usa só o exato.
+answer_cache = AnswerCache(
+    max_items=int(os.getenv('ANSWER_CACHE_ITEMS', '2000')),
+    max_per_item=int(os.getenv('ANSWER_CACHE_PER_ITEM', '50')),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', '86400')),
+    similarity_threshold=float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.9'))
+)
+
+# Cache de tenants (token + is_active) na frente do User.query.get.
+# Invalidado explicitamente no callback/admin e, entre processos, via LISTEN/NOTIFY.
+TENANT_CACHE_SIZE = int(os.getenv('TENANT_CACHE_SIZE', '10000'))
+TENANT_CACHE_TTL = float(os.getenv('TENANT_CACHE_TTL', '300'))
+TENANT_NOT_FOUND_TTL = float(os.getenv('TENANT_NOT_FOUND_TTL', '30'))
+
+# Snapshot imutável do tenant: pode circular entre threads, ao contrário do objeto do SQLAlchemy
+Tenant = namedtuple('Tenant', ['user_id', 'access_token', 'is_active'])
+TENANT_INEXISTENTE = Tenant(None, None, False)
+
+tenant_cache = TTLCache(maxsize=TENANT_CACHE_SIZE, ttl=TENANT_CACHE_TTL, name='tenants')
+
+# Cache de metadados de item por (vendedor, item_id). Invalidado pelo tópico 'items'.
+item_cache = TTLCache(
+    maxsize=int(os.getenv('ITEM_CACHE_SIZE', '5000')),
+    ttl=float(os.getenv('ITEM_CACHE_TTL', '600')),
+    name='items'
+)
+
+# Contexto do item para o prompt (atributos, descrição, frete, estoque), montado
+# uma vez na busca do item e guardado com ele no item_cache
+contexto_item = ContextoItem(
+    orcamento=int(os.getenv('ITEM_CONTEXT_TOKENS', '250')),
+    max_atributos=int(os.getenv('ITEM_CONTEXT_MAX_ATTRIBUTES', '15'))
+)
+
+# Pool de processamento em background: o /notifications só valida e enfileira.
+# WORKER_QUEUE_MAX limita a fila; acima disso a notificação é recusada (503)
+# e o Mercado Livre reenvia mais tarde.
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '4'))
+WORKER_QUEUE_MAX = int(os.getenv('WORKER_QUEUE_MAX', '500'))
+WORKER_DRAIN_TIMEOUT = float(os.getenv('WORKER_DRAIN_TIMEOUT', '25'))
+
+# Escalonamento justo entre vendedores: cada um tem sua sub-fila, servida por
+# deficit round-robin com os pesos de TENANT_WEIGHTS ("user_id:peso,...", padrão
+# 1). Um vendedor ocupa no máximo TENANT_QUEUE_SHARE da fila e roda no máximo
+# TENANT_MAX_CONCURRENCY perguntas ao mesmo tempo (0 = sem limite).
+TENANT_WEIGHTS = parse_pesos(os.getenv('TENANT_WEIGHTS', ''))
+TENANT_QUEUE_SHARE = float(os.getenv('TENANT_QUEUE_SHARE', '0.5'))
+TENANT_MAX_CONCURRENCY = int(os.getenv('TENANT_MAX_CONCURRENCY', '0'))
+
+def escalonador_tenants(max_queue, max_concorrencia):
+    return FairScheduler(
+        max_queue=max_queue,
+        max_por_tenant=max(1, int(max_queue * TENANT_QUEUE_SHARE)),
+        max_concorrencia=max_concorrencia,
+        pesos=TENANT_WEIGHTS
+    )
+
+pool = WorkerPool(
+    concurrency=WORKER_CONCURRENCY, name='perguntas',
+    escalonador=escalonador_tenants(WORKER_QUEUE_MAX, TENANT_MAX_CONCURRENCY)
+)
+
+# QUEUE_BACKEND=memory: fila só em memória (padrão, um único nó).
+# QUEUE_BACKEND=database: fila durável na tabela 'jobs', compartilhada por
+# vários processos/nós (web com EMBEDDED_JOB_RUNNER=1 e/ou worker.py).
+QUEUE_BACKEND = os.getenv('QUEUE_BACKEND', 'memory')
+EMBEDDED_JOB_RUNNER = os.getenv('EMBEDDED_JOB_RUNNER', '1') == '1'
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
 
 # --- Modelos ---
 
@@ -37,10 +198,261 @@ class User(db.Model):
     access_token = db.Column(db.Text)
     refresh_token = db.Column(db.Text)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    expires_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Listagem do admin: filtro por ativo + ordenação por data, paginada no banco
+    __table_args__ = (
+        db.Index('ix_users_is_active_updated_at', 'is_active', 'updated_at'),
+        db.Index('ix_users_created_at', 'created_at'),
+    )
 
     def __repr__(self):
         return f'<User {self.user_id}>'
 
+# Agregados por vendedor, atualizados incrementalmente (ver estatisticas.py)
+class TenantStats(db.Model):
+    __tablename__ = 'tenant_stats'
+    user_id = db.Column(db.BigInteger, primary_key=True)
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    ignored = db.Column(db.Integer, nullable=False, default=0)
+    latency_ms_total = db.Column(db.Float, nullable=False, default=0)
+    last_question_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def avg_latency_ms(self):
+        return round(self.latency_ms_total / self.answered, 1) if self.answered else None
+
+    def __repr__(self):
+        return f'<TenantStats {self.user_id}>'
+
+# Fila durável de notificações (QUEUE_BACKEND=database)
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    user_id = db.Column(db.BigInteger, nullable=False)
+    topic = db.Column(db.String(50), nullable=False)
+    resource = db.Column(db.Text, nullable=False)
+    notification_id = db.Column(db.String(100)) # _id da notificação do ML (chave n: de idempotência)
+    status = db.Column(db.String(20), nullable=False, default='pending') # pending, running, done, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(255))
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+        # No máximo um job ativo por pergunta: reentregas do ML não duplicam trabalho
+        db.Index(
+            'uq_jobs_resource_active', 'resource', unique=True,
+            postgresql_where=text("status IN ('pending', 'running')"),
+            sqlite_where=text("status IN ('pending', 'running')")
+        ),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.resource} {self.status}>'
+
+# Índice de idempotência: notificações e perguntas já recebidas (sobrevive a restart)
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    key = db.Column(db.String(255), primary_key=True)
+    status = db.Column(db.String(20), nullable=False) # in_flight, done
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key} {self.status}>'
+
+# Histórico de perguntas processadas (auditoria/análise), gravado em lote por historico.py
+class QuestionHistory(db.Model):
+    __tablename__ = 'question_history'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    user_id = db.Column(db.BigInteger, nullable=False)
+    question_id = db.Column(db.BigInteger)
+    item_id = db.Column(db.String(50))
+    resource = db.Column(db.Text)
+    question_text = db.Column(db.Text)
+    answer_text = db.Column(db.Text)
+    answer_source = db.Column(db.String(20)) # ai, cache, template, rule
+    status = db.Column(db.String(20), nullable=False) # ok, ignored, error
+    reason = db.Column(db.String(50))
+    tenant_lookup_ms = db.Column(db.Float)
+    question_fetch_ms = db.Column(db.Float)
+    item_fetch_ms = db.Column(db.Float)
+    generate_ms = db.Column(db.Float)
+    answer_post_ms = db.Column(db.Float)
+    total_ms = db.Column(db.Float)
+    queue_wait_ms = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_question_history_user_created', 'user_id', 'created_at'),
+        db.Index('ix_question_history_item_created', 'item_id', 'created_at'),
+        db.Index('ix_question_history_question_id', 'question_id'),
+    )
+
+    def __repr__(self):
+        return f'<QuestionHistory {self.question_id} {self.status}>'
+
+# Respostas automáticas do vendedor por palavra-chave (editáveis no admin, ver regras.py)
+class AutoReplyRule(db.Model):
+    __tablename__ = 'auto_reply_rules'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    user_id = db.Column(db.BigInteger, nullable=False)
+    keywords = db.Column(db.Text, nullable=False) # separadas por vírgula ou uma por linha
+    answer = db.Column(db.Text, nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=0) # maior vence
+    is_active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_auto_reply_rules_user_active', 'user_id', 'is_active'),
+    )
+
+    def __repr__(self):
+        return f'<AutoReplyRule {self.id} user={self.user_id}>'
+
+# Respostas prontas aguardando envio ao ML (ANSWER_OUTBOX=1, ver despacho.py)
+class AnswerOutbox(db.Model):
+    __tablename__ = 'answer_outbox'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    user_id = db.Column(db.BigInteger, nullable=False)
+    question_id = db.Column(db.BigInteger, nullable=False)
+    answer = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending') # pending, sending, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=10)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(255))
+    locked_until = db.Column(db.DateTime)
+    last_status = db.Column(db.Integer)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_answer_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        # Uma resposta ativa por pergunta: reprocessar a pergunta não duplica o envio
+        db.Index(
+            'uq_answer_outbox_question_active', 'question_id', unique=True,
+            postgresql_where=text("status IN ('pending', 'sending')"),
+            sqlite_where=text("status IN ('pending', 'sending')")
+        ),
+    )
+
+    def __repr__(self):
+        return f'<AnswerOutbox {self.id} q={self.question_id} {self.status}>'
+
+# Cópia local dos anúncios ativos, carregada em lote pelo prefetch (prefetch.py)
+class ItemSnapshot(db.Model):
+    __tablename__ = 'item_snapshots'
+    item_id = db.Column(db.String(50), primary_key=True)
+    seller_id = db.Column(db.BigInteger, nullable=False)
+    data = db.Column(db.Text, nullable=False) # JSON com os campos usados no prompt
+    description = db.Column(db.Text)
+    description_fetched = db.Column(db.Boolean, nullable=False, default=False)
+    last_updated = db.Column(db.String(40)) # last_updated do ML, só comparado por igualdade
+    fetched_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_item_snapshots_seller', 'seller_id'),
+    )
+
+    def __repr__(self):
+        return f'<ItemSnapshot {self.item_id}>'
+
+# Próximo prefetch de anúncios de cada vendedor (com lease, entre processos)
+class ItemPrefetchState(db.Model):
+    __tablename__ = 'item_prefetch_state'
+    user_id = db.Column(db.BigInteger, primary_key=True)
+    next_run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(255))
+    locked_until = db.Column(db.DateTime)
+    last_run_at = db.Column(db.DateTime)
+    items = db.Column(db.Integer, nullable=False, default=0)
+    api_calls = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_item_prefetch_state_next_run', 'next_run_at'),
+    )
+
+    def __repr__(self):
+        return f'<ItemPrefetchState {self.user_id}>'
+
+# --- Cache de Tenants ---
+
+CANAL_TENANTS = 'tenant_invalidation'
+invalidador = Invalidador(app, db)
+
+def obter_tenant(user_id):
+    tenant = tenant_cache.get(user_id)
+    if tenant is not None:
+        return None if tenant is TENANT_INEXISTENTE else tenant
+
+    user = User.query.get(user_id)
+    if not user:
+        # Cache negativo curto: protege o banco de rajadas para user_ids desconhecidos
+        tenant_cache.set(user_id, TENANT_INEXISTENTE, ttl=TENANT_NOT_FOUND_TTL)
+        return None
+
+    tenant = Tenant(user.user_id, user.access_token, user.is_active)
+    tenant_cache.set(user_id, tenant)
+    return tenant
+
+def invalidar_tenant(user_id):
+    tenant_cache.invalidate(int(user_id))
+    invalidador.publicar(CANAL_TENANTS, user_id)
+
+def _ao_invalidar_tenant(payload):
+    if payload is None:
+        tenant_cache.clear()
+    else:
+        tenant_cache.invalidate(int(payload))
+
+invalidador.registrar(CANAL_TENANTS, _ao_invalidar_tenant)
+
+# --- Respostas automáticas por palavra-chave ---
+# Cada vendedor tem suas regras compiladas num autômato em memória. Mudanças no
+# admin invalidam na hora (e nos outros processos via LISTEN/NOTIFY); sem
+# PostgreSQL, as regras são relidas a cada AUTO_REPLY_RULES_CHECK_INTERVAL e o
+# autômato só é recompilado se algo mudou.
+
+CANAL_REGRAS = 'auto_reply_rules_invalidation'
+AUTO_REPLY_RULES = os.getenv('AUTO_REPLY_RULES', '1') == '1'
+
+def carregar_regras(user_id):
+    consulta = AutoReplyRule.query.filter_by(user_id=user_id, is_active=True).order_by(AutoReplyRule.id)
+    return [Regra(r.id, r.keywords, r.answer, r.priority) for r in consulta]
+
+regras_automaticas = MotorRegras(
+    carregar_regras,
+    intervalo=float(os.getenv('AUTO_REPLY_RULES_CHECK_INTERVAL', '60')),
+    maxsize=TENANT_CACHE_SIZE
+)
+
+def invalidar_regras(user_id):
+    regras_automaticas.invalidar(user_id)
+    invalidador.publicar(CANAL_REGRAS, user_id)
+
+def _ao_invalidar_regras(payload):
+    if payload is None:
+        regras_automaticas.limpar()
+    else:
+        regras_automaticas.invalidar(payload)
+
+invalidador.registrar(CANAL_REGRAS, _ao_invalidar_regras)
+
 # Modelo do Administrador (Para Login)
 class AdminUser(UserMixin):
     id = 1
@@ -51,121 +463,913 @@ def load_user(user_id):
         return AdminUser()
     return None
 
-# --- Admin Views ---
-
-class MyAdminIndexView(AdminIndexView):
-    def is_accessible(self):
-        return current_user.is_authenticated
+# --- Admin ---
+# flask-admin (e wtforms) só é importado se o painel estiver ligado: processos
+# que só atendem webhooks ou a fila (ENABLE_ADMIN=0) sobem sem ele.
+ENABLE_ADMIN = os.getenv('ENABLE_ADMIN', '1') == '1'
 
-    def inaccessible_callback(self, name, **kwargs):
-        return redirect(url_for('login'))
-
-class UserModelView(ModelView):
-    column_list = ('user_id', 'is_active', 'access_token')
-    form_columns = ('user_id', 'is_active', 'access_token', 'refresh_token')
-    can_create = False # Geralmente criado via OAuth
-    can_delete = True
-    can_edit = True
-    
-    def is_accessible(self):
-        return current_user.is_authenticated
-
-    def inaccessible_callback(self, name, **kwargs):
-        return redirect(url_for('login'))
-
-# Inicialização do Admin com Bootstrap 4 e Template Customizado (via pasta templates/admin/master.html)
-admin = Admin(app, name='Bot Admin', index_view=MyAdminIndexView())
-admin.add_view(UserModelView(User, db.session))
+if ENABLE_ADMIN:
+    from admin_views import configurar_admin
+    admin = configurar_admin(
+        app, db, User, Job, TenantStats, AutoReplyRule,
+        ao_alterar_tenant=invalidar_tenant, ao_alterar_regras=invalidar_regras
+    )
 
 # --- Banco de Dados (Migração e Init) ---
 
 def init_db():
+    # Migrações versionadas (migrations.py): no boot normal é só uma consulta à schema_version
     with app.app_context():
-        # Cria tabelas se não existirem
-        db.create_all()
-        
-        # Migração Manual: Adicionar coluna is_active se não existir
         try:
-            inspector = db.inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('users')]
-            if 'is_active' not in columns:
-                print("Migrando banco de dados: Adicionando coluna 'is_active'...")
-                with db.engine.connect() as conn:
-                    conn.execute(text("ALTER TABLE users ADD COLUMN is_active BOOLEAN DEFAULT TRUE"))
-                    conn.commit()
-                print("Migração concluída.")
+            Migrador(db.engine, db.metadata).migrar()
         except Exception as e:
-            print(f"Erro na verificação/migração do banco: {e}")
+            print(f"Erro na migração do banco: {e}")
+            raise
 
 # --- Funções Auxiliares ML ---
 
-def obter_pergunta_ml(resource_url, token):
-    url = f"https://api.mercadolibre.com{resource_url}"
-    headers = {'Authorization': f'Bearer {token}'}
+def credenciais_app():
+    # Robustez nas Variáveis
+    CLIENT_ID = os.getenv('CLIENT_ID')
+    if not CLIENT_ID:
+        CLIENT_ID = os.getenv('APP_ID')
     
+    if not CLIENT_ID:
+        # Fallback para o hardcoded se env falhar, para manter consistência com /install
+        CLIENT_ID = '4601797779457193'
+
+    # Tenta obter o secret de várias formas para garantir
+    CLIENT_SECRET = os.getenv('CLIENT_SECRET')
+    if not CLIENT_SECRET:
+        CLIENT_SECRET = os.getenv('ML_CLIENT_SECRET')
+
+    return CLIENT_ID, CLIENT_SECRET
+
+def obter_pergunta_ml(resource_url, token, seller_id=None):
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json()
+        return ml.obter_pergunta(resource_url, token, seller_id=seller_id)
     except Exception as e:
         print(f"Erro ao obter pergunta: {e}")
         return None
 
-def obter_item_ml(item_id, token):
-    url = f"https://api.mercadolibre.com/items/{item_id}"
-    headers = {'Authorization': f'Bearer {token}'}
-    
+def obter_item_ml(item_id, token, seller_id=None):
+    chave = (seller_id, item_id)
+    item_info = item_cache.get(chave)
+    if item_info is not None:
+        ORIGEM_ITEM.inc(source='memory')
+        return item_info
+
+    item_info = item_do_estoque(item_id, token, seller_id)
+    if item_info is not None:
+        item_cache.set(chave, item_info)
+        return item_info
+
+    ORIGEM_ITEM.inc(source='api')
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return {
-            'title': data.get('title'),
-            'price': data.get('price'),
-            'currency_id': data.get('currency_id'),
-            'permalink': data.get('permalink')
-        }
+        data = ml.obter_item(item_id, token, seller_id=seller_id)
     except Exception as e:
         print(f"Erro ao obter item: {e}")
         return None
+    descricao = obter_descricao_ml(item_id, token, seller_id=seller_id)
+    item_info = _resumir_item(data, descricao)
+    item_cache.set(chave, item_info)
+    return item_info
+
+def obter_descricao_ml(item_id, token, seller_id=None):
+    # Opcional: sem descrição (404) ou com erro, o contexto sai só com o item
+    try:
+        return ml.obter_descricao(item_id, token, seller_id=seller_id).get('plain_text')
+    except Exception as e:
+        print(f"Sem descrição para {item_id}: {e}")
+        return None
+
+def item_do_estoque(item_id, token, seller_id=None):
+    # Anúncio já carregado pelo prefetch; a descrição vem do ML na primeira
+    # pergunta e fica guardada junto. None: não está no estoque, segue pela API.
+    if not ITEM_PREFETCH:
+        return None
+    if not has_app_context():
+        # Fora de request/worker (simulador_interno, scripts): contexto só para a consulta
+        with app.app_context():
+            return item_do_estoque(item_id, token, seller_id)
+    try:
+        salvo = estoque_itens.obter(seller_id, item_id)
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao ler o item {item_id} do estoque local: {e}")
+        return None
+    if salvo is None:
+        return None
+    data, descricao, descricao_buscada = salvo
+    if not descricao_buscada:
+        try:
+            descricao = ml.obter_descricao(item_id, token, seller_id=seller_id).get('plain_text')
+        except MLApiError as e:
+            # 404: o anúncio não tem descrição (guarda isso); outro erro: tenta na próxima
+            descricao_buscada = e.status_code == 404
+            print(f"Sem descrição para {item_id}: {e}")
+        except Exception as e:
+            print(f"Sem descrição para {item_id}: {e}")
+        else:
+            descricao_buscada = True
+        if descricao_buscada:
+            try:
+                estoque_itens.guardar_descricao(item_id, descricao)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Erro ao guardar a descrição de {item_id}: {e}")
+    ORIGEM_ITEM.inc(source='store')
+    return _resumir_item(data, descricao)
 
-def enviar_resposta_ml(question_id, texto_resposta, token):
-    url = "https://api.mercadolibre.com/answers"
-    headers = {'Authorization': f'Bearer {token}'}
-    payload = {
-        'question_id': question_id,
-        'text': texto_resposta
+def _resumir_item(data, descricao=None):
+    contexto, tokens = contexto_item.montar(data, descricao)
+    return {
+        'title': data.get('title'),
+        'price': data.get('price'),
+        'currency_id': data.get('currency_id'),
+        'permalink': data.get('permalink'),
+        'context': contexto,
+        'context_tokens': tokens,
+        # Campos das respostas por template (intencoes.py)
+        'available_quantity': data.get('available_quantity'),
+        'free_shipping': (data.get('shipping') or {}).get('free_shipping'),
+        'condition': data.get('condition'),
+        'warranty': data.get('warranty')
     }
-    
+
+def invalidar_item(item_id, seller_id=None):
+    if seller_id is not None:
+        return int(item_cache.invalidate((seller_id, item_id)))
+    return item_cache.invalidate_where(lambda chave: chave[1] == item_id)
+
+def enviar_resposta_ml(question_id, texto_resposta, token, seller_id=None):
     try:
         print(f"Enviando resposta para {question_id}...")
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
+        ml.enviar_resposta(question_id, texto_resposta, token, seller_id=seller_id)
         print("Resposta enviada com sucesso!")
         return True
     except Exception as e:
         print(f"Erro ao enviar resposta: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Detalhes do erro: {e.response.text}")
+        if isinstance(e, MLApiError) and e.body:
+            print(f"Detalhes do erro: {e.body}")
         return False
 
-def gerar_resposta_ia(pergunta_texto, item_info):
+def _mensagens_ia(pergunta_texto, item_info):
+    contexto_produto = item_info.get('context') or f"Produto: {item_info['title']}\nPreço: {item_info['currency_id']} {item_info['price']}"
+    prompt_sistema = (
+        "Você é um vendedor prestativo. Responda a pergunta sobre o produto de forma curta e persuasiva em PT-BR, "
+        "usando os dados do produto abaixo."
+    )
+    prompt_usuario = f"{contexto_produto}\n\nPergunta do cliente: {pergunta_texto}"
+    return [
+        {"role": "system", "content": prompt_sistema},
+        {"role": "user", "content": prompt_usuario}
+    ]
+
+def _contar_tokens(response, mensagens):
+    # Uso informado pela OpenAI; sem ele (mocks, proxies), a estimativa local
+    uso = getattr(response, 'usage', None)
+    prompt = getattr(uso, 'prompt_tokens', None)
+    if not isinstance(prompt, int):
+        prompt = sum(estimar_tokens(m['content']) for m in mensagens)
+    PROMPT_TOKENS.observe(prompt)
+    OPENAI_TOKENS.inc(prompt, kind='prompt')
+    completion = getattr(uso, 'completion_tokens', None)
+    if isinstance(completion, int):
+        OPENAI_TOKENS.inc(completion, kind='completion')
+
+def _chamar_openai(mensagens, timeout, modelo=None):
+    response = cliente_openai().chat.completions.create(
+        model=modelo or OPENAI_MODEL,
+        messages=mensagens,
+        timeout=timeout
+    )
+    _contar_tokens(response, mensagens)
+    return response.choices[0].message.content
+
+async def _chamar_openai_async(mensagens, timeout, modelo=None):
+    response = await cliente_openai_async().chat.completions.create(
+        model=modelo or OPENAI_MODEL,
+        messages=mensagens,
+        timeout=timeout
+    )
+    _contar_tokens(response, mensagens)
+    return response.choices[0].message.content
+
+# Roteamento antes da IA (intencoes.py): perguntas respondíveis com os dados do
+# item (estoque, preço, frete grátis, condição, garantia) recebem um template;
+# as outras vão para OPENAI_MODEL ou, se configurado, as longas/técnicas para
+# OPENAI_MODEL_STRONG.
+OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+roteador = Roteador(
+    ClassificadorIntencoes(),
+    modelo_rapido=OPENAI_MODEL,
+    modelo_forte=os.getenv('OPENAI_MODEL_STRONG') or None,
+    templates=os.getenv('INTENT_TEMPLATES', '1') == '1',
+    palavras_forte=int(os.getenv('ROUTE_STRONG_MIN_WORDS', '25'))
+)
+
+def _config_hedge(valor):
+    # OPENAI_HEDGE_AFTER: "p95" (percentil das tentativas recentes; 5 s até haver
+    # amostras), "8" (segundos fixos) ou "off"
+    valor = valor.strip().lower()
+    if valor in ('', 'off', '0'):
+        return None, None
+    if valor.startswith('p'):
+        return float(os.getenv('OPENAI_HEDGE_INITIAL', '5')), float(valor[1:])
+    return float(valor), None
+
+# Geração com prazo total, hedge na cauda e circuit breaker. Em falha a pergunta
+# é adiada (GeracaoIndisponivel) em vez de receber um texto genérico.
+_hedge_apos, _hedge_percentil = _config_hedge(os.getenv('OPENAI_HEDGE_AFTER', 'p95'))
+gerador = Gerador(
+    _chamar_openai, _chamar_openai_async,
+    deadline=float(os.getenv('OPENAI_DEADLINE', '20')),
+    hedge_apos=_hedge_apos,
+    hedge_percentil=_hedge_percentil,
+    breaker=CircuitBreaker(
+        falhas=int(os.getenv('OPENAI_BREAKER_FAILURES', '5')),
+        pausa=float(os.getenv('OPENAI_BREAKER_COOLDOWN', '30'))
+    ),
+    max_paralelo=int(os.getenv('OPENAI_MAX_PARALLEL', '32'))
+)
+
+def gerar_resposta_ia(pergunta_texto, item_info, modelo=None):
+    try:
+        return gerador.gerar(_mensagens_ia(pergunta_texto, item_info), modelo)
+    except GeracaoIndisponivel as e:
+        print(f"Erro na IA: {e}")
+        OPENAI_ERROS.inc(error=e.motivo)
+        raise
+
+# --- Pipeline de Perguntas ---
+
+# Contadores por vendedor somados em memória e gravados em lote na tenant_stats
+estatisticas_tenants = EstatisticasTenants(app, db, TenantStats)
+gravacao_estatisticas = TarefaPeriodica(
+    'tenant-stats-flush',
+    float(os.getenv('TENANT_STATS_FLUSH_INTERVAL', '15')),
+    estatisticas_tenants.gravar
+)
+
+historico = HistoryWriter(
+    app, db, QuestionHistory,
+    max_buffer=int(os.getenv('HISTORY_BUFFER_MAX', '10000')),
+    batch_size=int(os.getenv('HISTORY_BATCH_SIZE', '500')),
+    flush_interval=float(os.getenv('HISTORY_FLUSH_INTERVAL', '2')),
+    put_timeout=float(os.getenv('HISTORY_PUT_TIMEOUT', '0.5')),
+    ao_descartar=lambda quantidade, motivo: HISTORICO_DESCARTES.inc(quantidade, reason=motivo)
+)
+
+@contextmanager
+def medir_estagio(registro, estagio):
+    # Histograma do estágio + tempo guardado no registro do histórico
+    inicio = time.perf_counter()
     try:
-        contexto_produto = f"Produto: {item_info['title']}\nPreço: {item_info['currency_id']} {item_info['price']}"
-        prompt_sistema = "Você é um vendedor prestativo. Responda a pergunta sobre o produto de forma curta e persuasiva em PT-BR."
-        prompt_usuario = f"{contexto_produto}\n\nPergunta do cliente: {pergunta_texto}"
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        ESTAGIOS.observe(duracao, stage=estagio)
+        registro[f"{estagio}_ms"] = round(duracao * 1000, 1)
+
+def _processar_notificacao(user_id, resource, registro):
+    print(f"\n--- Notificação para User {user_id} ---")
+    
+    # Buscar usuário (cache em memória na frente do banco)
+    with medir_estagio(registro, 'tenant_lookup'):
+        user = obter_tenant(user_id)
+    
+    if not user:
+        print(f"Ignorando: Token não encontrado para o usuário {user_id}")
+        return {'status': 'ignored', 'reason': 'user_not_found'}
+    
+    # --- REGRA DE NEGÓCIO: Verificar se está ativo ---
+    if not user.is_active:
+        print(f"Ignorando: Usuário {user_id} está INATIVO.")
+        return {'status': 'ignored', 'reason': 'user_inactive'}
         
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": prompt_sistema},
-                {"role": "user", "content": prompt_usuario}
-            ]
-        )
-        return response.choices[0].message.content
+    token = user.access_token
+    
+    # 1. Buscar pergunta
+    with medir_estagio(registro, 'question_fetch'):
+        pergunta = obter_pergunta_ml(resource, token, seller_id=user_id)
+    if not pergunta:
+        return {'status': 'error', 'reason': 'question_fetch_failed'}
+
+    return _responder_pergunta(user_id, token, pergunta, registro)
+
+def _verificar_pergunta(user_id, pergunta, registro):
+    registro['question_id'] = pergunta.get('id')
+    registro['item_id'] = pergunta.get('item_id')
+    registro['question_text'] = pergunta.get('text')
+    status = pergunta.get('status')
+    from_id = pergunta.get('from', {}).get('id')
+
+    print(f"Pergunta: '{pergunta.get('text')}' | Status: {status}")
+
+    if status != 'UNANSWERED':
+        print("Ignorando: Não está pendente.")
+        return {'status': 'ignored', 'reason': 'not_pending'}
+
+    if str(from_id) == str(user_id):
+        print("Ignorando: Auto-pergunta.")
+        return {'status': 'ignored', 'reason': 'self_question'}
+
+    return None
+
+def _registrar_geracao(item_id, text, item_info, resposta_ia, registro):
+    answer_cache.registrar_geracao(registro['generate_ms'] / 1000)
+    answer_cache.guardar(item_id, text, item_info, resposta_ia)
+    registro['answer_source'] = 'ai'
+    print(f"Resposta IA: {resposta_ia}")
+
+def _resposta_sem_ia(item_id, text, item_info, registro):
+    # Template pela intenção ou resposta de uma pergunta igual/parecida no mesmo
+    # item; (decisão, None) quando precisa gerar
+    decisao = roteador.decidir(text, item_info)
+    if decisao.rota == 'template':
+        print(f"Resposta (template {decisao.intencao}): {decisao.resposta}")
+        registro['answer_source'] = 'template'
+        return decisao, decisao.resposta
+    resposta = answer_cache.buscar(item_id, text, item_info)
+    if resposta is not None:
+        print(f"Resposta (cache): {resposta}")
+        registro['answer_source'] = 'cache'
+    return decisao, resposta
+
+def _resposta_por_regra(compilado, text, registro):
+    # Resposta automática do vendedor por palavra-chave; None se nenhuma regra casar
+    inicio = time.perf_counter()
+    regra = regras_automaticas.responder(compilado, text)
+    if regra is None:
+        return None
+    segundos = time.perf_counter() - inicio
+    print(f"Resposta (regra {regra.id}): {regra.resposta}")
+    registro['answer_source'] = 'rule'
+    registro['answer_text'] = regra.resposta
+    ROTAS.inc(route='rule', intent='')
+    ROTA_SEGUNDOS.observe(segundos, route='rule')
+    roteador.registrar('rule', segundos)
+    return regra.resposta
+
+def _registrar_rota(decisao, segundos, text, item_info, registro):
+    rota = registro.get('answer_source') if registro.get('answer_source') in ('template', 'cache') else decisao.rota
+    ROTAS.inc(route=rota, intent=decisao.intencao or '')
+    ROTA_SEGUNDOS.observe(segundos, route=rota)
+    evitados = 0
+    if rota == 'template':
+        evitados = sum(estimar_tokens(m['content']) for m in _mensagens_ia(text, item_info))
+    roteador.registrar(rota, segundos, evitados)
+
+def _responder_pergunta(user_id, token, pergunta, registro):
+    question_id = pergunta.get('id')
+    text = pergunta.get('text')
+    item_id = pergunta.get('item_id')
+    
+    # 2. Verificações
+    ignorada = _verificar_pergunta(user_id, pergunta, registro)
+    if ignorada:
+        return ignorada
+
+    # 3. Regra do vendedor: responde sem buscar o item nem chamar a IA
+    if AUTO_REPLY_RULES:
+        resposta_regra = _resposta_por_regra(regras_automaticas.compilado(user_id), text, registro)
+        if resposta_regra is not None:
+            return _publicar_resposta(question_id, resposta_regra, token, user_id, registro)
+
+    # 4. Buscar Item
+    with medir_estagio(registro, 'item_fetch'):
+        item_info = obter_item_ml(item_id, token, seller_id=user_id)
+    if not item_info:
+        return {'status': 'error', 'reason': 'item_fetch_failed'}
+        
+    # 5. Template, cache de respostas ou IA (modelo rápido ou forte)
+    inicio_rota = time.perf_counter()
+    decisao, resposta_ia = _resposta_sem_ia(item_id, text, item_info, registro)
+    if resposta_ia is None:
+        try:
+            with medir_estagio(registro, 'generate'):
+                resposta_ia = gerar_resposta_ia(text, item_info, decisao.modelo)
+        except GeracaoIndisponivel:
+            # Nada é publicado: a pergunta é adiada e tentada de novo
+            return {'status': 'error', 'reason': 'generation_unavailable'}
+        _registrar_geracao(item_id, text, item_info, resposta_ia, registro)
+    _registrar_rota(decisao, time.perf_counter() - inicio_rota, text, item_info, registro)
+    registro['answer_text'] = resposta_ia
+    return _publicar_resposta(question_id, resposta_ia, token, user_id, registro)
+
+def _publicar_resposta(question_id, resposta, token, user_id, registro):
+    if ANSWER_OUTBOX:
+        try:
+            with medir_estagio(registro, 'answer_enqueue'):
+                enfileirada = outbox.enfileirar(user_id, question_id, resposta)
+        except Exception as e:
+            # Sem banco para a outbox: tenta o envio direto, como antes
+            db.session.rollback()
+            print(f"Erro ao gravar resposta na outbox: {e}")
+        else:
+            return _resultado_outbox(question_id, enfileirada)
+
+    with medir_estagio(registro, 'answer_post'):
+        enviado = enviar_resposta_ml(question_id, resposta, token, seller_id=user_id)
+    if not enviado:
+        return {'status': 'error', 'reason': 'answer_post_failed'}
+
+    return {'status': 'ok'}
+
+def _novo_registro(resource):
+    registro = {'resource': resource}
+    # Tempo na fila do pool (escalonador por vendedor), quando veio de lá
+    espera = espera_na_fila()
+    if espera is not None:
+        ESTAGIOS.observe(espera, stage='queue_wait')
+        registro['queue_wait_ms'] = round(espera * 1000, 1)
+    return registro
+
+def _medir_pipeline(fn, user_id, *args, resource=None):
+    registro = _novo_registro(resource)
+    inicio = time.perf_counter()
+    resultado = fn(user_id, *args, registro)
+    historico.registrar(_registrar_resultado(user_id, resultado, time.perf_counter() - inicio, registro))
+    return resultado
+
+def _registrar_resultado(user_id, resultado, duracao, registro):
+    # Métricas e contadores do vendedor; devolve a linha do histórico
+    ESTAGIOS.observe(duracao, stage='total')
+    NOTIFICACOES.inc(status=resultado.get('status'), reason=resultado.get('reason', ''))
+    estatisticas_tenants.registrar(user_id, resultado.get('status'), duracao)
+    return registro | {
+        'user_id': user_id,
+        'status': resultado.get('status'),
+        'reason': resultado.get('reason'),
+        'total_ms': round(duracao * 1000, 1),
+        'created_at': datetime.utcnow()
+    }
+
+def processar_notificacao(user_id, resource):
+    return _medir_pipeline(_processar_notificacao, user_id, resource, resource=resource)
+
+def processar_pergunta(user_id, token, pergunta):
+    # Entrada para quem já tem a pergunta em mãos (ex.: varredura via /questions/search)
+    return _medir_pipeline(_responder_pergunta, user_id, token, pergunta, resource=f"/questions/{pergunta.get('id')}")
+
+idempotencia = IdempotencyIndex(
+    app, db, IdempotencyKey,
+    in_flight_ttl=int(os.getenv('IDEMPOTENCY_IN_FLIGHT_TTL', '900')),
+    done_ttl=int(os.getenv('IDEMPOTENCY_DONE_TTL', str(7 * 86400))),
+    cache_size=int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '20000'))
+)
+
+def chaves_idempotencia(resource, notification_id=None):
+    chaves = [f"q:{resource}"]
+    if notification_id:
+        chaves.append(f"n:{notification_id}")
+    return chaves
+
+# Geração indisponível (OpenAI fora/lenta): a pergunta volta para o pool depois
+# de cada atraso de GENERATION_RETRY_DELAYS, com a chave de idempotência ainda
+# reservada. Esgotadas as tentativas, a chave é liberada e a varredura pega.
+GENERATION_RETRY_DELAYS = [float(s) for s in os.getenv('GENERATION_RETRY_DELAYS', '30,120,600').split(',') if s.strip()]
+adiamentos = Adiamentos('generation-retry', max_pendentes=int(os.getenv('GENERATION_RETRY_MAX_PENDING', '10000')))
+
+def _reenfileirar(user_id, resource, notification_id, tentativa):
+    if PIPELINE_MODE == 'async':
+        aceita = async_pool.submit(executar_notificacao_async, user_id, resource, notification_id, tentativa, tenant=user_id)
+    else:
+        aceita = pool.submit(executar_notificacao, user_id, resource, notification_id, tentativa, tenant=user_id)
+    if not aceita:
+        print(f"Fila cheia: desistindo da nova tentativa de {resource}")
+        idempotencia.liberar(chaves_idempotencia(resource, notification_id))
+
+def adiar_notificacao(user_id, resource, notification_id, tentativa):
+    if tentativa >= len(GENERATION_RETRY_DELAYS):
+        return False
+    atraso = GENERATION_RETRY_DELAYS[tentativa] * random.uniform(0.8, 1.2)
+    if not adiamentos.agendar(atraso, _reenfileirar, user_id, resource, notification_id, tentativa + 1):
+        return False
+    print(f"Geração indisponível: {resource} adiada por {atraso:.0f}s (tentativa {tentativa + 1})")
+    return True
+
+def executar_notificacao(user_id, resource, notification_id=None, tentativa=0):
+    # Roda numa thread do pool, fora do request: precisa do próprio app context
+    with app.app_context():
+        resultado = processar_notificacao(user_id, resource)
+        chaves = chaves_idempotencia(resource, notification_id)
+        if resultado.get('reason') == 'generation_unavailable' and adiar_notificacao(user_id, resource, notification_id, tentativa):
+            return resultado
+        if resultado.get('status') == 'error':
+            # Falhou: libera para que a reentrega do ML possa tentar de novo
+            idempotencia.liberar(chaves)
+        else:
+            idempotencia.concluir(chaves)
+        return resultado
+
+def executar_job(job):
+    # Handler da fila durável: em caso de erro o próprio job é re-tentado,
+    # então as chaves continuam 'in_flight' (bloqueando reentregas) até ele
+    # concluir ou ir para a dead-letter (descartar_job)
+    resultado = processar_notificacao(job['user_id'], job['resource'])
+    if resultado.get('status') != 'error':
+        idempotencia.concluir(chaves_idempotencia(job['resource'], job.get('notification_id')))
+    return resultado
+
+def descartar_job(job):
+    # Tentativas esgotadas: libera as chaves para a reentrega do ML (ou a varredura)
+    idempotencia.liberar(chaves_idempotencia(job['resource'], job.get('notification_id')))
+
+# --- Pipeline assíncrono ---
+# PIPELINE_MODE=async: o mesmo fluxo como corrotinas num event loop por processo
+# (ML via httpx, OpenAI via AsyncOpenAI), com até ASYNC_MAX_IN_FLIGHT perguntas
+# em andamento. O que toca o banco (tenant fora do cache, idempotência) roda em
+# threads com app context. Vale para QUEUE_BACKEND=memory; a fila durável
+# continua no pool de threads.
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'sync')
+
+ml_async = AsyncMercadoLivreClient(ml, max_connections=int(os.getenv('ML_ASYNC_MAX_CONNECTIONS', '200')))
+_client_async = None
+
+def cliente_openai_async():
+    # Criado dentro do event loop (e depois do fork do gunicorn)
+    global _client_async
+    if _client_async is None:
+        from openai import AsyncOpenAI
+        _client_async = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return _client_async
+
+async def _fechar_clientes_async():
+    await ml_async.aclose()
+    if _client_async is not None:
+        await _client_async.close()
+
+# Acima de ASYNC_MAX_IN_FLIGHT as perguntas esperam na fila por vendedor
+# (até ASYNC_QUEUE_MAX), com ASYNC_TENANT_MAX_IN_FLIGHT por vendedor
+async_pool = AsyncPool(
+    max_in_flight=int(os.getenv('ASYNC_MAX_IN_FLIGHT', '500')),
+    name='perguntas-async',
+    ao_parar=_fechar_clientes_async,
+    escalonador=escalonador_tenants(
+        int(os.getenv('ASYNC_QUEUE_MAX', '1000')),
+        int(os.getenv('ASYNC_TENANT_MAX_IN_FLIGHT', '0'))
+    )
+)
+
+def _com_app_context(fn, *args):
+    with app.app_context():
+        return fn(*args)
+
+async def obter_tenant_async(user_id):
+    tenant = tenant_cache.get(user_id)
+    if tenant is not None:
+        return None if tenant is TENANT_INEXISTENTE else tenant
+    return await asyncio.to_thread(_com_app_context, obter_tenant, user_id)
+
+async def obter_pergunta_ml_async(resource_url, token, seller_id=None):
+    try:
+        return await ml_async.obter_pergunta(resource_url, token, seller_id=seller_id)
     except Exception as e:
+        print(f"Erro ao obter pergunta: {e}")
+        return None
+
+async def obter_item_ml_async(item_id, token, seller_id=None):
+    chave = (seller_id, item_id)
+    item_info = item_cache.get(chave)
+    if item_info is not None:
+        ORIGEM_ITEM.inc(source='memory')
+        return item_info
+
+    if ITEM_PREFETCH:
+        item_info = await asyncio.to_thread(_com_app_context, item_do_estoque, item_id, token, seller_id)
+        if item_info is not None:
+            item_cache.set(chave, item_info)
+            return item_info
+
+    ORIGEM_ITEM.inc(source='api')
+
+    # Item e descrição em paralelo
+    data, descricao = await asyncio.gather(
+        ml_async.obter_item(item_id, token, seller_id=seller_id),
+        ml_async.obter_descricao(item_id, token, seller_id=seller_id),
+        return_exceptions=True
+    )
+    if isinstance(data, BaseException):
+        print(f"Erro ao obter item: {data}")
+        return None
+    if isinstance(descricao, BaseException):
+        print(f"Sem descrição para {item_id}: {descricao}")
+        descricao = None
+    else:
+        descricao = descricao.get('plain_text')
+    item_info = _resumir_item(data, descricao)
+    item_cache.set(chave, item_info)
+    return item_info
+
+async def enviar_resposta_ml_async(question_id, texto_resposta, token, seller_id=None):
+    try:
+        await ml_async.enviar_resposta(question_id, texto_resposta, token, seller_id=seller_id)
+        print(f"Resposta enviada com sucesso para {question_id}!")
+        return True
+    except Exception as e:
+        print(f"Erro ao enviar resposta: {e}")
+        if isinstance(e, MLApiError) and e.body:
+            print(f"Detalhes do erro: {e.body}")
+        return False
+
+async def gerar_resposta_ia_async(pergunta_texto, item_info, modelo=None):
+    try:
+        return await gerador.gerar_async(_mensagens_ia(pergunta_texto, item_info), modelo)
+    except GeracaoIndisponivel as e:
         print(f"Erro na IA: {e}")
-        return "Olá! Em breve responderemos sua pergunta."
+        OPENAI_ERROS.inc(error=e.motivo)
+        raise
+
+async def _processar_notificacao_async(user_id, resource, registro):
+    with medir_estagio(registro, 'tenant_lookup'):
+        user = await obter_tenant_async(user_id)
+
+    if not user:
+        print(f"Ignorando: Token não encontrado para o usuário {user_id}")
+        return {'status': 'ignored', 'reason': 'user_not_found'}
+    if not user.is_active:
+        print(f"Ignorando: Usuário {user_id} está INATIVO.")
+        return {'status': 'ignored', 'reason': 'user_inactive'}
+
+    token = user.access_token
+    with medir_estagio(registro, 'question_fetch'):
+        pergunta = await obter_pergunta_ml_async(resource, token, seller_id=user_id)
+    if not pergunta:
+        return {'status': 'error', 'reason': 'question_fetch_failed'}
+
+    return await _responder_pergunta_async(user_id, token, pergunta, registro)
+
+async def _responder_pergunta_async(user_id, token, pergunta, registro):
+    question_id = pergunta.get('id')
+    text = pergunta.get('text')
+    item_id = pergunta.get('item_id')
+
+    ignorada = _verificar_pergunta(user_id, pergunta, registro)
+    if ignorada:
+        return ignorada
+
+    if AUTO_REPLY_RULES:
+        compilado = regras_automaticas.em_cache(user_id)
+        if compilado is None:
+            compilado = await asyncio.to_thread(_com_app_context, regras_automaticas.compilado, user_id)
+        resposta_regra = _resposta_por_regra(compilado, text, registro)
+        if resposta_regra is not None:
+            return await _publicar_resposta_async(question_id, resposta_regra, token, user_id, registro)
+
+    with medir_estagio(registro, 'item_fetch'):
+        item_info = await obter_item_ml_async(item_id, token, seller_id=user_id)
+    if not item_info:
+        return {'status': 'error', 'reason': 'item_fetch_failed'}
+
+    inicio_rota = time.perf_counter()
+    decisao, resposta_ia = _resposta_sem_ia(item_id, text, item_info, registro)
+    if resposta_ia is None:
+        try:
+            with medir_estagio(registro, 'generate'):
+                resposta_ia = await gerar_resposta_ia_async(text, item_info, decisao.modelo)
+        except GeracaoIndisponivel:
+            return {'status': 'error', 'reason': 'generation_unavailable'}
+        _registrar_geracao(item_id, text, item_info, resposta_ia, registro)
+    _registrar_rota(decisao, time.perf_counter() - inicio_rota, text, item_info, registro)
+    registro['answer_text'] = resposta_ia
+    return await _publicar_resposta_async(question_id, resposta_ia, token, user_id, registro)
+
+async def _publicar_resposta_async(question_id, resposta, token, user_id, registro):
+    if ANSWER_OUTBOX:
+        try:
+            with medir_estagio(registro, 'answer_enqueue'):
+                enfileirada = await asyncio.to_thread(_com_app_context, outbox.enfileirar, user_id, question_id, resposta)
+        except Exception as e:
+            print(f"Erro ao gravar resposta na outbox: {e}")
+        else:
+            return _resultado_outbox(question_id, enfileirada)
+
+    with medir_estagio(registro, 'answer_post'):
+        enviado = await enviar_resposta_ml_async(question_id, resposta, token, seller_id=user_id)
+    if not enviado:
+        return {'status': 'error', 'reason': 'answer_post_failed'}
+
+    return {'status': 'ok'}
+
+async def executar_notificacao_async(user_id, resource, notification_id=None, tentativa=0):
+    registro = _novo_registro(resource)
+    inicio = time.perf_counter()
+    resultado = await _processar_notificacao_async(user_id, resource, registro)
+    await historico.registrar_async(_registrar_resultado(user_id, resultado, time.perf_counter() - inicio, registro))
+
+    if resultado.get('reason') == 'generation_unavailable' and adiar_notificacao(user_id, resource, notification_id, tentativa):
+        return resultado
+    chaves = chaves_idempotencia(resource, notification_id)
+    finalizar = idempotencia.liberar if resultado.get('status') == 'error' else idempotencia.concluir
+    await asyncio.to_thread(_com_app_context, finalizar, chaves)
+    return resultado
+
+# Renovação de tokens: em lote antes de expirar (tarefa periódica) e, no caminho
+# do request, uma renovação única após 401 (agrupada entre requisições concorrentes)
+token_refresher = TokenRefresher(
+    app, db, User, ml, credenciais_app,
+    ao_renovar=invalidar_tenant,
+    janela=int(os.getenv('TOKEN_REFRESH_WINDOW', '1800')),
+    concorrencia=int(os.getenv('TOKEN_REFRESH_CONCURRENCY', '4')),
+    lote=int(os.getenv('TOKEN_REFRESH_BATCH', '200'))
+)
+ml.on_unauthorized = token_refresher.renovar_apos_401
+gravacao_metricas = TarefaPeriodica('metrics-flush', METRICS_FLUSH_INTERVAL, metricas.gravar)
+
+@metricas.coletor
+def _coletar_gauges():
+    estado = metricas.gauge('bot_pool', 'Estado do pool de processamento', ['field'])
+    for campo, valor in pool.stats().items():
+        estado.set(valor, field=campo)
+    if PIPELINE_MODE == 'async':
+        estado_async = metricas.gauge('bot_async_pool', 'Estado do pipeline assíncrono', ['field'])
+        for campo, valor in async_pool.stats().items():
+            estado_async.set(valor, field=campo)
+    caches = metricas.gauge('bot_cache', 'Estatísticas dos caches em memória', ['cache', 'field'])
+    for nome, cache in (('items', item_cache), ('tenants', tenant_cache), ('idempotency', idempotencia)):
+        for campo, valor in cache.stats().items():
+            caches.set(valor, cache=nome, field=campo)
+    for campo, valor in answer_cache.stats().items():
+        caches.set(valor, cache='answers', field=campo)
+    for campo, valor in regras_automaticas.stats().items():
+        if valor is not None:
+            caches.set(valor, cache='auto_reply_rules', field=campo)
+    geracao = gerador.stats()
+    estado_geracao = metricas.gauge('bot_generation', 'Geração de respostas (OpenAI): contadores, breaker e latência', ['field'])
+    for campo, valor in geracao.items():
+        if isinstance(valor, (int, float)):
+            estado_geracao.set(valor, field=campo)
+    estado_geracao.set(['closed', 'half_open', 'open'].index(geracao['breaker']['state']), field='breaker_state')
+    for campo in ('p50', 'p95', 'p99'):
+        if geracao['latency_ms'][campo] is not None:
+            estado_geracao.set(geracao['latency_ms'][campo], field=f'latency_{campo}_ms')
+    for campo, valor in adiamentos.stats().items():
+        estado_geracao.set(valor, field=f'deferred_{campo}')
+    if ANSWER_OUTBOX:
+        despacho = despachante.stats()
+        estado_despacho = metricas.gauge('bot_answer_dispatch', 'Despacho de respostas da outbox: limite AIMD, envios e profundidade', ['field'])
+        for campo, valor in despacho.items():
+            if isinstance(valor, (int, float)):
+                estado_despacho.set(valor, field=campo)
+        for campo, valor in despacho['outbox'].items():
+            estado_despacho.set(valor, field=f'outbox_{campo}')
+    estado_historico = metricas.gauge('bot_history', 'Gravação em lote do histórico de perguntas', ['field'])
+    for campo, valor in historico.stats().items():
+        estado_historico.set(valor, field=campo)
+
+renovacao_tokens = TarefaPeriodica(
+    'token-refresh',
+    float(os.getenv('TOKEN_REFRESH_INTERVAL', '300')),
+    token_refresher.renovar_expirando
+)
+TOKEN_REFRESH_ENABLED = os.getenv('TOKEN_REFRESH_ENABLED', '1') == '1'
+
+job_queue = JobQueue(app, db, Job, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS)
+# Jobs done/dead ficam JOB_RETENTION_DAYS dias para consulta no painel e depois são apagados
+job_runner = JobRunner(
+    job_queue, pool, executar_job,
+    ao_descartar=descartar_job,
+    retencao_dias=float(os.getenv('JOB_RETENTION_DAYS', '7')),
+    purge_interval=float(os.getenv('JOB_PURGE_INTERVAL', '3600'))
+)
+
+# --- Outbox de respostas ---
+# ANSWER_OUTBOX=1: a resposta pronta é gravada na tabela answer_outbox e um
+# despachante por processo a publica no ML. O número de envios simultâneos
+# se ajusta sozinho (AIMD entre ANSWER_DISPATCH_MIN/MAX_CONCURRENCY), 429 com
+# Retry-After pausa o despacho, e falhas voltam para a outbox com backoff em
+# vez de jogar fora a resposta (e o que foi gasto na OpenAI).
+ANSWER_OUTBOX = os.getenv('ANSWER_OUTBOX', '1') == '1'
+
+outbox = OutboxRespostas(
+    app, db, AnswerOutbox,
+    lease_seconds=int(os.getenv('ANSWER_OUTBOX_LEASE_SECONDS', '60')),
+    max_attempts=int(os.getenv('ANSWER_OUTBOX_MAX_ATTEMPTS', '10')),
+    max_age_seconds=int(os.getenv('ANSWER_OUTBOX_MAX_AGE_SECONDS', '86400'))
+)
+
+def _enviar_da_outbox(linha):
+    # Token do cache de tenants: pega o renovado se mudou desde a geração
+    tenant = obter_tenant(linha['user_id'])
+    if not tenant or not tenant.is_active:
+        raise EnvioDescartado(f"vendedor {linha['user_id']} sem token ou inativo")
+    ml.enviar_resposta(linha['question_id'], linha['answer'], tenant.access_token, seller_id=linha['user_id'], retries=0)
+    ENTREGA_SEGUNDOS.observe((datetime.utcnow() - linha['created_at']).total_seconds())
+    print(f"Resposta enviada com sucesso para {linha['question_id']}! (outbox, tentativa {linha['attempts']})")
+
+def _resposta_ja_publicada(linha):
+    # Depois de um envio incerto: a pergunta já aparece respondida no ML?
+    tenant = obter_tenant(linha['user_id'])
+    if not tenant or not tenant.is_active:
+        raise EnvioDescartado(f"vendedor {linha['user_id']} sem token ou inativo")
+    pergunta = ml.obter_pergunta(f"/questions/{linha['question_id']}", tenant.access_token, seller_id=linha['user_id'])
+    return pergunta.get('status') == 'ANSWERED'
+
+despachante = Despachante(
+    outbox, _enviar_da_outbox,
+    ControleAIMD(
+        inicial=int(os.getenv('ANSWER_DISPATCH_CONCURRENCY', '4')),
+        minimo=int(os.getenv('ANSWER_DISPATCH_MIN_CONCURRENCY', '1')),
+        maximo=int(os.getenv('ANSWER_DISPATCH_MAX_CONCURRENCY', '16'))
+    ),
+    poll_interval=float(os.getenv('ANSWER_DISPATCH_POLL_INTERVAL', '1')),
+    backoff_max=float(os.getenv('ANSWER_DISPATCH_BACKOFF_MAX', '300')),
+    conferir=_resposta_ja_publicada
+)
+
+# --- Prefetch de anúncios ---
+# ITEM_PREFETCH=1: os anúncios ativos de cada vendedor são carregados em lote
+# (multiget, 20 por chamada) na tabela item_snapshots logo após a instalação
+# e a cada ITEM_PREFETCH_INTERVAL segundos. Nas execuções seguintes só entram
+# no multiget os anúncios novos, os que o tópico items tirou do estoque e os
+# conferidos há mais de ITEM_PREFETCH_REVALIDATE segundos. A primeira pergunta
+# de um anúncio já não paga o /items/{id}.
+ITEM_PREFETCH = os.getenv('ITEM_PREFETCH', '1') == '1'
+
+estoque_itens = EstoqueItens(app, db, ItemSnapshot)
+
+def _token_para_prefetch(user_id):
+    tenant = obter_tenant(user_id)
+    return tenant.access_token if tenant and tenant.is_active else None
+
+prefetch_anuncios = PrefetchAnuncios(
+    app, db, ItemPrefetchState, User, estoque_itens, ml,
+    obter_token=_token_para_prefetch,
+    ao_alterar=lambda item_id, seller_id: invalidar_item(item_id, seller_id=seller_id),
+    intervalo=float(os.getenv('ITEM_PREFETCH_INTERVAL', '21600')),
+    revalidar=float(os.getenv('ITEM_PREFETCH_REVALIDATE', '86400')),
+    concorrencia=int(os.getenv('ITEM_PREFETCH_CONCURRENCY', '4')),
+    vendedores_por_vez=int(os.getenv('ITEM_PREFETCH_SELLERS', '2')),
+    poll_interval=float(os.getenv('ITEM_PREFETCH_POLL_INTERVAL', '60'))
+)
+
+def _resultado_outbox(question_id, enfileirada):
+    if not enfileirada:
+        print(f"Ignorando: resposta da pergunta {question_id} já está na outbox.")
+        return {'status': 'ignored', 'reason': 'answer_already_queued'}
+    print(f"Resposta da pergunta {question_id} gravada na outbox.")
+    despachante.acordar()
+    return {'status': 'ok'}
+
+@atexit.register
+def desligar():
+    # Um prazo só para o desligamento inteiro (WORKER_DRAIN_TIMEOUT): o gunicorn
+    # mata o worker em graceful_timeout (30s), e cada etapa usa o que sobrou.
+    prazo = time.monotonic() + WORKER_DRAIN_TIMEOUT
+
+    def restante():
+        return max(0.0, prazo - time.monotonic())
+
+    # Antes dos drenos lentos: o que já está em memória não se perde se o worker for morto
+    prefetch_anuncios.stop()
+    estatisticas_tenants.gravar()
+    historico.flush(restante())
+    if gravador_webhooks:
+        gravador_webhooks.flush()
+
+    async_pool.shutdown(restante())
+    pool.shutdown(restante())
+    # O que não sair agora continua na outbox para o próximo processo
+    despachante.stop(restante())
+
+    # Agregados produzidos durante o dreno (o flush é rápido: um INSERT por lote)
+    estatisticas_tenants.gravar()
+    historico.flush(max(1.0, restante()))
+
+# Captura opcional dos webhooks para replay de carga (replay.py):
+# WEBHOOK_RECORD_PATH=capturas/webhooks.jsonl
+WEBHOOK_RECORD_PATH = os.getenv('WEBHOOK_RECORD_PATH')
+gravador_webhooks = GravadorWebhooks(WEBHOOK_RECORD_PATH) if WEBHOOK_RECORD_PATH else None
+
+@app.before_request
+def marcar_inicio():
+    g.inicio_request = time.perf_counter()
+
+@app.after_request
+def registrar_tempo_webhook(response):
+    if request.endpoint == 'notifications' and 'inicio_request' in g:
+        topic = g.get('topic') or 'unknown'
+        WEBHOOK_SEGUNDOS.observe(time.perf_counter() - g.inicio_request, topic=topic)
+        WEBHOOKS.inc(topic=topic, outcome=g.get('outcome') or response.status_code)
+    return response
+
+@app.before_request
+def iniciar_background():
+    # Sobe as threads de background uma vez por processo (após o fork do gunicorn)
+    aquecer_openai()
+    invalidador.start()
+    gravacao_metricas.start()
+    gravacao_estatisticas.start()
+    if TOKEN_REFRESH_ENABLED:
+        renovacao_tokens.start()
+    if QUEUE_BACKEND == 'database' and EMBEDDED_JOB_RUNNER:
+        job_runner.start()
+    if ANSWER_OUTBOX:
+        despachante.start()
+    if ITEM_PREFETCH:
+        prefetch_anuncios.start()
 
 # --- Rotas ---
 
@@ -212,45 +1416,21 @@ def callback():
     if not code:
         return "Erro: Código não fornecido.", 400
     
-    # Robustez nas Variáveis
-    CLIENT_ID = os.getenv('CLIENT_ID')
-    if not CLIENT_ID:
-        CLIENT_ID = os.getenv('APP_ID')
-    
-    if not CLIENT_ID:
-        # Fallback para o hardcoded se env falhar, para manter consistência com /install
-        CLIENT_ID = '4601797779457193'
-
-    # Tenta obter o secret de várias formas para garantir
-    CLIENT_SECRET = os.getenv('CLIENT_SECRET')
-    if not CLIENT_SECRET:
-        CLIENT_SECRET = os.getenv('ML_CLIENT_SECRET')
+    CLIENT_ID, CLIENT_SECRET = credenciais_app()
 
     redirect_uri = 'https://bot-mercadolivre.onrender.com/callback'
 
     # Debug Logs
     print(f"Tentando login com Client ID: {CLIENT_ID} e Redirect: {redirect_uri}")
     
-    # Trocar code por token
-    url = "https://api.mercadolibre.com/oauth/token"
-    
-    # Payload Explícito
-    data = {
-        'grant_type': 'authorization_code',
-        'client_id': CLIENT_ID,
-        'client_secret': CLIENT_SECRET,
-        'code': code,
-        'redirect_uri': redirect_uri
-    }
-    
     try:
-        response = requests.post(url, data=data)
-        response.raise_for_status()
-        response_data = response.json()
+        # Trocar code por token
+        response_data = ml.trocar_code(CLIENT_ID, CLIENT_SECRET, code, redirect_uri)
         
         access_token = response_data.get('access_token')
         refresh_token = response_data.get('refresh_token')
         user_id = response_data.get('user_id')
+        expires_in = int(response_data.get('expires_in') or 21600)
         
         # Salvar usando SQLAlchemy
         # Salvar usando SQLAlchemy com merge (Upsert)
@@ -260,81 +1440,134 @@ def callback():
             user_id=user_id,
             access_token=access_token,
             refresh_token=refresh_token,
-            is_active=True
+            is_active=True,
+            expires_at=datetime.utcnow() + timedelta(seconds=expires_in)
         )
         
         db.session.merge(user)
         db.session.commit()
+        invalidar_tenant(user_id)
+        if ITEM_PREFETCH:
+            # Anúncios carregados antes da primeira pergunta
+            prefetch_anuncios.agendar(user_id)
         
         return f"Instalação concluída com sucesso! User ID: {user_id}"
     except Exception as e:
         db.session.rollback() # Importante fazer rollback em caso de erro no banco
         print(f"Erro no callback: {e}")
-        if 'response' in locals() and response is not None:
-             print(f"Response Body: {response.text}")
+        if isinstance(e, MLApiError) and e.body:
+             print(f"Response Body: {e.body}")
         # Retorna o erro real para facilitar o debug
         return f"Erro interno ao processar callback: {str(e)}", 500
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    dados = {
+        'pool': pool.stats(),
+        'pipeline_mode': PIPELINE_MODE,
+        'queue_backend': QUEUE_BACKEND,
+        'ml_api': ml_latencias.snapshot(),
+        'item_cache': item_cache.stats(),
+        'tenant_cache': tenant_cache.stats(),
+        'idempotency': idempotencia.stats(),
+        'answer_cache': answer_cache.stats(),
+        'item_context': contexto_item.stats(),
+        'routing': roteador.stats(),
+        'auto_reply_rules': regras_automaticas.stats(),
+        'token_refresh': token_refresher.stats(),
+        'tenant_stats': estatisticas_tenants.stats(),
+        'history': historico.stats(),
+        'webhook_recorder': gravador_webhooks.stats() if gravador_webhooks else None,
+        'generation': gerador.stats(),
+        'generation_retry': adiamentos.stats(),
+        'answer_dispatch': despachante.stats() if ANSWER_OUTBOX else None
+    }
+    if ANSWER_OUTBOX:
+        dados['answer_dispatch']['outbox'] = outbox.estado()
+    if ITEM_PREFETCH:
+        dados['item_prefetch'] = prefetch_anuncios.stats() | {'store': estoque_itens.stats()}
+    if QUEUE_BACKEND == 'database':
+        dados['jobs'] = job_queue.stats()
+    if PIPELINE_MODE == 'async':
+        dados['async_pool'] = async_pool.stats()
+        dados['scheduler'] = async_pool.stats_tenants()
+    else:
+        dados['scheduler'] = pool.stats_tenants()
+    return jsonify(dados), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return metricas.exportar(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def resposta_webhook(payload, codigo):
+    # Guarda o resultado para as métricas do after_request
+    g.outcome = payload.get('reason') or payload.get('status')
+    return jsonify(payload), codigo
+
 @app.route('/notifications', methods=['POST'])
 def notifications():
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return resposta_webhook({'status': 'error', 'reason': 'invalid_payload'}, 400)
+    if gravador_webhooks:
+        gravador_webhooks.registrar(data)
+
     topic = data.get('topic')
     user_id = data.get('user_id')
+    resource = data.get('resource')
+    g.topic = topic
+
+    # user_id chega como número ou string dependendo do remetente: normaliza
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return resposta_webhook({'status': 'ignored', 'reason': 'invalid_payload'}, 200)
     
     if topic == 'questions':
-        print(f"\n--- Notificação para User {user_id} ---")
-        
-        # Buscar usuário no Banco (SQLAlchemy)
-        user = User.query.get(user_id)
-        
-        if not user:
-            print(f"Ignorando: Token não encontrado para o usuário {user_id}")
-            return jsonify({'status': 'ignored', 'reason': 'user_not_found'}), 200
-        
-        # --- REGRA DE NEGÓCIO: Verificar se está ativo ---
-        if not user.is_active:
-            print(f"Ignorando: Usuário {user_id} está INATIVO.")
-            return jsonify({'status': 'ignored', 'reason': 'user_inactive'}), 200
-            
-        token = user.access_token
-        resource = data.get('resource')
-        
-        # 1. Buscar pergunta
-        pergunta = obter_pergunta_ml(resource, token)
-        if not pergunta:
-            return jsonify({'status': 'error'}), 200
-            
-        question_id = pergunta.get('id')
-        status = pergunta.get('status')
-        text = pergunta.get('text')
-        item_id = pergunta.get('item_id')
-        from_id = pergunta.get('from', {}).get('id')
-        
-        print(f"Pergunta: '{text}' | Status: {status}")
-        
-        # 2. Verificações
-        if status != 'UNANSWERED':
-            print("Ignorando: Não está pendente.")
-            return jsonify({'status': 'ignored'}), 200
-            
-        if str(from_id) == str(user_id):
-            print("Ignorando: Auto-pergunta.")
-            return jsonify({'status': 'ignored'}), 200
-            
-        # 3. Buscar Item
-        item_info = obter_item_ml(item_id, token)
-        if not item_info:
-            return jsonify({'status': 'error'}), 200
-            
-        # 4. Gerar IA
-        resposta_ia = gerar_resposta_ia(text, item_info)
-        print(f"Resposta IA: {resposta_ia}")
-        
-        # 5. Enviar
-        enviar_resposta_ml(question_id, resposta_ia, token)
+        if not resource:
+            return resposta_webhook({'status': 'ignored', 'reason': 'invalid_payload'}, 200)
+
+        # Reentregas do ML (mesmo _id ou mesma pergunta) param aqui,
+        # antes de qualquer chamada ao ML ou à OpenAI
+        notification_id = data.get('_id')
+        chaves = chaves_idempotencia(resource, notification_id)
+        if not idempotencia.reservar(chaves):
+            return resposta_webhook({'status': 'ignored', 'reason': 'duplicate'}, 200)
+
+        # Só enfileira: o processamento (ML + IA) roda no pool em background
+        if QUEUE_BACKEND == 'database':
+            if not job_queue.enfileirar(user_id, topic, resource, notification_id):
+                return resposta_webhook({'status': 'ignored', 'reason': 'duplicate'}, 200)
+            return resposta_webhook({'status': 'queued'}, 200)
+
+        if PIPELINE_MODE == 'async':
+            aceita = async_pool.submit(executar_notificacao_async, user_id, resource, notification_id, tenant=user_id)
+        else:
+            aceita = pool.submit(executar_notificacao, user_id, resource, notification_id, tenant=user_id)
+        if not aceita:
+            print(f"Fila cheia: recusando notificação {resource} do usuário {user_id}")
+            idempotencia.liberar(chaves)
+            return resposta_webhook({'status': 'error', 'reason': 'overloaded'}, 503)
+
+        return resposta_webhook({'status': 'queued'}, 200)
+
+    if topic == 'items':
+        # Item alterado no ML: descarta o cache local (resource = /items/MLB123)
+        item_id = (resource or '').rstrip('/').split('/')[-1]
+        if item_id:
+            invalidar_item(item_id, seller_id=user_id)
+            if ITEM_PREFETCH:
+                # A cópia do prefetch também ficou velha: a próxima pergunta busca na API
+                try:
+                    estoque_itens.remover([item_id])
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Erro ao remover o item {item_id} do estoque local: {e}")
+        return resposta_webhook({'status': 'ok'}, 200)
         
-    return jsonify({'status': 'ok'}), 200
+    return resposta_webhook({'status': 'ok'}, 200)
 
 if __name__ == '__main__':
     init_db()
+    limpar_diretorio()
     app.run(port=5000)
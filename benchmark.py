@@ -0,0 +1,581 @@
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Benchmark ponta a ponta do /notifications com Mercado Livre e OpenAI falsos.
+#
+#   python benchmark.py --rate 50 --duration 30 --ml-latency lognormal:80,0.4 --openai-latency lognormal:900,0.5
+#
+# Sobe um ML falso (questions/items/answers/oauth) e uma OpenAI falsa com
+# latências configuráveis, sobe o app em processo apontando para eles e
+# dispara notificações numa taxa alvo (open-loop). No fim reporta vazão e
+# p50/p95/p99 por estágio e salva tudo em JSON para comparar entre commits.
+
+PERGUNTAS = [
+    'Tem pronta entrega?',
+    'Qual o tamanho?',
+    'Ainda tem disponível?',
+    'Qual o prazo de entrega para SP?',
+    'Serve para desenho técnico?',
+    'Aceita devolução se não servir?',
+    'Vem com nota fiscal?',
+    'Qual a cor exata?',
+]
+
+
+# --- Distribuições de latência ---
+
+def parse_latencia(spec):
+    """'fixed:50', 'uniform:20,80', 'normal:100,20', 'lognormal:150,0.5' (mediana, sigma). Em ms."""
+    if not spec or spec == '0':
+        return lambda: 0.0
+    tipo, _, params = spec.partition(':')
+    valores = [float(v) for v in params.split(',') if v]
+    if tipo == 'fixed':
+        return lambda: valores[0] / 1000
+    if tipo == 'uniform':
+        return lambda: random.uniform(valores[0], valores[1]) / 1000
+    if tipo == 'normal':
+        return lambda: max(0.0, random.gauss(valores[0], valores[1])) / 1000
+    if tipo == 'lognormal':
+        mu = math.log(valores[0])
+        return lambda: random.lognormvariate(mu, valores[1]) / 1000
+    raise ValueError(f"Distribuição de latência desconhecida: {spec}")
+
+
+def percentis(valores, ps=(50, 95, 99)):
+    if not valores:
+        return {f'p{p}': None for p in ps}
+    ordenados = sorted(valores)
+    resultado = {}
+    for p in ps:
+        # nearest-rank
+        idx = min(len(ordenados) - 1, max(0, math.ceil(p / 100 * len(ordenados)) - 1))
+        resultado[f'p{p}'] = round(ordenados[idx] * 1000, 2)
+    resultado['avg'] = round(sum(ordenados) / len(ordenados) * 1000, 2)
+    resultado['count'] = len(ordenados)
+    return resultado
+
+
+# --- Servidores falsos ---
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _ler_corpo(self):
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(tamanho) if tamanho else b''
+
+    def _enviar(self, status, obj, headers=None):
+        corpo = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        for nome, valor in (headers or {}).items():
+            self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+
+class ServidorFalso:
+    def __init__(self, handler, porta=0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', porta), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+
+class FakeMercadoLivre(ServidorFalso):
+    """ML falso. Registra a linha do tempo de cada pergunta (fetch e answer)."""
+
+    def __init__(self, latencia='fixed:50', itens=50, perguntas=None, unicas=False, taxa_erro=0.0, porta=0, backlog=0,
+                 limite_respostas=0, vendedores=1):
+        super().__init__(_HandlerML, porta)
+        # Vendedores 1000..1000+vendedores-1, como em subir_app/disparar: a pergunta
+        # `question_id` é do vendedor 1000 + question_id % vendedores
+        self.vendedores = max(1, vendedores)
+        self.backlog = backlog  # perguntas UNANSWERED por vendedor em /questions/search
+        # POST /answers por segundo antes de responder 429 com Retry-After (0 = sem limite)
+        self.limite_respostas = limite_respostas
+        self._janela_respostas = (0, 0)  # (segundo, contagem)
+        self.latencia = parse_latencia(latencia)
+        self.itens = itens
+        self.perguntas = perguntas or PERGUNTAS
+        self.unicas = unicas
+        self.taxa_erro = taxa_erro
+        self.lock = threading.Lock()
+        self.timeline = {}      # question_id -> {'question': (ini, fim), 'answer': (ini, fim)}
+        self.respostas = {}     # question_id -> texto
+        self.contagem = {}
+        self.versoes = {}       # item_id -> número de alterações (muda o last_updated)
+
+    def item_id(self, seller_id, n):
+        # Cada vendedor tem os próprios anúncios (no ML o id do item é global)
+        return f"MLB{seller_id}{n:05d}"
+
+    def pergunta(self, question_id, seller_id=None):
+        if seller_id is None:
+            seller_id = 1000 + question_id % self.vendedores
+        texto = self.perguntas[question_id % len(self.perguntas)]
+        if self.unicas:
+            texto = f"{texto} (ref {question_id})"
+        return {
+            'id': question_id,
+            'status': 'ANSWERED' if question_id in self.respostas else 'UNANSWERED',
+            'text': texto,
+            'item_id': self.item_id(seller_id, question_id % self.itens),
+            'seller_id': seller_id,
+            'from': {'id': 999000 + question_id % 97},
+        }
+
+    def busca(self, seller_id, offset, limit):
+        ids = [seller_id * 100000 + i for i in range(1, self.backlog + 1)]
+        with self.lock:
+            pendentes = [i for i in ids if i not in self.respostas]
+        pagina = pendentes[offset:offset + limit]
+        return {
+            'total': len(pendentes),
+            'limit': limit,
+            'questions': [self.pergunta(i, seller_id) for i in pagina],
+        }
+
+    def alterar_item(self, item_id):
+        with self.lock:
+            self.versoes[item_id] = self.versoes.get(item_id, 0) + 1
+
+    def anuncios(self, seller_id, scroll_id, limit):
+        # /users/{id}/items/search?search_type=scan: o scroll_id aqui é só o offset
+        offset = int(scroll_id or 0)
+        ids = [self.item_id(seller_id, i) for i in range(offset, min(offset + limit, self.itens))]
+        return {
+            'seller_id': seller_id,
+            'results': ids,
+            'scroll_id': str(offset + len(ids)) if ids else None,
+            'paging': {'total': self.itens, 'limit': limit},
+        }
+
+    def item(self, item_id):
+        versao = self.versoes.get(item_id, 0)
+        return {
+            'id': item_id,
+            'title': f"Produto de teste {item_id}",
+            'price': 99.9 + versao,
+            'status': 'active',
+            'last_updated': f"2024-01-01T00:00:{versao:02d}.000Z",
+            'currency_id': 'BRL',
+            'permalink': f"https://produto.mercadolivre.com.br/{item_id}",
+            'available_quantity': 10,
+            'condition': 'new',
+            'shipping': {'free_shipping': True},
+            'attributes': [
+                {'id': 'BRAND', 'name': 'Marca', 'value_name': 'Genérica'},
+                {'id': 'MODEL', 'name': 'Modelo', 'value_name': f"Modelo {item_id}"},
+                {'id': 'COLOR', 'name': 'Cor', 'value_name': 'Preto'},
+                {'id': 'SELLER_SKU', 'name': 'SKU', 'value_name': f"SKU-{item_id}"},
+            ],
+        }
+
+    def descricao(self, item_id):
+        texto = (f"{self.item(item_id)['title']} com acabamento resistente e envio imediato. "
+                 "Acompanha manual em português e nota fiscal. ") * 8
+        return {'text': '', 'plain_text': texto.strip()}
+
+    def registrar(self, question_id, estagio, inicio, fim):
+        with self.lock:
+            self.timeline.setdefault(question_id, {})[estagio] = (inicio, fim)
+
+    def contar(self, rota):
+        with self.lock:
+            self.contagem[rota] = self.contagem.get(rota, 0) + 1
+
+    def limitar_resposta(self):
+        # True se o POST /answers estourou o limite deste segundo
+        if not self.limite_respostas:
+            return False
+        segundo = int(time.time())
+        with self.lock:
+            inicio, contagem = self._janela_respostas
+            if inicio != segundo:
+                inicio, contagem = segundo, 0
+            self._janela_respostas = (inicio, contagem + 1)
+            return contagem >= self.limite_respostas
+
+
+class _HandlerML(_Handler):
+    def _fake(self):
+        return self.server.fake
+
+    def _atrasar(self):
+        fake = self._fake()
+        time.sleep(fake.latencia())
+        if fake.taxa_erro and random.random() < fake.taxa_erro:
+            self._enviar(503, {'message': 'service unavailable'})
+            return False
+        return True
+
+    def do_GET(self):
+        fake = self._fake()
+        inicio = time.time()
+        caminho = self.path.split('?', 1)[0]
+        partes = caminho.strip('/').split('/')
+        if not self._atrasar():
+            return
+        if caminho == '/questions/search':
+            params = parse_qs(urlparse(self.path).query)
+            fake.contar('questions_search')
+            self._enviar(200, fake.busca(
+                int(params['seller_id'][0]), int(params.get('offset', ['0'])[0]), int(params.get('limit', ['50'])[0])
+            ))
+        elif partes[0] == 'questions' and len(partes) == 2 and partes[1].isdigit():
+            question_id = int(partes[1])
+            fake.contar('questions')
+            self._enviar(200, fake.pergunta(question_id))
+            fake.registrar(question_id, 'question', inicio, time.time())
+        elif len(partes) == 4 and partes[0] == 'users' and partes[2:] == ['items', 'search']:
+            params = parse_qs(urlparse(self.path).query)
+            fake.contar('items_search')
+            self._enviar(200, fake.anuncios(
+                int(partes[1]), params.get('scroll_id', [None])[0], int(params.get('limit', ['50'])[0])
+            ))
+        elif caminho == '/items':
+            params = parse_qs(urlparse(self.path).query)
+            fake.contar('items_multiget')
+            ids = params.get('ids', [''])[0].split(',')
+            self._enviar(200, [{'code': 200, 'body': fake.item(i)} for i in ids if i])
+        elif partes[0] == 'items' and len(partes) == 3 and partes[2] == 'description':
+            fake.contar('items_description')
+            self._enviar(200, fake.descricao(partes[1]))
+        elif partes[0] == 'items' and len(partes) >= 2:
+            fake.contar('items')
+            self._enviar(200, fake.item(partes[1]))
+        else:
+            self._enviar(404, {'message': 'not found'})
+
+    def do_POST(self):
+        fake = self._fake()
+        inicio = time.time()
+        corpo = self._ler_corpo()
+        if not self._atrasar():
+            return
+        if self.path == '/answers' and fake.limitar_resposta():
+            fake.contar('answers_throttled')
+            self._enviar(429, {'message': 'too many requests'}, {'Retry-After': '1'})
+        elif self.path == '/answers':
+            dados = json.loads(corpo or b'{}')
+            question_id = int(dados.get('question_id') or 0)
+            with fake.lock:
+                fake.respostas[question_id] = dados.get('text')
+            fake.contar('answers')
+            self._enviar(200, {'question_id': question_id, 'status': 'ANSWERED'})
+            fake.registrar(question_id, 'answer', inicio, time.time())
+        elif self.path == '/oauth/token':
+            fake.contar('oauth')
+            self._enviar(200, {'access_token': 'bench-token', 'refresh_token': 'bench-refresh', 'expires_in': 21600})
+        else:
+            self._enviar(404, {'message': 'not found'})
+
+
+class FakeOpenAI(ServidorFalso):
+    """Endpoint /v1/chat/completions falso com latência configurável."""
+
+    def __init__(self, latencia='fixed:800', taxa_erro=0.0, porta=0):
+        super().__init__(_HandlerOpenAI, porta)
+        self.latencia = parse_latencia(latencia)
+        self.taxa_erro = taxa_erro
+        self.lock = threading.Lock()
+        self.chamadas = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}/v1"
+
+
+class _HandlerOpenAI(_Handler):
+    def do_POST(self):
+        fake = self.server.fake
+        corpo = json.loads(self._ler_corpo() or b'{}')
+        time.sleep(fake.latencia())
+        with fake.lock:
+            fake.chamadas += 1
+        if fake.taxa_erro and random.random() < fake.taxa_erro:
+            return self._enviar(500, {'error': {'message': 'fake upstream error', 'type': 'server_error'}})
+        if not self.path.endswith('/chat/completions'):
+            return self._enviar(404, {'error': {'message': 'not found'}})
+        prompt = ' '.join(m.get('content', '') for m in corpo.get('messages', []))
+        prompt_tokens = max(1, len(prompt) // 4)
+        self._enviar(200, {
+            'id': 'chatcmpl-bench',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': corpo.get('model', 'gpt-3.5-turbo'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': 'Olá! Sim, temos disponível para pronta entrega. Qualquer dúvida estamos à disposição.'},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 20, 'total_tokens': prompt_tokens + 20},
+        })
+
+
+# --- App em processo ---
+
+def preparar_ambiente(ml_url, openai_url, db_path, pipeline_mode=None):
+    # Precisa rodar antes do `import app` (a configuração é lida no import)
+    if pipeline_mode:
+        os.environ['PIPELINE_MODE'] = pipeline_mode
+    os.environ['DATABASE_URL'] = f"sqlite:///{db_path}"
+    os.environ['ML_API_URL'] = ml_url
+    os.environ['OPENAI_BASE_URL'] = openai_url
+    os.environ['OPENAI_API_KEY'] = 'bench'
+    os.environ.setdefault('ML_APP_RATE', '0')
+    os.environ.setdefault('ML_SELLER_RATE', '0')
+    os.environ.setdefault('TOKEN_REFRESH_ENABLED', '0')
+
+
+def subir_app(tenants, porta=0):
+    import logging
+    from werkzeug.serving import make_server
+    import app as bot
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with bot.app.app_context():
+        bot.init_db()
+        for i in range(tenants):
+            bot.db.session.merge(bot.User(
+                user_id=1000 + i,
+                access_token='bench-token',
+                refresh_token='bench-refresh',
+                is_active=True,
+                expires_at=datetime(2100, 1, 1)
+            ))
+        bot.db.session.commit()
+
+    servidor = make_server('127.0.0.1', porta, bot.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return bot, servidor, f"http://127.0.0.1:{servidor.server_port}"
+
+
+def commit_atual():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return 'unknown'
+
+
+# --- Driver de carga ---
+
+def disparar(app_url, rate, duracao, tenants, clientes, primeiro_id=1):
+    import requests
+
+    sessao = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=clientes)
+    sessao.mount('http://', adapter)
+
+    total = int(rate * duracao)
+    envios = {}
+    acks = []
+    erros = {}
+    lock = threading.Lock()
+
+    def enviar(question_id):
+        payload = {
+            '_id': f"bench-{question_id}",
+            'topic': 'questions',
+            'resource': f"/questions/{question_id}",
+            'user_id': 1000 + question_id % tenants,
+            'application_id': 4601797779457193,
+            'attempts': 1,
+            'sent': datetime.utcnow().isoformat() + 'Z',
+        }
+        inicio = time.time()
+        try:
+            resposta = sessao.post(f"{app_url}/notifications", json=payload, timeout=10)
+            chave = None if resposta.status_code == 200 else f"http_{resposta.status_code}"
+        except Exception as e:
+            chave = type(e).__name__
+        fim = time.time()
+        with lock:
+            envios[question_id] = inicio
+            acks.append(fim - inicio)
+            if chave:
+                erros[chave] = erros.get(chave, 0) + 1
+
+    inicio = time.time()
+    with ThreadPoolExecutor(max_workers=clientes) as executor:
+        for i in range(total):
+            # Open-loop: agenda pelo relógio, não espera a resposta anterior
+            alvo = inicio + i / rate
+            espera = alvo - time.time()
+            if espera > 0:
+                time.sleep(espera)
+            executor.submit(enviar, primeiro_id + i)
+    tempo_envio = time.time() - inicio
+    return envios, acks, erros, tempo_envio
+
+
+def aguardar_respostas(fake_ml, envios, timeout):
+    prazo = time.time() + timeout
+    while time.time() < prazo:
+        with fake_ml.lock:
+            faltando = sum(1 for q in envios if q not in fake_ml.respostas)
+        if not faltando:
+            return 0
+        time.sleep(0.1)
+    return faltando
+
+
+def calcular_estagios(fake_ml, envios):
+    # Deriva os estágios da linha do tempo vista pelo ML falso:
+    # fila = webhook -> fetch da pergunta; geração = fim do fetch -> início do POST /answers
+    estagios = {'queue_wait': [], 'question_fetch': [], 'generate': [], 'answer_post': [], 'end_to_end': []}
+    with fake_ml.lock:
+        timeline = dict(fake_ml.timeline)
+    for question_id, enviado in envios.items():
+        t = timeline.get(question_id, {})
+        if 'question' not in t or 'answer' not in t:
+            continue
+        q_ini, q_fim = t['question']
+        a_ini, a_fim = t['answer']
+        estagios['queue_wait'].append(max(0.0, q_ini - enviado))
+        estagios['question_fetch'].append(q_fim - q_ini)
+        estagios['generate'].append(max(0.0, a_ini - q_fim))
+        estagios['answer_post'].append(a_fim - a_ini)
+        estagios['end_to_end'].append(a_fim - enviado)
+    return {nome: percentis(valores) for nome, valores in estagios.items()}
+
+
+def comparar(resultado, arquivo_anterior):
+    with open(arquivo_anterior) as f:
+        anterior = json.load(f)
+    print(f"\nComparação com {arquivo_anterior} (commit {anterior.get('commit')}):")
+    for chave in ('throughput_answers_per_s',):
+        antes, depois = anterior['results'].get(chave), resultado['results'].get(chave)
+        if antes:
+            print(f"  {chave}: {antes} -> {depois} ({(depois - antes) / antes * 100:+.1f}%)")
+    for estagio, dados in resultado['results']['stages'].items():
+        antes = anterior['results'].get('stages', {}).get(estagio, {})
+        for p in ('p50', 'p95', 'p99'):
+            if antes.get(p) and dados.get(p) is not None:
+                print(f"  {estagio}.{p}: {antes[p]} -> {dados[p]} ms ({(dados[p] - antes[p]) / antes[p] * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ponta a ponta do /notifications')
+    parser.add_argument('--rate', type=float, default=20, help='notificações por segundo (alvo)')
+    parser.add_argument('--duration', type=float, default=15, help='duração do disparo em segundos')
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--items', type=int, default=50, help='itens distintos (afeta o cache de itens)')
+    parser.add_argument('--unique-questions', action='store_true', help='textos únicos (desliga o cache de respostas)')
+    parser.add_argument('--clients', type=int, default=32, help='conexões simultâneas do gerador de carga')
+    parser.add_argument('--ml-latency', default='lognormal:80,0.4')
+    parser.add_argument('--openai-latency', default='lognormal:900,0.5')
+    parser.add_argument('--ml-error-rate', type=float, default=0.0)
+    parser.add_argument('--ml-answers-rate', type=float, default=0, help='POST /answers por segundo antes do 429 (0 = sem limite)')
+    parser.add_argument('--openai-error-rate', type=float, default=0.0)
+    parser.add_argument('--drain-timeout', type=float, default=60, help='segundos para esperar as respostas após o disparo')
+    parser.add_argument('--output', help='arquivo JSON de saída (padrão: bench_results/<data>-<commit>.json)')
+    parser.add_argument('--pipeline-mode', choices=['sync', 'async'], help='PIPELINE_MODE do app (padrão: o do ambiente)')
+    parser.add_argument('--compare', help='JSON de uma execução anterior para comparar')
+    args = parser.parse_args()
+
+    fake_ml = FakeMercadoLivre(
+        args.ml_latency, itens=args.items, unicas=args.unique_questions, taxa_erro=args.ml_error_rate,
+        limite_respostas=args.ml_answers_rate, vendedores=args.tenants
+    ).start()
+    fake_openai = FakeOpenAI(args.openai_latency, taxa_erro=args.openai_error_rate).start()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db')
+    preparar_ambiente(fake_ml.url, fake_openai.url, db_path, args.pipeline_mode)
+    bot, servidor, app_url = subir_app(args.tenants)
+    print(f"App em {app_url} | ML falso em {fake_ml.url} | OpenAI falsa em {fake_openai.url}")
+
+    # O app é verboso (print por etapa); durante o disparo só o relatório interessa
+    stdout_original = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        envios, acks, erros, tempo_envio = disparar(app_url, args.rate, args.duration, args.tenants, args.clients)
+        inicio_espera = time.time()
+        faltando = aguardar_respostas(fake_ml, envios, args.drain_timeout)
+        tempo_total = tempo_envio + (time.time() - inicio_espera)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout_original
+
+    respondidas = len(envios) - faltando
+    resultado = {
+        'commit': commit_atual(),
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'config': vars(args) | {
+            'worker_concurrency': bot.WORKER_CONCURRENCY,
+            'queue_backend': bot.QUEUE_BACKEND,
+            'pipeline_mode': bot.PIPELINE_MODE,
+        },
+        'results': {
+            'sent': len(envios),
+            'answered': respondidas,
+            'unanswered': faltando,
+            'errors': erros,
+            'achieved_rate': round(len(envios) / tempo_envio, 2) if tempo_envio else 0,
+            'throughput_answers_per_s': round(respondidas / tempo_total, 2) if tempo_total else 0,
+            'ack': percentis(acks),
+            'stages': calcular_estagios(fake_ml, envios),
+            'ml_calls': dict(fake_ml.contagem),
+            'openai_calls': fake_openai.chamadas,
+        },
+    }
+
+    r = resultado['results']
+    print(f"\nEnviadas: {r['sent']} (taxa obtida {r['achieved_rate']}/s) | Respondidas: {r['answered']} | Sem resposta: {r['unanswered']}")
+    print(f"Vazão: {r['throughput_answers_per_s']} respostas/s | Erros: {r['errors'] or 'nenhum'}")
+    print(f"Chamadas ML: {r['ml_calls']} | Chamadas OpenAI: {r['openai_calls']}")
+    print(f"\n{'estágio':<16}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for nome, dados in [('ack', r['ack'])] + list(r['stages'].items()):
+        print(f"{nome:<16}{dados['p50'] or '-':>10}{dados['p95'] or '-':>10}{dados['p99'] or '-':>10}")
+
+    saida = args.output
+    if not saida:
+        os.makedirs('bench_results', exist_ok=True)
+        saida = os.path.join('bench_results', f"{datetime.utcnow():%Y%m%d-%H%M%S}-{resultado['commit']}.json")
+    with open(saida, 'w') as f:
+        json.dump(resultado, f, indent=2)
+    print(f"\nResultado salvo em {saida}")
+
+    if args.compare:
+        comparar(resultado, args.compare)
+
+    bot.pool.shutdown(5)
+    bot.async_pool.shutdown(5)
+    servidor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Cache em memória com TTL por entrada e expulsão LRU ao atingir maxsize.
+
+    Thread-safe. Mantém contadores de hit/miss/evictions para a rota /stats.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, name='cache'):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self.name = name
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entrada = self._dados.get(key)
+            if entrada is None:
+                self.misses += 1
+                return default
+            valor, expira = entrada
+            if expira is not None and expira <= time.monotonic():
+                del self._dados[key]
+                self.misses += 1
+                return default
+            self._dados.move_to_end(key)
+            self.hits += 1
+            return valor
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expira = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._dados[key] = (value, expira)
+            self._dados.move_to_end(key)
+            while len(self._dados) > self.maxsize:
+                self._dados.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._dados.pop(key, None) is not None:
+                self.invalidations += 1
+                return True
+            return False
+
+    def invalidate_where(self, predicado):
+        with self._lock:
+            chaves = [k for k in self._dados if predicado(k)]
+            for k in chaves:
+                del self._dados[k]
+            self.invalidations += len(chaves)
+            return len(chaves)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+
+    def values(self):
+        # Snapshot das entradas ainda válidas (não conta como hit/miss)
+        agora = time.monotonic()
+        with self._lock:
+            return [valor for valor, expira in self._dados.values() if expira is None or expira > agora]
+
+    def __len__(self):
+        return len(self._dados)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._dados),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
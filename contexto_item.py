@@ -0,0 +1,125 @@
+import re
+import threading
+
+# Atributos que não ajudam a responder o comprador (só ocupam tokens)
+ATRIBUTOS_IGNORADOS = {'SELLER_SKU', 'ITEM_CONDITION', 'GTIN', 'EAN', 'MPN', 'PACKAGE_DATA_SOURCE'}
+
+CONDICOES = {'new': 'Novo', 'used': 'Usado', 'refurbished': 'Recondicionado'}
+
+
+def estimar_tokens(texto):
+    # ~4 caracteres por token (tokenizer da OpenAI em PT-BR): basta para orçamento
+    return (len(texto) + 3) // 4
+
+
+def _limpar(texto):
+    return re.sub(r'\s+', ' ', texto or '').strip()
+
+
+def _cortar(texto, tokens):
+    # Corta no limite de palavra para caber em `tokens`
+    limite = tokens * 4
+    if len(texto) <= limite:
+        return texto
+    corte = texto[:max(0, limite - 1)].rsplit(' ', 1)[0].rstrip(' ,.;:')
+    return f"{corte}…" if corte else ''
+
+
+class ContextoItem:
+    """Monta o trecho de contexto do produto usado no prompt da IA.
+
+    Junta título, preço, condição, estoque, frete, atributos e descrição em
+    poucas linhas, na ordem do que mais ajuda a responder, e para quando o
+    orçamento de tokens acaba (a descrição fica com o que sobrar). É montado
+    uma vez por item e guardado junto com ele no cache de itens.
+    """
+
+    def __init__(self, orcamento=250, max_atributos=15, min_descricao=30):
+        self.orcamento = orcamento
+        self.max_atributos = max_atributos
+        self.min_descricao = min_descricao
+        self._lock = threading.Lock()
+        self.montados = 0
+        self.truncados = 0
+        self.tokens_total = 0
+
+    def _linhas_basicas(self, item):
+        linhas = [
+            f"Produto: {_limpar(item.get('title'))}",
+            f"Preço: {item.get('currency_id')} {item.get('price')}",
+        ]
+        condicao = CONDICOES.get(item.get('condition'))
+        if condicao:
+            linhas.append(f"Condição: {condicao}")
+        estoque = item.get('available_quantity')
+        if estoque is not None:
+            linhas.append(f"Estoque: {estoque} unidade(s)" if estoque > 0 else "Estoque: esgotado")
+        frete = []
+        shipping = item.get('shipping') or {}
+        if shipping.get('free_shipping'):
+            frete.append('grátis')
+        if shipping.get('logistic_type') == 'fulfillment':
+            frete.append('Full')
+        if shipping.get('local_pick_up'):
+            frete.append('retirada no local')
+        if frete:
+            linhas.append(f"Frete: {', '.join(frete)}")
+        if item.get('warranty'):
+            linhas.append(f"Garantia: {_limpar(item['warranty'])}")
+        return linhas
+
+    def _atributos(self, item):
+        pares = []
+        for attr in item.get('attributes') or []:
+            valor = _limpar(attr.get('value_name'))
+            if not valor or attr.get('id') in ATRIBUTOS_IGNORADOS:
+                continue
+            pares.append(f"{_limpar(attr.get('name'))}: {valor}")
+            if len(pares) >= self.max_atributos:
+                break
+        return pares
+
+    def montar(self, item, descricao=None):
+        # Retorna (texto, tokens estimados)
+        linhas = self._linhas_basicas(item)
+        usados = estimar_tokens('\n'.join(linhas))
+        truncado = False
+
+        atributos = []
+        for par in self._atributos(item):
+            custo = estimar_tokens(par) + 1
+            if usados + custo > self.orcamento:
+                truncado = True
+                break
+            atributos.append(par)
+            usados += custo
+        if atributos:
+            linhas.append(f"Características: {'; '.join(atributos)}")
+            usados += 4
+
+        descricao = _limpar(descricao)
+        if descricao:
+            restante = self.orcamento - usados - 2
+            if restante >= self.min_descricao:
+                trecho = _cortar(descricao, restante)
+                truncado = truncado or trecho != descricao
+                linhas.append(f"Descrição: {trecho}")
+            else:
+                truncado = True
+
+        texto = '\n'.join(linhas)
+        tokens = estimar_tokens(texto)
+        with self._lock:
+            self.montados += 1
+            self.truncados += int(truncado)
+            self.tokens_total += tokens
+        return texto, tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                'budget_tokens': self.orcamento,
+                'built': self.montados,
+                'truncated': self.truncados,
+                'avg_tokens': round(self.tokens_total / self.montados, 1) if self.montados else None,
+            }
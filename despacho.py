@@ -0,0 +1,426 @@
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from geracao import JanelaLatencias
+
+# Status do ML que indicam sobrecarga: além de re-tentar, reduzem a concorrência
+STATUS_SOBRECARGA = {429, 500, 502, 503, 504}
+
+
+def agora():
+    return datetime.utcnow()
+
+
+class EnvioDescartado(Exception):
+    """Falha definitiva (ex.: vendedor sem token): a resposta vai para a dead-letter."""
+
+
+class OutboxRespostas:
+    """Respostas prontas aguardando envio ao ML, na tabela `answer_outbox`.
+
+    Mesma mecânica da JobQueue: cada linha é reivindicada com lease
+    (locked_until), com FOR UPDATE SKIP LOCKED no PostgreSQL, então vários
+    processos/nós drenam a mesma outbox. Enviada, a linha é apagada (o texto
+    fica no question_history); esgotadas as tentativas, fica como 'dead'.
+    429 não gasta tentativa, então o limite para quem só recebe rate limit é
+    a idade: com mais de `max_age_seconds` a resposta também vai para 'dead'.
+    """
+
+    def __init__(self, app, db, model, lease_seconds=60, max_attempts=10, max_age_seconds=86400):
+        self.app = app
+        self.db = db
+        self.Outbox = model
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_age_seconds = max_age_seconds
+
+    def _limite_idade(self, now):
+        return now - timedelta(seconds=self.max_age_seconds)
+
+    def _skip_locked(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def enfileirar(self, user_id, question_id, texto):
+        # False se a pergunta já tem uma resposta na outbox (pending/sending)
+        try:
+            self.db.session.add(self.Outbox(
+                user_id=user_id,
+                question_id=question_id,
+                answer=texto,
+                status='pending',
+                max_attempts=self.max_attempts,
+                next_attempt_at=agora()
+            ))
+            self.db.session.commit()
+            return True
+        except IntegrityError:
+            self.db.session.rollback()
+            return False
+
+    def reivindicar(self, limite, worker_id):
+        Outbox = self.Outbox
+        now = agora()
+        session = self.db.session
+
+        session.execute(
+            update(Outbox)
+            .where(Outbox.status == 'sending', Outbox.locked_until < now, Outbox.attempts >= Outbox.max_attempts)
+            .values(status='dead', last_error='lease expirado', locked_by=None, locked_until=None, updated_at=now)
+        )
+        session.execute(
+            update(Outbox)
+            .where(Outbox.status == 'pending', Outbox.created_at < self._limite_idade(now))
+            .values(status='dead', last_error='expirada na outbox', updated_at=now)
+        )
+
+        disponivel = and_(
+            Outbox.attempts < Outbox.max_attempts,
+            Outbox.created_at >= self._limite_idade(now),
+            or_(
+                and_(Outbox.status == 'pending', Outbox.next_attempt_at <= now),
+                and_(Outbox.status == 'sending', Outbox.locked_until < now),
+            )
+        )
+        candidatos = select(Outbox.id).where(disponivel).order_by(Outbox.next_attempt_at).limit(limite)
+        if self._skip_locked():
+            candidatos = candidatos.with_for_update(skip_locked=True)
+
+        stmt = (
+            update(Outbox)
+            .where(Outbox.id.in_(candidatos.scalar_subquery()), disponivel)
+            .values(
+                status='sending',
+                locked_by=worker_id,
+                locked_until=now + timedelta(seconds=self.lease_seconds),
+                attempts=Outbox.attempts + 1,
+                updated_at=now
+            )
+            .returning(Outbox.id, Outbox.user_id, Outbox.question_id, Outbox.answer, Outbox.attempts,
+                       Outbox.last_status, Outbox.created_at)
+            .execution_options(synchronize_session=False)
+        )
+        linhas = [dict(row._mapping) for row in session.execute(stmt)]
+        session.commit()
+        return linhas
+
+    def concluir(self, outbox_id):
+        self.db.session.execute(delete(self.Outbox).where(self.Outbox.id == outbox_id))
+        self.db.session.commit()
+
+    def reagendar(self, outbox_id, atraso, erro, status_code=None, gastar_tentativa=True):
+        # Volta para 'pending' daqui a `atraso` segundos, ou 'dead' sem tentativas restantes.
+        # gastar_tentativa=False (rate limit): a resposta não tem culpa, não conta tentativa.
+        linha = self.db.session.get(self.Outbox, outbox_id)
+        if not linha:
+            return None
+        now = agora()
+        if not gastar_tentativa:
+            linha.attempts -= 1
+        linha.last_error = str(erro)[:1000]
+        linha.last_status = status_code
+        linha.locked_by = None
+        linha.locked_until = None
+        linha.updated_at = now
+        if linha.attempts >= linha.max_attempts:
+            linha.status = 'dead'
+            print(f"Resposta da pergunta {linha.question_id} movida para dead-letter após {linha.attempts} tentativas: {erro}")
+        elif now + timedelta(seconds=atraso) > linha.created_at + timedelta(seconds=self.max_age_seconds):
+            # A próxima tentativa já cairia depois do prazo da resposta
+            linha.status = 'dead'
+            print(f"Resposta da pergunta {linha.question_id} movida para dead-letter: expirou na outbox ({erro})")
+        else:
+            linha.status = 'pending'
+            linha.next_attempt_at = now + timedelta(seconds=atraso)
+        status = linha.status
+        self.db.session.commit()
+        return status
+
+    def descartar(self, outbox_id, erro, status_code=None):
+        now = agora()
+        self.db.session.execute(
+            update(self.Outbox)
+            .where(self.Outbox.id == outbox_id)
+            .values(status='dead', last_error=str(erro)[:1000], last_status=status_code,
+                    locked_by=None, locked_until=None, updated_at=now)
+        )
+        self.db.session.commit()
+
+    def estado(self):
+        # Profundidade por status e idade da resposta mais antiga ainda não enviada
+        Outbox = self.Outbox
+        session = self.db.session
+        contagem = {status: total for status, total in session.execute(
+            select(Outbox.status, func.count()).group_by(Outbox.status)
+        ).all()}
+        mais_antiga = session.execute(
+            select(func.min(Outbox.created_at)).where(Outbox.status.in_(('pending', 'sending')))
+        ).scalar()
+        return {
+            'pending': contagem.get('pending', 0),
+            'sending': contagem.get('sending', 0),
+            'dead': contagem.get('dead', 0),
+            'oldest_age_s': round((agora() - mais_antiga).total_seconds(), 1) if mais_antiga else 0.0,
+        }
+
+
+class ControleAIMD:
+    """Limite de envios simultâneos com aumento aditivo e redução multiplicativa.
+
+    Cada sucesso soma 1/limite (≈ +1 por "volta" de envios); um sinal de
+    sobrecarga (429/5xx/timeout) multiplica o limite por `fator`, no máximo
+    uma vez por `intervalo` segundos: os envios que já estavam em voo quando o
+    ML começou a recusar não derrubam o limite de uma vez.
+    """
+
+    def __init__(self, inicial=4, minimo=1, maximo=32, fator=0.5, intervalo=1.0):
+        self.minimo = max(1, int(minimo))
+        self.maximo = max(self.minimo, int(maximo))
+        self.limite = float(min(max(inicial, self.minimo), self.maximo))
+        self.fator = fator
+        self.intervalo = intervalo
+        self._ultima_reducao = 0.0
+        self._lock = threading.Lock()
+        self.reducoes = 0
+
+    @property
+    def capacidade(self):
+        return int(self.limite)
+
+    def sucesso(self):
+        with self._lock:
+            self.limite = min(self.maximo, self.limite + 1 / self.limite)
+
+    def sobrecarga(self):
+        with self._lock:
+            agora_ = time.monotonic()
+            if agora_ - self._ultima_reducao < self.intervalo:
+                return False
+            self._ultima_reducao = agora_
+            self.limite = max(self.minimo, self.limite * self.fator)
+            self.reducoes += 1
+            return True
+
+
+class Despachante:
+    """Thread que drena a outbox e publica as respostas no ML.
+
+    Reivindica só o que cabe no limite AIMD menos o que já está em voo e envia
+    num pool de threads. `enviar(linha)` faz o POST (sem retries do cliente:
+    quem decide é o despachante) e levanta MLApiError/EnvioDescartado. Em 429
+    com Retry-After todo o despacho do processo pausa por esse tempo; 429/5xx
+    e falhas de rede reduzem o limite e a linha volta depois do Retry-After
+    (ou com backoff, sem ele). 429 não gasta tentativa. Outros 4xx vão direto
+    para a dead-letter.
+
+    POST não é idempotente: depois de um 5xx, timeout ou lease vencido o ML
+    pode ter aceitado a resposta. Antes de reenviar uma linha assim,
+    `conferir(linha)` consulta a pergunta; já respondida, a linha é concluída
+    sem novo POST.
+    """
+
+    def __init__(self, outbox, enviar, controle, poll_interval=1.0, backoff_base=2.0, backoff_max=300.0,
+                 intervalo_estado=10.0, conferir=None):
+        self.outbox = outbox
+        self.enviar = enviar
+        self.conferir = conferir
+        self.controle = controle
+        self.poll_interval = poll_interval
+        self.intervalo_estado = intervalo_estado
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._pid = None
+        self._thread = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._parando = threading.Event()
+        self._acordar = threading.Event()
+        self._em_voo = 0
+        self._pausa_ate = 0.0
+        self._estado = {}
+        self._estado_em = 0.0
+        self.idades = JanelaLatencias()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.sent = 0
+        self.confirmed = 0
+        self.retried = 0
+        self.dead = 0
+        self.throttled = 0
+        self.server_errors = 0
+        self.network_errors = 0
+        self.claim_errors = 0
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+            self._em_voo = 0
+            self._parando.clear()
+            self._executor = ThreadPoolExecutor(max_workers=self.controle.maximo, thread_name_prefix='answer-dispatch')
+            self._thread = threading.Thread(target=self._loop, name='answer-dispatcher', daemon=True)
+            self._thread.start()
+
+    def acordar(self):
+        # Resposta nova na outbox: reivindica já, sem esperar o poll
+        if self._pid != os.getpid():
+            self.start()
+        self._acordar.set()
+
+    def stop(self, timeout=10):
+        # Para de reivindicar e espera os envios em voo; o resto fica na outbox
+        self._parando.set()
+        self._acordar.set()
+        if self._thread and self._pid == os.getpid():
+            prazo = time.monotonic() + timeout
+            self._thread.join(timeout)
+            while self._em_voo and time.monotonic() < prazo:
+                time.sleep(0.05)
+            # Envio ainda em voo no prazo: a linha volta pelo lease no próximo processo
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _backoff(self, tentativa):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** tentativa))
+
+    def _atualizar_estado(self):
+        # Profundidade/idade da outbox para as métricas, sem consultar o banco a cada coleta
+        if time.monotonic() - self._estado_em < self.intervalo_estado:
+            return
+        self._estado_em = time.monotonic()
+        try:
+            with self.outbox.app.app_context():
+                self._estado = self.outbox.estado()
+        except Exception as e:
+            print(f"Erro ao consultar o estado da outbox: {e}")
+
+    def _loop(self):
+        while not self._parando.is_set():
+            self._atualizar_estado()
+            pausa = self._pausa_ate - time.monotonic()
+            if pausa > 0:
+                self._parando.wait(pausa)
+                continue
+            self._acordar.clear()
+            with self._lock:
+                livre = self.controle.capacidade - self._em_voo
+            reivindicadas = 0
+            if livre > 0:
+                try:
+                    with self.outbox.app.app_context():
+                        linhas = self.outbox.reivindicar(livre, self.worker_id)
+                except Exception as e:
+                    print(f"Erro ao reivindicar respostas da outbox: {e}")
+                    with self._lock:
+                        self.claim_errors += 1
+                    linhas = []
+                reivindicadas = len(linhas)
+                for linha in linhas:
+                    with self._lock:
+                        self._em_voo += 1
+                    self._executor.submit(self._enviar, linha)
+            # Lote cheio: provavelmente há mais. Senão espera o poll, uma
+            # resposta nova ou um envio terminar (libera capacidade).
+            if not livre or reivindicadas < livre:
+                self._acordar.wait(self.poll_interval)
+
+    def _enviar(self, linha):
+        try:
+            with self.outbox.app.app_context():
+                self._tentar(linha)
+        except Exception as e:
+            print(f"Erro ao atualizar a outbox (resposta {linha['id']}): {e}")
+        finally:
+            with self._lock:
+                self._em_voo -= 1
+            self._acordar.set()
+
+    @staticmethod
+    def _incerta(linha):
+        # A tentativa anterior pode ter chegado ao ML (rede, 5xx, processo morto no envio)
+        status = linha.get('last_status')
+        return linha['attempts'] > 1 and (status is None or status >= 500)
+
+    def _tentar(self, linha):
+        try:
+            if self.conferir and self._incerta(linha) and self.conferir(linha):
+                self.outbox.concluir(linha['id'])
+                with self._lock:
+                    self.confirmed += 1
+                print(f"Resposta da pergunta {linha['question_id']} já estava publicada: sem novo envio.")
+                return
+            self.enviar(linha)
+        except EnvioDescartado as e:
+            self.outbox.descartar(linha['id'], e)
+            with self._lock:
+                self.dead += 1
+            print(f"Resposta da pergunta {linha['question_id']} descartada: {e}")
+            return
+        except Exception as e:
+            self._falhou(linha, e)
+            return
+        self.outbox.concluir(linha['id'])
+        self.controle.sucesso()
+        self.idades.adicionar((agora() - linha['created_at']).total_seconds())
+        with self._lock:
+            self.sent += 1
+
+    def _falhou(self, linha, erro):
+        status = getattr(erro, 'status_code', None)
+        espera = getattr(erro, 'retry_after', None)
+        if status is not None and status not in STATUS_SOBRECARGA and status != 401:
+            # Erro do pedido (pergunta apagada, já respondida...): não adianta repetir
+            self.outbox.descartar(linha['id'], getattr(erro, 'body', None) or erro, status)
+            with self._lock:
+                self.dead += 1
+            print(f"Resposta da pergunta {linha['question_id']} recusada pelo ML ({status}): {erro}")
+            return
+
+        if status in STATUS_SOBRECARGA or status is None:
+            self.controle.sobrecarga()
+        with self._lock:
+            if status == 429:
+                self.throttled += 1
+                if espera:
+                    self._pausa_ate = max(self._pausa_ate, time.monotonic() + espera)
+            elif status is None:
+                self.network_errors += 1
+            elif status != 401:
+                self.server_errors += 1
+
+        # O ML disse quando voltar: é esse o atraso; senão backoff exponencial com jitter
+        atraso = espera if espera is not None else self._backoff(linha['attempts'])
+        if self.outbox.reagendar(linha['id'], atraso, erro, status, gastar_tentativa=status != 429) == 'dead':
+            with self._lock:
+                self.dead += 1
+        else:
+            with self._lock:
+                self.retried += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'concurrency_limit': round(self.controle.limite, 2),
+                'max_concurrency': self.controle.maximo,
+                'in_flight': self._em_voo,
+                'paused_for_s': round(max(0.0, self._pausa_ate - time.monotonic()), 1),
+                'sent': self.sent,
+                'confirmed_after_uncertain': self.confirmed,
+                'retried': self.retried,
+                'dead': self.dead,
+                'throttled': self.throttled,
+                'server_errors': self.server_errors,
+                'network_errors': self.network_errors,
+                'claim_errors': self.claim_errors,
+                'limit_decreases': self.controle.reducoes,
+                'delivery_age_ms': self.idades.percentis(),
+                'outbox': dict(self._estado),
+            }
@@ -0,0 +1,189 @@
+import contextvars
+import threading
+import time
+from collections import deque
+
+# Tempo que a tarefa em execução passou na fila (segundos). Definido pelo
+# WorkerPool/AsyncPool antes de chamar a tarefa; por thread e por corrotina.
+ESPERA_FILA = contextvars.ContextVar('espera_fila', default=None)
+
+
+def espera_na_fila():
+    return ESPERA_FILA.get()
+
+
+def parse_pesos(valor):
+    # "123:3,456:0.5" -> {123: 3.0, 456: 0.5}
+    pesos = {}
+    for par in (valor or '').split(','):
+        if ':' not in par:
+            continue
+        tenant, peso = par.split(':', 1)
+        try:
+            pesos[int(tenant.strip())] = max(0.1, float(peso))
+        except ValueError:
+            print(f"Peso de vendedor inválido ignorado: {par!r}")
+    return pesos
+
+
+class _EstatTenant:
+    __slots__ = ('atendidas', 'recusadas', 'espera_total', 'espera_max', 'espera_ultima')
+
+    def __init__(self):
+        self.atendidas = 0
+        self.recusadas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.espera_ultima = 0.0
+
+
+class FairScheduler:
+    """Fila com uma sub-fila por vendedor, servida por deficit round-robin.
+
+    Cada vendedor com tarefas na fila recebe `peso` créditos por volta e cada
+    tarefa custa um: com pesos iguais é um round-robin, e um vendedor com 500
+    perguntas na fila não atrasa a pergunta de quem tem uma só. Também limita
+    quantas tarefas de um mesmo vendedor rodam ao mesmo tempo
+    (`max_concorrencia`) e quantas ele pode ter na fila (`max_por_tenant`).
+
+    Tarefas sem vendedor (tenant=None) formam uma sub-fila como as outras.
+    """
+
+    def __init__(self, max_queue=500, max_por_tenant=None, max_concorrencia=None, pesos=None, peso_padrao=1.0):
+        self.max_queue = max(1, int(max_queue))
+        self.max_por_tenant = int(max_por_tenant) if max_por_tenant else self.max_queue
+        self.max_concorrencia = int(max_concorrencia) if max_concorrencia else None
+        self.pesos = dict(pesos or {})
+        self.peso_padrao = peso_padrao
+        self._cond = threading.Condition()
+        self._filas = {}          # tenant -> deque[(item, enfileirado_em)]
+        self._anel = deque()      # vendedores com fila não vazia, na ordem de atendimento
+        self._deficit = {}
+        self._em_execucao = {}
+        self._total = 0
+        self._estat = {}
+
+    def peso(self, tenant):
+        return self.pesos.get(tenant, self.peso_padrao)
+
+    def _estatisticas(self, tenant):
+        estat = self._estat.get(tenant)
+        if estat is None:
+            estat = self._estat[tenant] = _EstatTenant()
+        return estat
+
+    def put_nowait(self, tenant, item):
+        with self._cond:
+            fila = self._filas.get(tenant)
+            if self._total >= self.max_queue or (fila is not None and len(fila) >= self.max_por_tenant):
+                self._estatisticas(tenant).recusadas += 1
+                return False
+            if fila is None:
+                fila = self._filas[tenant] = deque()
+                self._anel.append(tenant)
+                self._deficit[tenant] = self.peso(tenant) if len(self._anel) == 1 else 0.0
+            fila.append((item, time.monotonic()))
+            self._total += 1
+            self._cond.notify()
+            return True
+
+    def _bloqueado(self, tenant):
+        return self.max_concorrencia is not None and self._em_execucao.get(tenant, 0) >= self.max_concorrencia
+
+    def _girar(self):
+        # Próximo vendedor da vez ganha seus créditos (sem acumular além de uma volta)
+        self._anel.rotate(-1)
+        self._recarregar()
+
+    def _recarregar(self):
+        if self._anel:
+            tenant = self._anel[0]
+            peso = self.peso(tenant)
+            self._deficit[tenant] = min(self._deficit[tenant] + peso, max(peso, 1.0))
+
+    def _proximo(self):
+        bloqueados = 0
+        while self._anel and bloqueados < len(self._anel):
+            tenant = self._anel[0]
+            if self._bloqueado(tenant):
+                bloqueados += 1
+                self._girar()
+                continue
+            bloqueados = 0
+            if self._deficit[tenant] < 1:
+                self._girar()
+                continue
+            self._deficit[tenant] -= 1
+            fila = self._filas[tenant]
+            item, enfileirado_em = fila.popleft()
+            if not fila:
+                self._anel.popleft()
+                del self._filas[tenant]
+                del self._deficit[tenant]
+                self._recarregar()
+            self._total -= 1
+            self._em_execucao[tenant] = self._em_execucao.get(tenant, 0) + 1
+            espera = time.monotonic() - enfileirado_em
+            estat = self._estatisticas(tenant)
+            estat.atendidas += 1
+            estat.espera_total += espera
+            estat.espera_max = max(estat.espera_max, espera)
+            estat.espera_ultima = espera
+            return tenant, item, espera
+        return None
+
+    def get(self, timeout=None):
+        # (tenant, item, espera) ou None se nada puder ser servido no timeout
+        prazo = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                proximo = self._proximo()
+                if proximo is not None:
+                    return proximo
+                restante = None if prazo is None else prazo - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return None
+                self._cond.wait(restante)
+
+    def get_nowait(self):
+        with self._cond:
+            return self._proximo()
+
+    def concluir(self, tenant):
+        # Tarefa terminou: libera a vaga de concorrência do vendedor
+        with self._cond:
+            n = self._em_execucao.get(tenant, 0) - 1
+            if n > 0:
+                self._em_execucao[tenant] = n
+            else:
+                self._em_execucao.pop(tenant, None)
+            self._cond.notify()
+
+    def qsize(self):
+        return self._total
+
+    def stats(self, top=20):
+        with self._cond:
+            tenants = []
+            for tenant, estat in self._estat.items():
+                tenants.append({
+                    'tenant': tenant,
+                    'weight': self.peso(tenant),
+                    'queued': len(self._filas.get(tenant, ())),
+                    'running': self._em_execucao.get(tenant, 0),
+                    'served': estat.atendidas,
+                    'rejected': estat.recusadas,
+                    'avg_wait_ms': round(estat.espera_total / estat.atendidas * 1000, 1) if estat.atendidas else None,
+                    'max_wait_ms': round(estat.espera_max * 1000, 1),
+                    'last_wait_ms': round(estat.espera_ultima * 1000, 1),
+                })
+            ativos = len(self._anel)
+        # Quem tem mais fila (e depois mais espera) primeiro
+        tenants.sort(key=lambda t: (t['queued'], t['last_wait_ms']), reverse=True)
+        return {
+            'queued': self._total,
+            'queued_tenants': ativos,
+            'max_per_tenant': self.max_por_tenant,
+            'max_concurrency_per_tenant': self.max_concorrencia,
+            'tenants': tenants[:top],
+        }
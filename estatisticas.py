@@ -0,0 +1,100 @@
+import threading
+from datetime import datetime
+
+
+class EstatisticasTenants:
+    """Agregados por vendedor (respondidas, falhas, latência) mantidos incrementalmente.
+
+    Cada pergunta processada só soma em memória; gravar() aplica os deltas
+    acumulados com um upsert por vendedor (answered = answered + delta). O painel
+    do admin lê a tabela pronta em vez de varrer o histórico.
+    """
+
+    def __init__(self, app, db, model):
+        self.app = app
+        self.db = db
+        self.Stats = model
+        self._lock = threading.Lock()
+        self._deltas = {}
+        self.flushes = 0
+        self.rows_written = 0
+
+    def registrar(self, user_id, status, segundos):
+        if not user_id:
+            return
+        agora = datetime.utcnow()
+        with self._lock:
+            d = self._deltas.get(user_id)
+            if d is None:
+                d = self._deltas[user_id] = {
+                    'answered': 0, 'failed': 0, 'ignored': 0,
+                    'latency_ms_total': 0.0, 'last_question_at': agora
+                }
+            if status == 'ok':
+                d['answered'] += 1
+                d['latency_ms_total'] += segundos * 1000
+            elif status == 'error':
+                d['failed'] += 1
+            else:
+                d['ignored'] += 1
+            d['last_question_at'] = agora
+
+    def _insert(self):
+        # Import tardio: o dialeto só é carregado no primeiro flush, não no boot
+        if self.db.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(self.Stats)
+
+    def gravar(self):
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        if not deltas:
+            return 0
+
+        agora = datetime.utcnow()
+        linhas = [{'user_id': user_id, 'updated_at': agora, **d} for user_id, d in deltas.items()]
+        with self.app.app_context():
+            tabela = self.Stats.__table__
+            stmt = self._insert()
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[tabela.c.user_id],
+                set_={
+                    'answered': tabela.c.answered + stmt.excluded.answered,
+                    'failed': tabela.c.failed + stmt.excluded.failed,
+                    'ignored': tabela.c.ignored + stmt.excluded.ignored,
+                    'latency_ms_total': tabela.c.latency_ms_total + stmt.excluded.latency_ms_total,
+                    'last_question_at': stmt.excluded.last_question_at,
+                    'updated_at': stmt.excluded.updated_at,
+                }
+            )
+            try:
+                self.db.session.execute(stmt, linhas)
+                self.db.session.commit()
+            except Exception as e:
+                self.db.session.rollback()
+                print(f"Erro ao gravar estatísticas dos vendedores: {e}")
+                # Devolve os deltas para a próxima tentativa
+                with self._lock:
+                    for user_id, d in deltas.items():
+                        atual = self._deltas.get(user_id)
+                        if atual is None:
+                            self._deltas[user_id] = d
+                        else:
+                            for campo in ('answered', 'failed', 'ignored', 'latency_ms_total'):
+                                atual[campo] += d[campo]
+                return 0
+
+        with self._lock:
+            self.flushes += 1
+            self.rows_written += len(linhas)
+        return len(linhas)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending_tenants': len(self._deltas),
+                'flushes': self.flushes,
+                'rows_written': self.rows_written,
+            }
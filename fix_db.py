@@ -1,5 +1,4 @@
 import os
-import psycopg2
 from dotenv import load_dotenv
 
 # Carregar variáveis de ambiente
@@ -12,19 +11,16 @@ if not DATABASE_URL:
     exit(1)
 
 def fix_database():
+    # As correções manuais (ALTER TABLE) viraram migrações versionadas: ver migrations.py
+    from app import app, db, init_db
+    from migrations import Migrador
+
     try:
-        print("Conectando ao banco de dados...")
-        conn = psycopg2.connect(DATABASE_URL)
-        cursor = conn.cursor()
-        
-        print("Executando alteração na tabela users...")
-        cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE;")
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        print("Banco de dados corrigido!")
+        print("Aplicando migrações pendentes...")
+        init_db()
+        with app.app_context():
+            versao = Migrador(db.engine, db.metadata).versao_atual()
+        print(f"Banco de dados corrigido! Versão do schema: {versao}")
     except Exception as e:
         print(f"Erro ao corrigir banco de dados: {e}")
 
@@ -0,0 +1,286 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class GeracaoIndisponivel(Exception):
+    """A resposta não pôde ser gerada agora (circuito aberto, prazo estourado ou erro).
+
+    Quem chama deve adiar a pergunta e tentar de novo mais tarde, nunca
+    publicar um texto genérico no lugar da resposta.
+    """
+
+    def __init__(self, motivo, causa=None):
+        super().__init__(f"geração indisponível: {motivo}" + (f" ({causa})" if causa else ''))
+        self.motivo = motivo
+        self.causa = causa
+
+
+class CircuitBreaker:
+    """Abre após `falhas` falhas seguidas; depois de `pausa` segundos deixa passar
+    uma chamada de sonda (half-open) que fecha ou reabre o circuito."""
+
+    FECHADO = 'closed'
+    SEMI_ABERTO = 'half_open'
+    ABERTO = 'open'
+
+    def __init__(self, falhas=5, pausa=30.0):
+        self.limite = max(1, int(falhas))
+        self.pausa = pausa
+        self.estado = self.FECHADO
+        self._lock = threading.Lock()
+        self._falhas_seguidas = 0
+        self._aberto_em = 0.0
+        self._sonda_em_andamento = False
+        self.aberturas = 0
+        self.rejeitadas = 0
+
+    def permitir(self):
+        with self._lock:
+            if self.estado == self.FECHADO:
+                return True
+            if self.estado == self.ABERTO and time.monotonic() - self._aberto_em >= self.pausa:
+                self.estado = self.SEMI_ABERTO
+            if self.estado == self.SEMI_ABERTO and not self._sonda_em_andamento:
+                self._sonda_em_andamento = True
+                return True
+            self.rejeitadas += 1
+            return False
+
+    def sucesso(self):
+        with self._lock:
+            self.estado = self.FECHADO
+            self._falhas_seguidas = 0
+            self._sonda_em_andamento = False
+
+    def falha(self):
+        with self._lock:
+            self._falhas_seguidas += 1
+            self._sonda_em_andamento = False
+            if self.estado == self.SEMI_ABERTO or self._falhas_seguidas >= self.limite:
+                if self.estado != self.ABERTO:
+                    self.aberturas += 1
+                    print(f"Circuito da geração ABERTO após {self._falhas_seguidas} falhas seguidas.")
+                self.estado = self.ABERTO
+                self._aberto_em = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.estado,
+                'consecutive_failures': self._falhas_seguidas,
+                'opens': self.aberturas,
+                'rejected': self.rejeitadas,
+            }
+
+
+class JanelaLatencias:
+    """Últimas N latências (segundos) para percentis e para o limiar de hedge."""
+
+    def __init__(self, tamanho=500):
+        self._valores = deque(maxlen=tamanho)
+        self._lock = threading.Lock()
+
+    def adicionar(self, segundos):
+        with self._lock:
+            self._valores.append(segundos)
+
+    def percentil(self, p, minimo=1):
+        with self._lock:
+            if len(self._valores) < minimo:
+                return None
+            ordenados = sorted(self._valores)
+        return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+    def percentis(self):
+        with self._lock:
+            ordenados = sorted(self._valores)
+        if not ordenados:
+            return {'p50': None, 'p95': None, 'p99': None, 'count': 0}
+        pegar = lambda p: round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))] * 1000, 1)
+        return {'p50': pegar(50), 'p95': pegar(95), 'p99': pegar(99), 'count': len(ordenados)}
+
+
+class Gerador:
+    """Camada de geração com prazo, hedge e circuit breaker.
+
+    - deadline: orçamento total da geração; cada tentativa recebe o que sobra
+      como timeout, então nenhuma fica presa além do prazo
+    - hedge: se a primeira tentativa passar de `hedge_apos` segundos (ou do
+      percentil `hedge_percentil` das latências recentes), dispara uma segunda
+      em paralelo e fica com a que responder primeiro; se a primeira falhar
+      rápido, a segunda vale como nova tentativa
+    - breaker: em pane do upstream para de chamar e falha na hora
+
+    `chamar(mensagens, timeout, modelo)` / `chamar_async(...)` fazem a chamada
+    de fato e retornam o texto (modelo=None: o padrão de quem chama). Falhas
+    viram GeracaoIndisponivel.
+    """
+
+    def __init__(self, chamar, chamar_async=None, deadline=20.0, hedge_apos=None,
+                 hedge_percentil=None, breaker=None, max_paralelo=32, nome='generation'):
+        self.chamar = chamar
+        self.chamar_async = chamar_async
+        self.deadline = deadline
+        self.hedge_apos = hedge_apos
+        self.hedge_percentil = hedge_percentil
+        self.breaker = breaker or CircuitBreaker()
+        self.nome = nome
+        self.latencias = JanelaLatencias()       # gerações bem-sucedidas (ponta a ponta)
+        self._tentativas = JanelaLatencias()     # tentativas individuais (base do hedge)
+        self._executor = None
+        self._max_paralelo = max_paralelo
+        self._lock = threading.Lock()
+        self.contagem = {'calls': 0, 'ok': 0, 'hedges': 0, 'hedge_wins': 0, 'timeouts': 0, 'errors': 0, 'circuit_open': 0}
+
+    def _contar(self, chave):
+        with self._lock:
+            self.contagem[chave] += 1
+
+    def limiar_hedge(self):
+        if self.hedge_percentil:
+            limiar = self._tentativas.percentil(self.hedge_percentil, minimo=20)
+            if limiar is not None:
+                return limiar
+        return self.hedge_apos
+
+    def _entrar(self):
+        self._contar('calls')
+        if not self.breaker.permitir():
+            self._contar('circuit_open')
+            raise GeracaoIndisponivel('circuit_open')
+
+    def _sucesso(self, inicio, hedge_venceu):
+        self.breaker.sucesso()
+        self.latencias.adicionar(time.monotonic() - inicio)
+        self._contar('ok')
+        if hedge_venceu:
+            self._contar('hedge_wins')
+
+    def _falha(self, expirou, erro):
+        self.breaker.falha()
+        if expirou:
+            self._contar('timeouts')
+            raise GeracaoIndisponivel('deadline', erro)
+        self._contar('errors')
+        raise GeracaoIndisponivel('error', erro)
+
+    # --- Síncrono (pool de threads) ---
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._max_paralelo, thread_name_prefix=self.nome)
+        return self._executor
+
+    def _tentar(self, mensagens, timeout, modelo=None):
+        inicio = time.monotonic()
+        texto = self.chamar(mensagens, timeout, modelo)
+        self._tentativas.adicionar(time.monotonic() - inicio)
+        return texto
+
+    def _gerar_direto(self, mensagens, inicio, modelo):
+        # Interpretador encerrando (o concurrent.futures já recusa tarefas antes
+        # do atexit que drena o pool): uma tentativa na própria thread, sem hedge
+        try:
+            texto = self._tentar(mensagens, self.deadline, modelo)
+        except Exception as e:
+            self._falha(time.monotonic() >= inicio + self.deadline, e)
+        self._sucesso(inicio, False)
+        return texto
+
+    def gerar(self, mensagens, modelo=None):
+        self._entrar()
+        inicio = time.monotonic()
+        prazo = inicio + self.deadline
+        limiar = self.limiar_hedge()
+        try:
+            pendentes = {self._pool().submit(self._tentar, mensagens, self.deadline, modelo): False}
+        except RuntimeError:
+            return self._gerar_direto(mensagens, inicio, modelo)
+        reserva_disparada = False
+        erro = None
+        while pendentes:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            espera = restante
+            if limiar is not None and not reserva_disparada:
+                espera = min(restante, max(0.0, inicio + limiar - time.monotonic()))
+            feitas, _ = wait(list(pendentes), timeout=espera, return_when=FIRST_COMPLETED)
+            for futuro in feitas:
+                eh_reserva = pendentes.pop(futuro)
+                if futuro.exception() is None:
+                    for outro in pendentes:
+                        outro.cancel()
+                    self._sucesso(inicio, eh_reserva)
+                    return futuro.result()
+                erro = futuro.exception()
+            # Hedge: primeira tentativa lenta (limiar) ou que falhou rápido
+            if not reserva_disparada and (limiar is not None or not pendentes):
+                if (not pendentes or time.monotonic() >= inicio + limiar) and prazo - time.monotonic() > 0:
+                    reserva_disparada = True
+                    try:
+                        pendentes[self._pool().submit(self._tentar, mensagens, prazo - time.monotonic(), modelo)] = True
+                        self._contar('hedges')
+                    except RuntimeError:
+                        pass  # encerrando: fica só com a primeira
+        for futuro in pendentes:
+            futuro.cancel()  # as que já rodam terminam sozinhas pelo timeout
+        self._falha(time.monotonic() >= prazo, erro)
+
+    # --- Assíncrono (pipeline asyncio) ---
+
+    async def _tentar_async(self, mensagens, timeout, modelo=None):
+        inicio = time.monotonic()
+        texto = await self.chamar_async(mensagens, timeout, modelo)
+        self._tentativas.adicionar(time.monotonic() - inicio)
+        return texto
+
+    async def gerar_async(self, mensagens, modelo=None):
+        self._entrar()
+        inicio = time.monotonic()
+        prazo = inicio + self.deadline
+        limiar = self.limiar_hedge()
+        pendentes = {asyncio.ensure_future(self._tentar_async(mensagens, self.deadline, modelo)): False}
+        reserva_disparada = False
+        erro = None
+        try:
+            while pendentes:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                espera = restante
+                if limiar is not None and not reserva_disparada:
+                    espera = min(restante, max(0.0, inicio + limiar - time.monotonic()))
+                feitas, _ = await asyncio.wait(list(pendentes), timeout=espera, return_when=asyncio.FIRST_COMPLETED)
+                for tarefa in feitas:
+                    eh_reserva = pendentes.pop(tarefa)
+                    if tarefa.exception() is None:
+                        self._sucesso(inicio, eh_reserva)
+                        return tarefa.result()
+                    erro = tarefa.exception()
+                if not reserva_disparada and (limiar is not None or not pendentes):
+                    if (not pendentes or time.monotonic() >= inicio + limiar) and prazo - time.monotonic() > 0:
+                        reserva_disparada = True
+                        self._contar('hedges')
+                        pendentes[asyncio.ensure_future(self._tentar_async(mensagens, prazo - time.monotonic(), modelo))] = True
+        finally:
+            # Perdedoras e tentativas além do prazo são canceladas de fato
+            for tarefa in pendentes:
+                tarefa.cancel()
+        self._falha(time.monotonic() >= prazo, erro)
+
+    def stats(self):
+        with self._lock:
+            contagem = dict(self.contagem)
+        limiar = self.limiar_hedge()
+        return contagem | {
+            'deadline_s': self.deadline,
+            'hedge_after_ms': round(limiar * 1000, 1) if limiar is not None else None,
+            'breaker': self.breaker.stats(),
+            'latency_ms': self.latencias.percentis(),
+        }
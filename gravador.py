@@ -0,0 +1,93 @@
+import json
+import os
+import queue
+import threading
+import time
+
+
+class GravadorWebhooks:
+    """Grava os payloads recebidos no /notifications para replay (replay.py).
+
+    Cada notificação vira uma linha JSON compacta {"t": epoch, "p": payload}
+    num arquivo só de acréscimo. registrar() só enfileira; uma thread junta as
+    linhas e faz um único write() com O_APPEND, então vários workers do
+    gunicorn podem gravar no mesmo arquivo sem misturar linhas. Com a fila
+    cheia o registro é descartado e contado.
+
+    O caminho aceita {pid} (ex.: capturas/webhooks-{pid}.jsonl).
+    """
+
+    def __init__(self, caminho, max_buffer=10000, flush_interval=0.5):
+        self.caminho = caminho
+        self.flush_interval = flush_interval
+        self._fila = queue.Queue(maxsize=max(1, int(max_buffer)))
+        self._pid = None
+        self._thread = None
+        self._fd = None
+        self._lock = threading.Lock()
+        self._parando = threading.Event()
+
+        self.recorded = 0
+        self.dropped = 0
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._parando.clear()
+            caminho = self.caminho.format(pid=self._pid)
+            if os.path.dirname(caminho):
+                os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            self._fd = os.open(caminho, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            self._thread = threading.Thread(target=self._loop, name='webhook-recorder', daemon=True)
+            self._thread.start()
+
+    def registrar(self, payload):
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self._fila.put_nowait((time.time(), payload))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _drenar(self):
+        linhas = []
+        while True:
+            try:
+                t, payload = self._fila.get_nowait()
+            except queue.Empty:
+                break
+            linhas.append(json.dumps({'t': round(t, 3), 'p': payload}, separators=(',', ':'), ensure_ascii=False) + '\n')
+        if linhas:
+            try:
+                os.write(self._fd, ''.join(linhas).encode())
+            except OSError as e:
+                print(f"Erro ao gravar captura de webhooks: {e}")
+                with self._lock:
+                    self.dropped += len(linhas)
+                return
+            with self._lock:
+                self.recorded += len(linhas)
+
+    def _loop(self):
+        while not self._parando.wait(self.flush_interval):
+            self._drenar()
+
+    def flush(self, timeout=5):
+        # Desligamento: grava o que sobrou na fila
+        self._parando.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout)
+            self._drenar()
+
+    def stats(self):
+        return {
+            'path': self.caminho,
+            'buffered': self._fila.qsize(),
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,34 @@
+# Configuração carregada automaticamente pelo gunicorn (./gunicorn.conf.py)
+import gc
+
+from metricas import limpar_diretorio
+
+# O master importa o app uma vez e os workers nascem por fork já com tudo
+# carregado (boot mais rápido, páginas compartilhadas copy-on-write)
+preload_app = True
+
+
+def on_starting(server):
+    # Cada worker grava suas métricas em METRICS_DIR; começa limpo a cada boot
+    limpar_diretorio()
+
+    # Migrações uma vez, no master, antes de subir os workers (eles não migram)
+    from app import app, db, init_db, cliente_openai
+    init_db()
+    # SDK da OpenAI fica fora do import do app; aqui ele entra antes do fork
+    cliente_openai()
+    # Conexões abertas aqui não podem ser herdadas pelos workers após o fork
+    with app.app_context():
+        db.engine.dispose()
+
+    # Objetos do boot vão para a geração permanente: o GC dos workers não os
+    # percorre (nem escreve nos seus cabeçalhos), então as páginas seguem compartilhadas
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Garantia extra: o worker nunca reaproveita conexões do pool do master
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
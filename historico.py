@@ -0,0 +1,163 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import insert
+
+
+class HistoryWriter:
+    """Grava o histórico de perguntas em lote, fora do caminho do request.
+
+    registrar() só coloca o registro numa fila limitada; uma thread junta até
+    `batch_size` registros (ou o que chegou em `flush_interval` segundos) e faz
+    um único INSERT de várias linhas. Com a fila cheia, registrar() espera até
+    `put_timeout` segundos por espaço (o processamento desacelera junto com o
+    banco); só depois disso o registro é descartado. Descartes são contados e
+    repassados a `ao_descartar(quantidade, motivo)`, que o app liga às métricas.
+    """
+
+    def __init__(self, app, db, model, max_buffer=10000, batch_size=500, flush_interval=2.0,
+                 put_timeout=0.5, ao_descartar=None):
+        self.app = app
+        self.db = db
+        self.History = model
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.ao_descartar = ao_descartar
+        self._fila = queue.Queue(maxsize=max(1, int(max_buffer)))
+        self._colunas = {c.name for c in model.__table__.columns}
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._parando = threading.Event()
+
+        self.written = 0
+        self.dropped = 0
+        self.waits = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    def start(self):
+        # Thread por processo, criada sob demanda (como o WorkerPool)
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._parando.clear()
+            self._thread = threading.Thread(target=self._loop, name='history-writer', daemon=True)
+            self._thread.start()
+
+    def _linha(self, registro):
+        if self._pid != os.getpid():
+            self.start()
+        return {k: v for k, v in registro.items() if k in self._colunas}
+
+    def _descartar(self, quantidade, motivo):
+        with self._lock:
+            self.dropped += quantidade
+        if self.ao_descartar:
+            try:
+                self.ao_descartar(quantidade, motivo)
+            except Exception as e:
+                print(f"Erro no hook de descarte do histórico: {e}")
+
+    def registrar(self, registro):
+        linha = self._linha(registro)
+        try:
+            self._fila.put_nowait(linha)
+            return True
+        except queue.Full:
+            pass
+        with self._lock:
+            self.waits += 1
+        try:
+            self._fila.put(linha, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self._descartar(1, 'queue_full')
+            return False
+
+    async def registrar_async(self, registro):
+        # Mesma espera de registrar(), sem bloquear o event loop
+        linha = self._linha(registro)
+        prazo = None
+        while True:
+            try:
+                self._fila.put_nowait(linha)
+                return True
+            except queue.Full:
+                pass
+            if prazo is None:
+                prazo = time.monotonic() + self.put_timeout
+                with self._lock:
+                    self.waits += 1
+            elif time.monotonic() >= prazo:
+                self._descartar(1, 'queue_full')
+                return False
+            await asyncio.sleep(min(0.01, self.put_timeout))
+
+    def _coletar(self):
+        lote = []
+        prazo = time.monotonic() + self.flush_interval
+        while len(lote) < self.batch_size:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _loop(self):
+        while not self._parando.is_set():
+            lote = self._coletar()
+            if lote:
+                self._gravar(lote)
+
+    def _gravar(self, lote):
+        with self.app.app_context():
+            try:
+                # executemany: o SQLAlchemy agrupa em INSERT ... VALUES (...), (...)
+                self.db.session.execute(insert(self.History), lote)
+                self.db.session.commit()
+            except Exception as e:
+                self.db.session.rollback()
+                print(f"Erro ao gravar histórico ({len(lote)} registros): {e}")
+                with self._lock:
+                    self.failed_batches += 1
+                self._descartar(len(lote), 'write_error')
+                return
+        with self._lock:
+            self.batches += 1
+            self.written += len(lote)
+
+    def flush(self, timeout=10):
+        # Desligamento: para a thread e grava o que sobrou na fila
+        self._parando.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout)
+        prazo = time.monotonic() + timeout
+        while not self._fila.empty() and time.monotonic() < prazo:
+            lote = []
+            while len(lote) < self.batch_size:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            if lote:
+                self._gravar(lote)
+
+    def stats(self):
+        return {
+            'buffered': self._fila.qsize(),
+            'max_buffer': self._fila.maxsize,
+            'written': self.written,
+            'dropped': self.dropped,
+            'waits': self.waits,
+            'batches': self.batches,
+            'failed_batches': self.failed_batches,
+        }
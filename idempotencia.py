@@ -0,0 +1,96 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from cache import TTLCache
+
+
+class IdempotencyIndex:
+    """Índice de idempotência: notificação `_id` e pergunta (resource) já vistas.
+
+    Uma chave reservada fica 'in_flight' até o pipeline terminar e então vira
+    'done'. Enquanto existir, novas entregas com a mesma chave são descartadas
+    antes de qualquer chamada externa. As chaves ficam no banco (sobrevivem a
+    restart) com expiração, e um cache em memória evita ida ao banco para
+    duplicatas repetidas no mesmo processo.
+    """
+
+    def __init__(self, app, db, model, in_flight_ttl=900, done_ttl=7 * 86400,
+                 cache_size=20000, purge_interval=600):
+        self.app = app
+        self.db = db
+        self.Key = model
+        self.in_flight_ttl = in_flight_ttl
+        self.done_ttl = done_ttl
+        self.purge_interval = purge_interval
+        self.cache = TTLCache(maxsize=cache_size, ttl=in_flight_ttl, name='idempotency')
+        self._ultimo_purge = time.monotonic()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def _duplicata(self):
+        with self._lock:
+            self.duplicates += 1
+        return False
+
+    def reservar(self, chaves):
+        # True se a chamada "ganhou" as chaves; False se for duplicata
+        if any(self.cache.get(c) is not None for c in chaves):
+            return self._duplicata()
+
+        Key = self.Key
+        now = datetime.utcnow()
+        session = self.db.session
+        try:
+            # Chaves expiradas podem ser reaproveitadas
+            session.execute(delete(Key).where(Key.key.in_(chaves), Key.expires_at < now))
+            expira = now + timedelta(seconds=self.in_flight_ttl)
+            session.add_all([Key(key=c, status='in_flight', expires_at=expira, created_at=now) for c in chaves])
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            return self._duplicata()
+
+        for c in chaves:
+            self.cache.set(c, 'in_flight')
+        self._purgar_se_preciso()
+        return True
+
+    def concluir(self, chaves):
+        Key = self.Key
+        expira = datetime.utcnow() + timedelta(seconds=self.done_ttl)
+        self.db.session.execute(
+            update(Key).where(Key.key.in_(chaves)).values(status='done', expires_at=expira)
+        )
+        self.db.session.commit()
+        for c in chaves:
+            self.cache.set(c, 'done', ttl=self.done_ttl)
+
+    def liberar(self, chaves):
+        # Falha definitiva ou trabalho não aceito: permite reprocessar numa reentrega
+        Key = self.Key
+        self.db.session.execute(delete(Key).where(Key.key.in_(chaves)))
+        self.db.session.commit()
+        for c in chaves:
+            self.cache.invalidate(c)
+
+    def _purgar_se_preciso(self):
+        if time.monotonic() - self._ultimo_purge < self.purge_interval:
+            return
+        self._ultimo_purge = time.monotonic()
+        try:
+            resultado = self.db.session.execute(delete(self.Key).where(self.Key.expires_at < datetime.utcnow()))
+            self.db.session.commit()
+            if resultado.rowcount:
+                print(f"Idempotência: {resultado.rowcount} chaves expiradas removidas.")
+        except Exception as e:
+            self.db.session.rollback()
+            print(f"Erro ao purgar chaves de idempotência: {e}")
+
+    def stats(self):
+        dados = self.cache.stats()
+        dados['duplicates'] = self.duplicates
+        return dados
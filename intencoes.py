@@ -0,0 +1,190 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from respostas_cache import normalizar_pergunta
+
+# Frases típicas de cada intenção respondível com os dados do item. Cada frase
+# vira um n-grama de palavras com peso = tamanho (bigrama vale 2): "tem
+# garantia" pesa mais para garantia do que "tem" sozinho para estoque.
+FRASES = {
+    'stock': [
+        'tem', 'disponivel', 'tem disponivel', 'ainda tem', 'ainda disponivel', 'ta disponivel',
+        'esta disponivel', 'tem estoque', 'estoque', 'pronta entrega', 'tem pronta entrega',
+        'ainda vende', 'ainda vendem', 'acabou', 'quantas unidades', 'tem unidade',
+    ],
+    'price': [
+        'preco', 'qual o preco', 'quanto custa', 'custa', 'quanto', 'quanto e', 'quanto fica',
+        'qual o valor', 'valor', 'valor a vista',
+    ],
+    'free_shipping': [
+        'frete gratis', 'tem frete gratis', 'frete e gratis', 'envio gratis', 'frete gratuito',
+        'paga frete', 'cobra frete',
+    ],
+    'condition': ['novo', 'e novo', 'usado', 'e usado', 'novo ou usado', 'seminovo', 'lacrado', 'na caixa'],
+    'warranty': ['garantia', 'tem garantia', 'quanto tempo de garantia', 'qual a garantia'],
+}
+
+# Palavras que não mudam o pedido ("ainda tem esse produto?" = "tem?")
+NEUTRAS = {
+    'o', 'a', 'os', 'as', 'de', 'da', 'do', 'dos', 'das', 'e', 'um', 'uma', 'para', 'pra', 'com',
+    'no', 'na', 'nos', 'nas', 'qual', 'ai', 'esse', 'essa', 'este', 'esta', 'isso', 'produto',
+    'item', 'anuncio', 'ele', 'ela', 'me', 'se', 'voce', 'voces', 'vc', 'vcs', 'ainda', 'ja', 'ta',
+    'sim', 'ok', 'ola', 'oi', 'pf', 'pfv', 'por', 'favor', 'so', 'mesmo',
+}
+
+# Sinais de pergunta que pede raciocínio (compatibilidade, comparação, medidas)
+SINAIS_COMPLEXOS = {
+    'compativel', 'compatibilidade', 'serve', 'funciona', 'diferenca', 'comparado', 'melhor',
+    'instalar', 'instalacao', 'medida', 'medidas', 'especificacao', 'voltagem', 'tecnico', 'tecnica',
+}
+
+SIMBOLOS = {'BRL': 'R$', 'USD': 'US$', 'ARS': '$', 'MXN': '$'}
+ASSINATURA = 'Qualquer dúvida, estamos à disposição!'
+
+Decisao = namedtuple('Decisao', 'rota intencao resposta modelo')
+
+
+def _ngramas(palavras, n_max=4):
+    for n in range(1, n_max + 1):
+        for i in range(len(palavras) - n + 1):
+            yield ' '.join(palavras[i:i + n])
+
+
+def _preco(valor, moeda):
+    texto = f"{float(valor):,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+    return f"{SIMBOLOS.get(moeda, moeda or '')} {texto}".strip()
+
+
+class ClassificadorIntencoes:
+    """Classificador local de intenção por n-gramas de palavras.
+
+    As frases de FRASES viram uma matriz esparsa (n-grama x intenção); uma
+    pergunta normalizada é pontuada somando as linhas dos seus n-gramas. Só
+    aceita a intenção se toda palavra da pergunta estiver no vocabulário dela
+    ou em NEUTRAS, sem números: "tem pronta entrega?" sim; "tem na cor azul?",
+    "quanto fica pra 10?" e "disponível para retirada?" não. Template errado
+    publicado para o comprador custa mais que uma chamada à IA.
+    """
+
+    def __init__(self, frases=FRASES, pontuacao_minima=1.0):
+        self.intencoes = list(frases)
+        self.pontuacao_minima = pontuacao_minima
+        self._indice = {}
+        pesos = []
+        self._vocabulario = [set() for _ in self.intencoes]
+        for j, intencao in enumerate(self.intencoes):
+            for frase in frases[intencao]:
+                if frase not in self._indice:
+                    self._indice[frase] = len(pesos)
+                    pesos.append(np.zeros(len(self.intencoes), dtype=np.float32))
+                pesos[self._indice[frase]][j] = len(frase.split())
+                self._vocabulario[j].update(frase.split())
+        self._pesos = np.vstack(pesos)
+
+    def classificar(self, texto):
+        # (intenção, pontuação) ou (None, pontuação) se não for respondível por template
+        palavras = normalizar_pergunta(texto).split()
+        if not palavras:
+            return None, 0.0
+        linhas = [self._indice[g] for g in _ngramas(palavras) if g in self._indice]
+        if not linhas:
+            return None, 0.0
+        pontos = self._pesos[linhas].sum(axis=0)
+        melhor = int(pontos.argmax())
+        if pontos[melhor] < self.pontuacao_minima:
+            return None, float(pontos[melhor])
+        # Palavra fora do vocabulário (ou número: quantidade, medida, modelo) muda o pedido
+        vocabulario = self._vocabulario[melhor]
+        if any(p not in vocabulario and p not in NEUTRAS for p in palavras):
+            return None, float(pontos[melhor])
+        return self.intencoes[melhor], float(pontos[melhor])
+
+
+def preencher_template(intencao, item):
+    # Resposta pronta com os dados do item; None se faltar o dado necessário
+    if intencao == 'stock':
+        estoque = item.get('available_quantity')
+        if estoque is None:
+            return None
+        if estoque <= 0:
+            return f"Olá! No momento este produto está esgotado. {ASSINATURA}"
+        return f"Olá! Sim, temos disponível para pronta entrega. É só fazer o pedido! {ASSINATURA}"
+    if intencao == 'price':
+        if item.get('price') is None:
+            return None
+        return f"Olá! O valor é {_preco(item['price'], item.get('currency_id'))}, direto pelo anúncio. {ASSINATURA}"
+    if intencao == 'free_shipping':
+        # Sem frete grátis o valor depende do CEP: fica com a IA
+        if not item.get('free_shipping'):
+            return None
+        return f"Olá! Sim, o frete é grátis para este produto. {ASSINATURA}"
+    if intencao == 'condition':
+        condicao = {'new': 'novo', 'used': 'usado', 'refurbished': 'recondicionado'}.get(item.get('condition'))
+        if not condicao:
+            return None
+        return f"Olá! O produto é {condicao}. {ASSINATURA}"
+    if intencao == 'warranty':
+        if not item.get('warranty'):
+            return None
+        return f"Olá! Sim, o produto tem garantia: {item['warranty']}. {ASSINATURA}"
+    return None
+
+
+class Roteador:
+    """Decide o caminho de cada pergunta antes da IA.
+
+    - template: intenção respondível com os dados do item (sem chamar a OpenAI)
+    - strong: pergunta longa/composta/técnica, vai para o modelo forte
+    - fast: o resto, modelo rápido (e mais barato)
+
+    Sem modelo forte configurado, tudo o que não é template vai para o rápido.
+    """
+
+    def __init__(self, classificador, modelo_rapido, modelo_forte=None, templates=True, palavras_forte=25):
+        self.classificador = classificador
+        self.modelo_rapido = modelo_rapido
+        self.modelo_forte = modelo_forte if modelo_forte and modelo_forte != modelo_rapido else None
+        self.templates = templates
+        self.palavras_forte = palavras_forte
+        self._lock = threading.Lock()
+        self._contagem = {}
+        self._latencia = {}
+        self.tokens_evitados = 0
+
+    def _complexa(self, texto):
+        palavras = normalizar_pergunta(texto).split()
+        return (
+            len(palavras) >= self.palavras_forte
+            or (texto or '').count('?') >= 2
+            or any(p in SINAIS_COMPLEXOS for p in palavras)
+        )
+
+    def decidir(self, texto, item):
+        if self.templates:
+            intencao, _ = self.classificador.classificar(texto)
+            if intencao:
+                resposta = preencher_template(intencao, item)
+                if resposta:
+                    return Decisao('template', intencao, resposta, None)
+        if self.modelo_forte and self._complexa(texto):
+            return Decisao('strong', None, None, self.modelo_forte)
+        return Decisao('fast', None, None, self.modelo_rapido)
+
+    def registrar(self, rota, segundos, tokens_evitados=0):
+        with self._lock:
+            self._contagem[rota] = self._contagem.get(rota, 0) + 1
+            self._latencia[rota] = self._latencia.get(rota, 0.0) + segundos
+            self.tokens_evitados += tokens_evitados
+
+    def stats(self):
+        with self._lock:
+            return {
+                'templates_enabled': self.templates,
+                'fast_model': self.modelo_rapido,
+                'strong_model': self.modelo_forte,
+                'routes': dict(self._contagem),
+                'avg_latency_ms': {r: round(self._latencia[r] / n * 1000, 2) for r, n in self._contagem.items()},
+                'prompt_tokens_avoided': self.tokens_evitados,
+            }
@@ -0,0 +1,99 @@
+import os
+import select
+import threading
+
+from sqlalchemy import text
+
+
+class Invalidador:
+    """Propaga invalidações de cache entre processos/nós via LISTEN/NOTIFY.
+
+    Cada processo mantém uma thread com uma conexão dedicada escutando os
+    canais registrados. No SQLite (ou sem PostgreSQL) vira no-op e os caches
+    dependem apenas do TTL para convergir.
+    """
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self._callbacks = {}
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._parando = threading.Event()
+
+    def registrar(self, canal, callback):
+        # callback(payload); payload None = "invalide tudo" (ex.: após reconexão)
+        self._callbacks.setdefault(canal, []).append(callback)
+
+    def _suportado(self):
+        with self.app.app_context():
+            return self.db.engine.dialect.name == 'postgresql'
+
+    def publicar(self, canal, payload):
+        if not self._suportado():
+            return
+        try:
+            self.db.session.execute(text("SELECT pg_notify(:canal, :payload)"), {'canal': canal, 'payload': str(payload)})
+            self.db.session.commit()
+        except Exception as e:
+            self.db.session.rollback()
+            print(f"Erro ao publicar invalidação em '{canal}': {e}")
+
+    def start(self):
+        if not self._callbacks or not self._suportado():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._parando.clear()
+            self._thread = threading.Thread(target=self._loop, name='cache-invalidation', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._parando.set()
+
+    def _disparar(self, canal, payload):
+        for callback in self._callbacks.get(canal, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                print(f"Erro ao processar invalidação de '{canal}': {e}")
+
+    def _loop(self):
+        espera = 1
+        while not self._parando.is_set():
+            conn = None
+            try:
+                with self.app.app_context():
+                    raw = self.db.engine.raw_connection()
+                raw.detach()  # conexão dedicada, fora do pool
+                conn = raw.driver_connection
+                conn.autocommit = True
+                cursor = conn.cursor()
+                for canal in self._callbacks:
+                    cursor.execute(f'LISTEN "{canal}"')
+
+                # Pode ter perdido mensagens enquanto estava desconectado
+                for canal in self._callbacks:
+                    self._disparar(canal, None)
+                espera = 1
+
+                while not self._parando.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notificacao = conn.notifies.pop(0)
+                        self._disparar(notificacao.channel, notificacao.payload)
+            except Exception as e:
+                print(f"Listener de invalidação desconectado: {e}")
+                self._parando.wait(espera)
+                espera = min(espera * 2, 60)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
@@ -0,0 +1,274 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, or_, select, update, func
+from sqlalchemy.exc import IntegrityError
+
+
+def agora():
+    return datetime.utcnow()
+
+
+class JobQueue:
+    """Fila durável de jobs na tabela `jobs`, compartilhada entre processos e nós.
+
+    Cada job é reivindicado com lease (locked_until). No PostgreSQL a seleção usa
+    FOR UPDATE SKIP LOCKED, então vários workers podem reivindicar em paralelo
+    sem disputar as mesmas linhas. No SQLite (testes locais) o UPDATE condicional
+    garante a mesma semântica, só que serializada.
+    """
+
+    def __init__(self, app, db, model, lease_seconds=300, max_attempts=5):
+        self.app = app
+        self.db = db
+        self.Job = model
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def _skip_locked(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def enfileirar(self, user_id, topic, resource, notification_id=None):
+        # Retorna False se já existe um job ativo (pending/running) para o mesmo resource
+        Job = self.Job
+        try:
+            self.db.session.add(Job(
+                user_id=user_id,
+                topic=topic,
+                resource=resource,
+                notification_id=notification_id,
+                status='pending',
+                max_attempts=self.max_attempts,
+                run_at=agora()
+            ))
+            self.db.session.commit()
+            return True
+        except IntegrityError:
+            self.db.session.rollback()
+            return False
+
+    def reivindicar(self, limite, worker_id):
+        Job = self.Job
+        now = agora()
+        session = self.db.session
+
+        # Lease vencido e sem tentativas restantes: vai para a dead-letter
+        session.execute(
+            update(Job)
+            .where(Job.status == 'running', Job.locked_until < now, Job.attempts >= Job.max_attempts)
+            .values(status='dead', last_error='lease expirado', locked_by=None, locked_until=None, updated_at=now)
+        )
+
+        disponivel = and_(
+            Job.attempts < Job.max_attempts,
+            or_(
+                and_(Job.status == 'pending', Job.run_at <= now),
+                and_(Job.status == 'running', Job.locked_until < now),
+            )
+        )
+        candidatos = select(Job.id).where(disponivel).order_by(Job.run_at).limit(limite)
+        if self._skip_locked():
+            candidatos = candidatos.with_for_update(skip_locked=True)
+
+        stmt = (
+            update(Job)
+            .where(Job.id.in_(candidatos.scalar_subquery()), disponivel)
+            .values(
+                status='running',
+                locked_by=worker_id,
+                locked_until=now + timedelta(seconds=self.lease_seconds),
+                attempts=Job.attempts + 1,
+                updated_at=now
+            )
+            .returning(Job.id, Job.user_id, Job.topic, Job.resource, Job.notification_id, Job.attempts)
+            .execution_options(synchronize_session=False)
+        )
+        jobs = [dict(row._mapping) for row in session.execute(stmt)]
+        session.commit()
+        return jobs
+
+    def concluir(self, job_id):
+        Job = self.Job
+        self.db.session.execute(
+            update(Job)
+            .where(Job.id == job_id)
+            .values(status='done', locked_by=None, locked_until=None, last_error=None, updated_at=agora())
+        )
+        self.db.session.commit()
+
+    def falhar(self, job_id, erro):
+        # Devolve o novo status ('pending' para nova tentativa ou 'dead')
+        Job = self.Job
+        job = self.db.session.get(Job, job_id)
+        if not job:
+            return None
+        now = agora()
+        job.last_error = str(erro)[:1000]
+        job.locked_by = None
+        job.locked_until = None
+        job.updated_at = now
+        if job.attempts >= job.max_attempts:
+            job.status = 'dead'
+            print(f"Job {job_id} movido para dead-letter após {job.attempts} tentativas: {erro}")
+        else:
+            # Backoff exponencial: 10s, 20s, 40s... limitado a 10 minutos
+            job.status = 'pending'
+            job.run_at = now + timedelta(seconds=min(10 * 2 ** (job.attempts - 1), 600))
+        status = job.status
+        self.db.session.commit()
+        return status
+
+    def devolver(self, job_id):
+        # Job reivindicado mas não executado (ex.: pool cheio): volta sem gastar tentativa
+        Job = self.Job
+        self.db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'running')
+            .values(status='pending', attempts=Job.attempts - 1, locked_by=None, locked_until=None, updated_at=agora())
+        )
+        self.db.session.commit()
+
+    def purgar(self, retencao_dias, lote=1000):
+        # Apaga jobs done/dead sem mudança há mais de `retencao_dias`, em lotes
+        Job = self.Job
+        limite = agora() - timedelta(days=retencao_dias)
+        total = 0
+        while True:
+            ids = select(Job.id).where(Job.status.in_(('done', 'dead')), Job.updated_at < limite).limit(lote)
+            resultado = self.db.session.execute(
+                delete(Job).where(Job.id.in_(ids.scalar_subquery())).execution_options(synchronize_session=False)
+            )
+            self.db.session.commit()
+            total += resultado.rowcount
+            if resultado.rowcount < lote:
+                return total
+
+    def stats(self):
+        Job = self.Job
+        rows = self.db.session.execute(select(Job.status, func.count()).group_by(Job.status)).all()
+        return {status: total for status, total in rows}
+
+
+class JobRunner:
+    """Thread que reivindica jobs do banco e os executa no WorkerPool local.
+
+    Só reivindica o que o pool consegue executar agora, então adicionar
+    processos/nós aumenta a vazão sem um worker acumular jobs dos outros.
+
+    `handler(job)` recebe o dict reivindicado; `ao_descartar(job)` é chamado
+    quando o job vai para a dead-letter. A cada `purge_interval` segundos o
+    runner apaga os jobs done/dead com mais de `retencao_dias`.
+    """
+
+    def __init__(self, job_queue, pool, handler, poll_interval=1.0, batch_size=10, ao_descartar=None,
+                 retencao_dias=7, purge_interval=3600):
+        self.queue = job_queue
+        self.pool = pool
+        self.handler = handler
+        self.ao_descartar = ao_descartar
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.retencao_dias = retencao_dias
+        self.purge_interval = purge_interval
+        self._ultimo_purge = None  # primeiro purge logo no início do runner
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._parando = threading.Event()
+        self._acordar = threading.Event()
+        self._em_execucao = 0
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+            self._parando.clear()
+            self._thread = threading.Thread(target=self._loop, name='job-runner', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._parando.set()
+        self._acordar.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def _capacidade(self):
+        with self._lock:
+            livre = self.pool.concurrency - self._em_execucao
+        return max(0, min(livre, self.batch_size))
+
+    def _purgar_se_preciso(self):
+        if not self.retencao_dias or (
+                self._ultimo_purge is not None and time.monotonic() - self._ultimo_purge < self.purge_interval):
+            return
+        self._ultimo_purge = time.monotonic()
+        with self.queue.app.app_context():
+            try:
+                removidos = self.queue.purgar(self.retencao_dias)
+                if removidos:
+                    print(f"Fila durável: {removidos} jobs antigos (done/dead) removidos.")
+            except Exception as e:
+                self.queue.db.session.rollback()
+                print(f"Erro ao purgar jobs antigos: {e}")
+
+    def _loop(self):
+        while not self._parando.is_set():
+            self._purgar_se_preciso()
+            reivindicados = 0
+            try:
+                limite = self._capacidade()
+                if limite:
+                    with self.queue.app.app_context():
+                        jobs = self.queue.reivindicar(limite, self.worker_id)
+                    reivindicados = len(jobs)
+                    for job in jobs:
+                        self._despachar(job)
+            except Exception as e:
+                print(f"Erro ao reivindicar jobs: {e}")
+
+            # Se pegou um lote cheio, provavelmente há mais: volta sem dormir.
+            # Senão espera o intervalo ou até um job terminar e liberar capacidade.
+            if reivindicados < self.batch_size:
+                self._acordar.wait(self.poll_interval)
+                self._acordar.clear()
+
+    def _despachar(self, job):
+        with self._lock:
+            self._em_execucao += 1
+        if not self.pool.submit(self._executar, job, tenant=job['user_id']):
+            with self._lock:
+                self._em_execucao -= 1
+            with self.queue.app.app_context():
+                self.queue.devolver(job['id'])
+
+    def _executar(self, job):
+        try:
+            with self.queue.app.app_context():
+                try:
+                    resultado = self.handler(job)
+                except Exception as e:
+                    self.queue.db.session.rollback()
+                    self._falhar(job, e)
+                    return
+                if resultado and resultado.get('status') == 'error':
+                    self._falhar(job, resultado.get('reason', 'error'))
+                else:
+                    self.queue.concluir(job['id'])
+        finally:
+            with self._lock:
+                self._em_execucao -= 1
+            self._acordar.set()
+
+
+    def _falhar(self, job, erro):
+        if self.queue.falhar(job['id'], erro) == 'dead' and self.ao_descartar:
+            try:
+                self.ao_descartar(job)
+            except Exception as e:
+                print(f"Erro ao descartar o job {job['id']}: {e}")
@@ -0,0 +1,208 @@
+import bisect
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Métricas no formato texto do Prometheus, agregadas entre workers do gunicorn.
+#
+# Cada processo acumula contadores/histogramas em memória (custo: um lock e um
+# bisect por observação) e grava um snapshot em METRICS_DIR de tempos em tempos.
+# O /metrics grava o snapshot do próprio processo, lê o de todos e soma.
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def diretorio_metricas():
+    return os.getenv('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'bot_metrics')
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, labels=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _chave(self, labels):
+        return tuple(str(labels.get(l, '')) for l in self.labels)
+
+    def snapshot(self):
+        with self._lock:
+            series = {json.dumps(k): (list(v) if isinstance(v, list) else v) for k, v in self._series.items()}
+        return {'type': self.tipo, 'help': self.ajuda, 'labels': list(self.labels), 'series': series}
+
+
+class Counter(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **labels):
+        chave = self._chave(labels)
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+
+class Gauge(_Metrica):
+    tipo = 'gauge'
+
+    def set(self, valor, **labels):
+        with self._lock:
+            self._series[self._chave(labels)] = valor
+
+
+class Histogram(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, labels=(), buckets=BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, valor, **labels):
+        chave = self._chave(labels)
+        idx = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                # [contagem por bucket..., +Inf, soma]
+                serie = self._series[chave] = [0] * (len(self.buckets) + 2)
+            serie[idx] += 1
+            serie[-1] += valor
+
+    @contextmanager
+    def time(self, **labels):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **labels)
+
+    def snapshot(self):
+        dados = super().snapshot()
+        dados['buckets'] = list(self.buckets)
+        return dados
+
+
+class Registry:
+    def __init__(self):
+        self._metricas = {}
+        self._coletores = []
+
+    def counter(self, nome, ajuda, labels=()):
+        return self._metricas.setdefault(nome, Counter(nome, ajuda, labels))
+
+    def gauge(self, nome, ajuda, labels=()):
+        return self._metricas.setdefault(nome, Gauge(nome, ajuda, labels))
+
+    def histogram(self, nome, ajuda, labels=(), buckets=BUCKETS_PADRAO):
+        return self._metricas.setdefault(nome, Histogram(nome, ajuda, labels, buckets))
+
+    def coletor(self, fn):
+        # fn() é chamada antes de cada snapshot (ex.: copiar stats de caches para gauges)
+        self._coletores.append(fn)
+        return fn
+
+    def snapshot(self):
+        for fn in self._coletores:
+            try:
+                fn()
+            except Exception as e:
+                print(f"Erro no coletor de métricas: {e}")
+        return {nome: m.snapshot() for nome, m in self._metricas.items()}
+
+    # --- Multiprocesso ---
+
+    def gravar(self):
+        diretorio = diretorio_metricas()
+        os.makedirs(diretorio, exist_ok=True)
+        caminho = os.path.join(diretorio, f"metrics-{os.getpid()}.json")
+        temporario = f"{caminho}.tmp"
+        with open(temporario, 'w') as f:
+            json.dump({'pid': os.getpid(), 'metrics': self.snapshot()}, f)
+        os.replace(temporario, caminho)  # rename atômico: leitores nunca veem arquivo pela metade
+
+    def agregar(self):
+        self.gravar()
+        total = {}
+        for caminho in glob.glob(os.path.join(diretorio_metricas(), 'metrics-*.json')):
+            try:
+                with open(caminho) as f:
+                    dados = json.load(f)
+            except (OSError, ValueError):
+                continue
+            vivo = _processo_vivo(dados.get('pid'))
+            for nome, metrica in dados.get('metrics', {}).items():
+                # Gauges de processos mortos não valem mais; contadores continuam somando
+                if metrica['type'] == 'gauge' and not vivo:
+                    continue
+                destino = total.setdefault(nome, {k: v for k, v in metrica.items() if k != 'series'} | {'series': {}})
+                for chave, valor in metrica['series'].items():
+                    atual = destino['series'].get(chave)
+                    if atual is None:
+                        destino['series'][chave] = valor
+                    elif isinstance(valor, list):
+                        destino['series'][chave] = [a + b for a, b in zip(atual, valor)]
+                    else:
+                        destino['series'][chave] = atual + valor
+        return total
+
+    def exportar(self):
+        return formatar_prometheus(self.agregar())
+
+
+def _processo_vivo(pid):
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def _formatar_labels(nomes, valores, extra=None):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def formatar_prometheus(metricas):
+    linhas = []
+    for nome in sorted(metricas):
+        m = metricas[nome]
+        linhas.append(f"# HELP {nome} {m['help']}")
+        linhas.append(f"# TYPE {nome} {m['type']}")
+        for chave, valor in sorted(m['series'].items()):
+            valores = json.loads(chave)
+            if m['type'] == 'histogram':
+                acumulado = 0
+                for limite, contagem in zip(m['buckets'] + ['+Inf'], valor[:-1]):
+                    acumulado += contagem
+                    le = 'le="%s"' % limite
+                    linhas.append(f"{nome}_bucket{_formatar_labels(m['labels'], valores, le)} {acumulado}")
+                linhas.append(f"{nome}_sum{_formatar_labels(m['labels'], valores)} {valor[-1]}")
+                linhas.append(f"{nome}_count{_formatar_labels(m['labels'], valores)} {acumulado}")
+            else:
+                linhas.append(f"{nome}{_formatar_labels(m['labels'], valores)} {valor}")
+    return '\n'.join(linhas) + '\n'
+
+
+def limpar_diretorio():
+    # Chamado uma vez no início do gunicorn (master): descarta métricas de execuções anteriores
+    for caminho in glob.glob(os.path.join(diretorio_metricas(), 'metrics-*.json*')):
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
@@ -0,0 +1,178 @@
+import zlib
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+# Migrações versionadas do schema.
+#
+# A tabela schema_version guarda as versões aplicadas. No boot, uma única
+# consulta compara a versão do banco com a última da lista; só se houver
+# pendências o processo pega um lock (pg_advisory_lock no PostgreSQL,
+# BEGIN EXCLUSIVE no SQLite), confere de novo e aplica o que falta. Vários
+# workers/nós subindo juntos: um migra, os outros esperam o lock e pulam.
+#
+# Para mudar o schema, acrescente uma função ao final de MIGRACOES (nunca
+# altere uma já publicada). Os passos são idempotentes porque bancos antigos
+# podem já ter parte do schema (create_all + ALTERs manuais de antes).
+
+LOCK_ID = zlib.crc32(b'bot-ml-schema-migrations')
+
+
+def _criar_tabela(conn, metadata, nome):
+    # Cria a tabela (com os índices declarados no modelo) se ainda não existir
+    metadata.tables[nome].create(conn, checkfirst=True)
+
+
+def _adicionar_coluna(conn, tabela, coluna, tipo):
+    colunas = {c['name'] for c in inspect(conn).get_columns(tabela)}
+    if coluna not in colunas:
+        print(f"Migrando banco de dados: adicionando coluna '{tabela}.{coluna}'...")
+        conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}"))
+
+
+def _criar_indice(conn, nome, tabela, colunas):
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({colunas})"))
+
+
+def m001_users(conn, metadata):
+    _criar_tabela(conn, metadata, 'users')
+    # Antes em fix_db.py / init_db()
+    _adicionar_coluna(conn, 'users', 'is_active', 'BOOLEAN DEFAULT TRUE')
+    _adicionar_coluna(conn, 'users', 'expires_at', 'TIMESTAMP')
+
+
+def m002_jobs(conn, metadata):
+    _criar_tabela(conn, metadata, 'jobs')
+
+
+def m003_idempotency_keys(conn, metadata):
+    _criar_tabela(conn, metadata, 'idempotency_keys')
+
+
+def m004_users_admin_e_tenant_stats(conn, metadata):
+    _adicionar_coluna(conn, 'users', 'created_at', 'TIMESTAMP')
+    _adicionar_coluna(conn, 'users', 'updated_at', 'TIMESTAMP')
+    _criar_indice(conn, 'ix_users_is_active_updated_at', 'users', 'is_active, updated_at')
+    _criar_indice(conn, 'ix_users_created_at', 'users', 'created_at')
+    _criar_tabela(conn, metadata, 'tenant_stats')
+
+
+def m005_question_history(conn, metadata):
+    _criar_tabela(conn, metadata, 'question_history')
+
+
+def m006_question_history_queue_wait(conn, metadata):
+    _adicionar_coluna(conn, 'question_history', 'queue_wait_ms', 'FLOAT')
+
+
+def m007_auto_reply_rules(conn, metadata):
+    _criar_tabela(conn, metadata, 'auto_reply_rules')
+
+
+def m008_answer_outbox(conn, metadata):
+    _criar_tabela(conn, metadata, 'answer_outbox')
+
+
+def m009_item_snapshots(conn, metadata):
+    _criar_tabela(conn, metadata, 'item_snapshots')
+    _criar_tabela(conn, metadata, 'item_prefetch_state')
+
+
+def m010_jobs_notification_id(conn, metadata):
+    _adicionar_coluna(conn, 'jobs', 'notification_id', 'VARCHAR(100)')
+
+
+MIGRACOES = [
+    (1, 'users (is_active, expires_at)', m001_users),
+    (2, 'jobs', m002_jobs),
+    (3, 'idempotency_keys', m003_idempotency_keys),
+    (4, 'users created_at/updated_at + tenant_stats', m004_users_admin_e_tenant_stats),
+    (5, 'question_history', m005_question_history),
+    (6, 'question_history.queue_wait_ms', m006_question_history_queue_wait),
+    (7, 'auto_reply_rules', m007_auto_reply_rules),
+    (8, 'answer_outbox', m008_answer_outbox),
+    (9, 'item_snapshots + item_prefetch_state', m009_item_snapshots),
+    (10, 'jobs.notification_id', m010_jobs_notification_id),
+]
+
+SQL_CRIAR_VERSAO = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+)
+"""
+
+
+class Migrador:
+    def __init__(self, engine, metadata, migracoes=MIGRACOES):
+        self.engine = engine
+        self.metadata = metadata
+        self.migracoes = sorted(migracoes, key=lambda m: m[0])
+        self.ultima = self.migracoes[-1][0] if self.migracoes else 0
+
+    @staticmethod
+    def _versao(conn):
+        if not inspect(conn).has_table('schema_version'):
+            return 0
+        return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+    def versao_atual(self):
+        with self.engine.connect() as conn:
+            return self._versao(conn)
+
+    def migrar(self):
+        # Caminho rápido (todo boot): uma consulta e nenhum lock
+        if self.versao_atual() >= self.ultima:
+            return 0
+        if self.engine.dialect.name == 'postgresql':
+            return self._migrar_postgres()
+        return self._migrar_sqlite()
+
+    def _aplicar(self, conn, versao_atual):
+        aplicadas = 0
+        for versao, descricao, fn in self.migracoes:
+            if versao <= versao_atual:
+                continue
+            print(f"Aplicando migração {versao}: {descricao}...")
+            fn(conn, self.metadata)
+            conn.execute(
+                text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {'v': versao, 'd': descricao, 't': datetime.utcnow()}
+            )
+            aplicadas += 1
+            yield aplicadas
+
+    def _migrar_postgres(self):
+        aplicadas = 0
+        with self.engine.connect() as conn:
+            # Lock de sessão: atravessa os commits de cada migração
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {'id': LOCK_ID})
+            try:
+                conn.execute(text(SQL_CRIAR_VERSAO))
+                conn.commit()
+                # Outro processo pode ter migrado enquanto esperávamos o lock
+                for aplicadas in self._aplicar(conn, self._versao(conn)):
+                    conn.commit()  # DDL é transacional: cada versão entra inteira ou não entra
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': LOCK_ID})
+                conn.commit()
+        return aplicadas
+
+    def _migrar_sqlite(self):
+        aplicadas = 0
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            # Sem advisory lock no SQLite: a transação exclusiva bloqueia os outros processos
+            conn.exec_driver_sql("BEGIN EXCLUSIVE")
+            try:
+                conn.execute(text(SQL_CRIAR_VERSAO))
+                for aplicadas in self._aplicar(conn, self._versao(conn)):
+                    pass
+                conn.exec_driver_sql("COMMIT")
+            except Exception:
+                conn.exec_driver_sql("ROLLBACK")
+                raise
+        return aplicadas
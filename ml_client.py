@@ -0,0 +1,452 @@
+import asyncio
+import email.utils
+import os
+import random
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from cache import TTLCache
+
+ML_API_URL = os.getenv('ML_API_URL', 'https://api.mercadolibre.com')
+
+# Status que valem nova tentativa (rate limit e falhas do lado do ML)
+STATUS_RETRY = {429, 500, 502, 503, 504}
+
+# POST (/answers, /oauth/token) não é idempotente: um 5xx ou timeout de leitura
+# pode ter sido aceito pelo ML, e repetir publicaria a resposta duas vezes.
+# Nesses métodos só se repete 429 e falha de conexão (nada foi enviado).
+METODOS_IDEMPOTENTES = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+STATUS_RETRY_NAO_IDEMPOTENTE = {429}
+
+
+def status_retry(method):
+    return STATUS_RETRY if method in METODOS_IDEMPOTENTES else STATUS_RETRY_NAO_IDEMPOTENTE
+
+
+def sem_envio(erro):
+    # True se a requisição (requests) falhou antes de sair: recusa ou timeout de conexão
+    if isinstance(erro, requests.ConnectTimeout):
+        return True
+    motivo = getattr(erro.args[0], 'reason', None) if erro.args else None
+    return isinstance(motivo, NewConnectionError)
+
+
+class MLApiError(Exception):
+    def __init__(self, mensagem, status_code=None, body=None, endpoint=None, retry_after=None):
+        super().__init__(mensagem)
+        self.status_code = status_code
+        self.body = body
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def retry_after(response):
+    # Retry-After em segundos ("30") ou data HTTP; None se ausente/inválido
+    valor = response.headers.get('Retry-After') if response is not None else None
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket simples: `rate` requisições por segundo com rajada de `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self._tokens = self.capacity
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (agora - self._ultimo) * self.rate)
+        self._ultimo = agora
+
+    def _tentar(self):
+        # Consome um token se houver; senão retorna quanto falta esperar
+        with self._lock:
+            self._repor()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        # Bloqueia até ter um token; retorna quanto tempo esperou
+        espera_total = 0.0
+        while True:
+            espera = self._tentar()
+            if not espera:
+                return espera_total
+            time.sleep(espera)
+            espera_total += espera
+
+    async def acquire_async(self):
+        # Mesma coisa sem bloquear o event loop (o bucket é compartilhado com o cliente síncrono)
+        espera_total = 0.0
+        while True:
+            espera = self._tentar()
+            if not espera:
+                return espera_total
+            await asyncio.sleep(espera)
+            espera_total += espera
+
+
+class LatencyStats:
+    """Hook padrão: agrega latência por endpoint para a rota /stats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dados = {}
+
+    def __call__(self, endpoint, method, status, elapsed, attempt):
+        chave = f"{method} {endpoint}"
+        with self._lock:
+            d = self._dados.setdefault(chave, {'count': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            d['count'] += 1
+            if status is None or status >= 400:
+                d['errors'] += 1
+            if attempt > 1:
+                d['retries'] += 1
+            ms = elapsed * 1000
+            d['total_ms'] += ms
+            d['max_ms'] = max(d['max_ms'], ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                chave: {
+                    'count': d['count'],
+                    'errors': d['errors'],
+                    'retries': d['retries'],
+                    'avg_ms': round(d['total_ms'] / d['count'], 1) if d['count'] else 0,
+                    'max_ms': round(d['max_ms'], 1),
+                }
+                for chave, d in self._dados.items()
+            }
+
+
+class MercadoLivreClient:
+    """Cliente único da API do Mercado Livre.
+
+    - Session compartilhada com pool de conexões (keep-alive, sem novo TLS por chamada)
+    - Timeout em toda chamada (connect, read)
+    - Rate limit por token bucket: um global da aplicação e um por vendedor
+    - Retry com backoff exponencial e jitter em 429/5xx (respeita Retry-After);
+      POST só repete 429 e falha de conexão
+    - Hooks chamados a cada tentativa com (endpoint, method, status, elapsed, attempt)
+    """
+
+    def __init__(self, base_url=ML_API_URL, timeout=(3.05, 10), pool_size=20,
+                 app_rate=20, app_burst=40, seller_rate=5, seller_burst=10,
+                 max_retries=3, backoff_base=0.5, backoff_max=8, seller_buckets_max=10000):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.seller_rate = seller_rate
+        self.seller_burst = seller_burst
+        self.hooks = []
+        # on_unauthorized(seller_id, token) -> novo token ou None (renovação após 401)
+        self.on_unauthorized = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._app_bucket = TokenBucket(app_rate, app_burst) if app_rate else None
+        # LRU: o bucket expulso é de um vendedor parado, que já estaria cheio de novo
+        self._seller_buckets = TTLCache(maxsize=seller_buckets_max, ttl=None, name='ml_seller_buckets')
+        self._buckets_lock = threading.Lock()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def _seller_bucket(self, seller_id):
+        if not seller_id or not self.seller_rate:
+            return None
+        with self._buckets_lock:
+            bucket = self._seller_buckets.get(seller_id)
+            if bucket is None:
+                bucket = TokenBucket(self.seller_rate, self.seller_burst)
+                self._seller_buckets.set(seller_id, bucket)
+            return bucket
+
+    @staticmethod
+    def endpoint_label(path):
+        # /items/MLB123/description -> /items/{id}/description (baixa cardinalidade)
+        path = path.split('?', 1)[0]
+        partes = [('{id}' if re.search(r'\d', p) else p) for p in path.strip('/').split('/')]
+        return '/' + '/'.join(partes)
+
+    def _backoff(self, tentativa, response=None):
+        espera = retry_after(response)
+        if espera is not None:
+            return min(espera, self.backoff_max)
+        # Full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** tentativa))
+
+    def _notificar(self, endpoint, method, status, elapsed, attempt):
+        for hook in self.hooks:
+            try:
+                hook(endpoint, method, status, elapsed, attempt)
+            except Exception as e:
+                print(f"Erro no hook do cliente ML: {e}")
+
+    def request(self, method, path, token=None, seller_id=None, timeout=None, retries=None, **kwargs):
+        url = f"{self.base_url}{path}"
+        endpoint = self.endpoint_label(path)
+        headers = kwargs.pop('headers', {})
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        max_retries = self.max_retries if retries is None else retries
+        renovou = False
+
+        tentativa = 0
+        while True:
+            tentativa += 1
+            if self._app_bucket:
+                self._app_bucket.acquire()
+            bucket = self._seller_bucket(seller_id)
+            if bucket:
+                bucket.acquire()
+
+            inicio = time.monotonic()
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=timeout or self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._notificar(endpoint, method, None, time.monotonic() - inicio, tentativa)
+                if tentativa > max_retries or (method not in METODOS_IDEMPOTENTES and not sem_envio(e)):
+                    raise MLApiError(f"{method} {endpoint} falhou: {e}", endpoint=endpoint) from e
+                time.sleep(self._backoff(tentativa))
+                continue
+
+            self._notificar(endpoint, method, response.status_code, time.monotonic() - inicio, tentativa)
+
+            if response.status_code in status_retry(method) and tentativa <= max_retries:
+                time.sleep(self._backoff(tentativa, response))
+                continue
+
+            # Token expirado: uma única renovação + nova tentativa
+            if response.status_code == 401 and token and seller_id and self.on_unauthorized and not renovou:
+                renovou = True
+                novo_token = self.on_unauthorized(seller_id, token)
+                if novo_token and novo_token != token:
+                    token = novo_token
+                    headers['Authorization'] = f'Bearer {token}'
+                    continue
+
+            if response.status_code >= 400:
+                raise MLApiError(
+                    f"{method} {endpoint} retornou {response.status_code}",
+                    status_code=response.status_code,
+                    body=response.text,
+                    endpoint=endpoint,
+                    retry_after=retry_after(response)
+                )
+            return response
+
+    def get(self, path, token=None, **kwargs):
+        return self.request('GET', path, token=token, **kwargs).json()
+
+    def post(self, path, token=None, **kwargs):
+        return self.request('POST', path, token=token, **kwargs)
+
+    # --- Endpoints usados pelo bot ---
+
+    def obter_pergunta(self, resource, token, seller_id=None):
+        return self.get(resource, token, seller_id=seller_id)
+
+    def obter_item(self, item_id, token, seller_id=None):
+        return self.get(f"/items/{item_id}", token, seller_id=seller_id)
+
+    def obter_descricao(self, item_id, token, seller_id=None):
+        return self.get(f"/items/{item_id}/description", token, seller_id=seller_id)
+
+    def obter_itens(self, item_ids, token, seller_id=None, attributes=None):
+        # Multiget: até 20 ids por chamada; devolve [{'code': 200, 'body': {...}}, ...]
+        params = {'ids': ','.join(item_ids)}
+        if attributes:
+            params['attributes'] = attributes
+        return self.get('/items', token, seller_id=seller_id, params=params)
+
+    def listar_anuncios(self, seller_id, token, status='active', scroll_id=None, limit=100):
+        # search_type=scan: paginação por scroll_id, sem o teto de 1000 do offset
+        params = {'search_type': 'scan', 'status': status, 'limit': limit}
+        if scroll_id:
+            params['scroll_id'] = scroll_id
+        return self.get(f"/users/{seller_id}/items/search", token, seller_id=seller_id, params=params)
+
+    def buscar_perguntas(self, seller_id, token, status='UNANSWERED', offset=0, limit=50):
+        params = {
+            'seller_id': seller_id,
+            'status': status,
+            'api_version': 4,
+            'sort_fields': 'date_created',
+            'sort_types': 'ASC',
+            'offset': offset,
+            'limit': limit
+        }
+        return self.get('/questions/search', token, seller_id=seller_id, params=params)
+
+    def enviar_resposta(self, question_id, texto, token, seller_id=None, retries=None):
+        payload = {'question_id': question_id, 'text': texto}
+        return self.post('/answers', token, json=payload, seller_id=seller_id, retries=retries)
+
+    def trocar_code(self, client_id, client_secret, code, redirect_uri):
+        data = {
+            'grant_type': 'authorization_code',
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'code': code,
+            'redirect_uri': redirect_uri
+        }
+        return self.post('/oauth/token', data=data).json()
+
+    def renovar_token(self, client_id, client_secret, refresh_token):
+        data = {
+            'grant_type': 'refresh_token',
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'refresh_token': refresh_token
+        }
+        return self.post('/oauth/token', data=data).json()
+
+
+class AsyncMercadoLivreClient:
+    """Versão asyncio (httpx) do cliente, para o pipeline assíncrono.
+
+    Reaproveita do cliente síncrono a configuração, os token buckets (o limite
+    de taxa vale para os dois juntos), os hooks e o on_unauthorized.
+    """
+
+    def __init__(self, base, max_connections=200):
+        self.base = base
+        self.max_connections = max_connections
+        self._client = None
+        self._loop = None
+
+    def _http(self):
+        # Um AsyncClient por event loop (não pode ser usado fora do loop que o criou)
+        import httpx
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            connect, read = self.base.timeout
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read, connect=connect),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            )
+            self._loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method, path, token=None, seller_id=None, timeout=None, retries=None, **kwargs):
+        import httpx  # só o modo assíncrono precisa dele
+        base = self.base
+        url = f"{base.base_url}{path}"
+        endpoint = base.endpoint_label(path)
+        headers = kwargs.pop('headers', {})
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        if timeout:
+            kwargs['timeout'] = httpx.Timeout(timeout[1], connect=timeout[0]) if isinstance(timeout, tuple) else timeout
+        max_retries = base.max_retries if retries is None else retries
+        renovou = False
+
+        tentativa = 0
+        while True:
+            tentativa += 1
+            if base._app_bucket:
+                await base._app_bucket.acquire_async()
+            bucket = base._seller_bucket(seller_id)
+            if bucket:
+                await bucket.acquire_async()
+
+            inicio = time.monotonic()
+            try:
+                response = await self._http().request(method, url, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                base._notificar(endpoint, method, None, time.monotonic() - inicio, tentativa)
+                sem_envio_async = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                if tentativa > max_retries or (method not in METODOS_IDEMPOTENTES and not sem_envio_async):
+                    raise MLApiError(f"{method} {endpoint} falhou: {e}", endpoint=endpoint) from e
+                await asyncio.sleep(base._backoff(tentativa))
+                continue
+
+            base._notificar(endpoint, method, response.status_code, time.monotonic() - inicio, tentativa)
+
+            if response.status_code in status_retry(method) and tentativa <= max_retries:
+                await asyncio.sleep(base._backoff(tentativa, response))
+                continue
+
+            # Token expirado: uma única renovação (síncrona, com lock no banco) numa thread
+            if response.status_code == 401 and token and seller_id and base.on_unauthorized and not renovou:
+                renovou = True
+                novo_token = await asyncio.to_thread(base.on_unauthorized, seller_id, token)
+                if novo_token and novo_token != token:
+                    token = novo_token
+                    headers['Authorization'] = f'Bearer {token}'
+                    continue
+
+            if response.status_code >= 400:
+                raise MLApiError(
+                    f"{method} {endpoint} retornou {response.status_code}",
+                    status_code=response.status_code,
+                    body=response.text,
+                    endpoint=endpoint,
+                    retry_after=retry_after(response)
+                )
+            return response
+
+    async def get(self, path, token=None, **kwargs):
+        return (await self.request('GET', path, token=token, **kwargs)).json()
+
+    async def post(self, path, token=None, **kwargs):
+        return await self.request('POST', path, token=token, **kwargs)
+
+    async def obter_pergunta(self, resource, token, seller_id=None):
+        return await self.get(resource, token, seller_id=seller_id)
+
+    async def obter_item(self, item_id, token, seller_id=None):
+        return await self.get(f"/items/{item_id}", token, seller_id=seller_id)
+
+    async def obter_descricao(self, item_id, token, seller_id=None):
+        return await self.get(f"/items/{item_id}/description", token, seller_id=seller_id)
+
+    async def enviar_resposta(self, question_id, texto, token, seller_id=None, retries=None):
+        payload = {'question_id': question_id, 'text': texto}
+        return await self.post('/answers', token, json=payload, seller_id=seller_id, retries=retries)
+
+
+def criar_cliente():
+    # Configuração por variáveis de ambiente (valores padrão conservadores)
+    return MercadoLivreClient(
+        base_url=ML_API_URL,
+        timeout=(float(os.getenv('ML_CONNECT_TIMEOUT', '3.05')), float(os.getenv('ML_READ_TIMEOUT', '10'))),
+        pool_size=int(os.getenv('ML_POOL_SIZE', '20')),
+        app_rate=float(os.getenv('ML_APP_RATE', '20')),
+        app_burst=float(os.getenv('ML_APP_BURST', '40')),
+        seller_rate=float(os.getenv('ML_SELLER_RATE', '5')),
+        seller_burst=float(os.getenv('ML_SELLER_BURST', '10')),
+        max_retries=int(os.getenv('ML_MAX_RETRIES', '3')),
+        seller_buckets_max=int(os.getenv('ML_SELLER_BUCKETS_MAX', '10000'))
+    )
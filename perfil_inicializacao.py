@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Relatório de cold start: quanto custa importar o app e quanto tempo leva até
+# a primeira pergunta respondida num processo novo (como um dyno acordando).
+#
+#   python perfil_inicializacao.py                 # relatório no terminal
+#   python perfil_inicializacao.py --json out.json # para comparar entre commits
+#   python perfil_inicializacao.py --no-admin      # como o worker.py sobe
+#
+# Cada medição roda num interpretador novo (nada em cache de imports). O ML e a
+# OpenAI são os servidores falsos do benchmark.py, com latência fixa.
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _ambiente(admin, db_path):
+    env = dict(os.environ)
+    env['ENABLE_ADMIN'] = '1' if admin else '0'
+    env.setdefault('OPENAI_API_KEY', 'perfil')
+    env['DATABASE_URL'] = f"sqlite:///{db_path}"
+    return env
+
+
+def perfil_imports(admin, top):
+    # python -X importtime: "self | cumulativo | módulo" em µs, no stderr
+    db_path = os.path.join(tempfile.mkdtemp(prefix='perfil-'), 'perfil.db')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=DIRETORIO, env=_ambiente(admin, db_path), capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import app falhou:\n{proc.stderr[-2000:]}")
+
+    modulos = []
+    for linha in proc.stderr.splitlines():
+        if not linha.startswith('import time:') or 'self [us]' in linha:
+            continue
+        proprio, cumulativo, nome = linha[len('import time:'):].split('|')
+        profundidade = (len(nome) - len(nome.lstrip())) // 2
+        modulos.append({
+            'module': nome.strip(),
+            'depth': profundidade,
+            'self_ms': int(proprio) / 1000,
+            'cumulative_ms': int(cumulativo) / 1000,
+        })
+
+    app_mod = next((m for m in modulos if m['module'] == 'app'), None)
+    diretos = [m for m in modulos if m['depth'] == 1]
+    return {
+        'import_app_ms': app_mod['cumulative_ms'] if app_mod else None,
+        'top_direct_imports': sorted(diretos, key=lambda m: m['cumulative_ms'], reverse=True)[:top],
+        'top_self': sorted(modulos, key=lambda m: m['self_ms'], reverse=True)[:top],
+    }
+
+
+def _primeira_resposta(admin):
+    # Roda no processo filho: sobe os fakes, importa o app e responde uma pergunta
+    inicio = time.perf_counter()
+    import benchmark
+
+    fake_ml = benchmark.FakeMercadoLivre('fixed:20').start()
+    fake_openai = benchmark.FakeOpenAI('fixed:100').start()
+    db_path = os.path.join(tempfile.mkdtemp(prefix='perfil-'), 'perfil.db')
+    benchmark.preparar_ambiente(fake_ml.url, fake_openai.url, db_path)
+    os.environ['ENABLE_ADMIN'] = '1' if admin else '0'
+    t_fakes = time.perf_counter()
+
+    import app as bot  # medido aqui; subir_app reaproveita o módulo
+    t_import = time.perf_counter()
+    # O que o gunicorn.conf.py faz no master antes do fork (migrações + SDK da OpenAI)
+    _, servidor, url = benchmark.subir_app(1)
+    bot.cliente_openai()
+    t_pronto = time.perf_counter()
+
+    import requests
+    sys.stdout = open(os.devnull, 'w')
+    envio = time.perf_counter()
+    requests.post(f"{url}/notifications", json={'topic': 'questions', 'user_id': 1000, 'resource': '/questions/1'}, timeout=30)
+    t_ack = time.perf_counter()
+    faltando = benchmark.aguardar_respostas(fake_ml, [1], 30)
+    t_resposta = time.perf_counter()
+    sys.stdout = sys.__stdout__
+
+    latencia_fakes = 0.02 * 3 + 0.1  # pergunta + item + resposta no ML, uma chamada à OpenAI
+    print(json.dumps({
+        'import_app_ms': round((t_import - t_fakes) * 1000, 1),
+        'preload_ms': round((t_pronto - t_import) * 1000, 1),
+        'first_ack_ms': round((t_ack - envio) * 1000, 1),
+        'first_answer_ms': round((t_resposta - envio) * 1000, 1),
+        'first_answer_overhead_ms': round((t_resposta - envio - latencia_fakes) * 1000, 1),
+        'time_to_first_answer_ms': round((t_resposta - t_fakes) * 1000, 1),
+        'harness_ms': round((t_fakes - inicio) * 1000, 1),
+        'answered': not faltando,
+    }))
+    servidor.shutdown()
+
+
+def medir_primeira_resposta(admin):
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--_filho'] + ([] if admin else ['--no-admin']),
+        cwd=DIRETORIO, capture_output=True, text=True, timeout=120
+    )
+    linhas = [l for l in proc.stdout.splitlines() if l.startswith('{')]
+    if proc.returncode != 0 or not linhas:
+        raise RuntimeError(f"medição falhou:\n{proc.stderr[-2000:]}")
+    return json.loads(linhas[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Perfil de inicialização do app (imports e primeira resposta)')
+    parser.add_argument('--top', type=int, default=15, help='quantos módulos listar')
+    parser.add_argument('--no-admin', action='store_true', help='ENABLE_ADMIN=0 (sem flask-admin)')
+    parser.add_argument('--json', help='grava o relatório neste arquivo')
+    parser.add_argument('--_filho', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._filho:
+        _primeira_resposta(not args.no_admin)
+        return
+
+    admin = not args.no_admin
+    imports = perfil_imports(admin, args.top)
+    primeira = medir_primeira_resposta(admin)
+
+    print(f"import app: {imports['import_app_ms']:.0f} ms (admin {'ligado' if admin else 'desligado'})")
+    print(f"\n{'import direto':<32}{'cumulativo':>12}{'próprio':>10}  (ms)")
+    for m in imports['top_direct_imports']:
+        print(f"{m['module']:<32}{m['cumulative_ms']:>12.1f}{m['self_ms']:>10.1f}")
+    print(f"\n{'mais lentos (próprio)':<32}{'próprio':>12}")
+    for m in imports['top_self']:
+        print(f"{m['module']:<32}{m['self_ms']:>12.1f}")
+
+    print("\nPrimeira pergunta num processo novo:")
+    for chave in ('import_app_ms', 'preload_ms', 'first_ack_ms', 'first_answer_ms',
+                  'first_answer_overhead_ms', 'time_to_first_answer_ms'):
+        print(f"  {chave:<28}{primeira[chave]:>10}")
+    if not primeira['answered']:
+        print("  Aviso: a pergunta não foi respondida a tempo.")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'admin': admin, 'imports': imports, 'first_answer': primeira}, f, indent=2)
+        print(f"\nRelatório salvo em {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import threading
+import time
+
+from escalonador import ESPERA_FILA
+
+
+class AsyncPool:
+    """Executa corrotinas num event loop próprio, numa thread de background.
+
+    Mesma interface do WorkerPool (start/submit/shutdown/stats), mas cada tarefa
+    é uma corrotina: enquanto uma espera o ML ou a OpenAI as outras avançam, então
+    um processo mantém centenas de perguntas em andamento sem uma thread para cada.
+    Acima de `max_in_flight` tarefas, submit() recusa (load shedding).
+
+    Com um `escalonador` (FairScheduler), acima do limite as tarefas esperam
+    numa fila por vendedor em vez de serem recusadas, e as vagas que abrem são
+    distribuídas entre os vendedores (submit(..., tenant=user_id)).
+    """
+
+    def __init__(self, max_in_flight=500, name='async', ao_parar=None, escalonador=None):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.name = name
+        # ao_parar(): corrotina chamada no loop antes de ele parar (fechar clientes HTTP)
+        self.ao_parar = ao_parar
+        self.escalonador = escalonador
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._parando = threading.Event()
+        self._em_andamento = 0
+        self._pico = 0
+        self._futuros = set()
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        # Loop criado por processo, como as threads do WorkerPool (fork do gunicorn)
+        with self._lock:
+            if self._pid == os.getpid() and self._thread:
+                return
+            self._pid = os.getpid()
+            self._parando.clear()
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit(self, coro_fn, *args, tenant=None, **kwargs):
+        if self._parando.is_set():
+            with self._lock:
+                self.rejected += 1
+            return False
+        self.start()
+        if self.escalonador is not None:
+            if not self.escalonador.put_nowait(tenant, (coro_fn, args, kwargs)):
+                with self._lock:
+                    self.rejected += 1
+                return False
+            with self._lock:
+                self.submitted += 1
+            self._bombear()
+            return True
+        with self._lock:
+            if self._em_andamento >= self.max_in_flight:
+                self.rejected += 1
+                return False
+            self._em_andamento += 1
+            self._pico = max(self._pico, self._em_andamento)
+            self.submitted += 1
+        self._agendar(coro_fn, args, kwargs)
+        return True
+
+    def _agendar(self, coro_fn, args, kwargs, tenant=None, espera=None):
+        futuro = asyncio.run_coroutine_threadsafe(self._executar(coro_fn, args, kwargs, tenant, espera), self._loop)
+        with self._lock:
+            self._futuros.add(futuro)
+        futuro.add_done_callback(self._descartar)
+
+    def _bombear(self):
+        # Ocupa as vagas livres com as próximas tarefas do escalonador
+        while True:
+            with self._lock:
+                if self._em_andamento >= self.max_in_flight:
+                    return
+                proximo = self.escalonador.get_nowait()
+                if proximo is None:
+                    return
+                self._em_andamento += 1
+                self._pico = max(self._pico, self._em_andamento)
+            tenant, (coro_fn, args, kwargs), espera = proximo
+            self._agendar(coro_fn, args, kwargs, tenant, espera)
+
+    def _descartar(self, futuro):
+        with self._lock:
+            self._futuros.discard(futuro)
+
+    async def _executar(self, coro_fn, args, kwargs, tenant=None, espera=None):
+        ok = False
+        ESPERA_FILA.set(espera)  # contexto próprio de cada tarefa
+        try:
+            await coro_fn(*args, **kwargs)
+            ok = True
+        except Exception as e:
+            print(f"Erro na tarefa assíncrona de {self.name}: {e}")
+        finally:
+            with self._lock:
+                self._em_andamento -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            if self.escalonador is not None:
+                self.escalonador.concluir(tenant)
+                self._bombear()
+
+    def shutdown(self, timeout=25):
+        self._parando.set()
+        if self._pid != os.getpid() or not self._loop:
+            return
+        if self._em_andamento or self._na_fila():
+            print(f"Drenando {self.name}: {self._na_fila()} na fila, {self._em_andamento} em andamento...")
+        prazo = time.monotonic() + timeout
+        while (self._em_andamento or self._na_fila()) and time.monotonic() < prazo:
+            time.sleep(0.05)
+        if self._na_fila():
+            print(f"Aviso: {self._na_fila()} tarefas descartadas no desligamento de {self.name}.")
+        if self._em_andamento:
+            print(f"Aviso: {self._em_andamento} tarefas abandonadas no desligamento de {self.name}.")
+            # Cancela o que sobrou antes de fechar os clientes HTTP que elas usam
+            with self._lock:
+                restantes = list(self._futuros)
+            for futuro in restantes:
+                futuro.cancel()
+            time.sleep(0.1)
+        if self.ao_parar:
+            try:
+                asyncio.run_coroutine_threadsafe(self.ao_parar(), self._loop).result(2)
+            except Exception as e:
+                # O processo está saindo: não vale segurar o desligamento por isso
+                print(f"Erro ao encerrar {self.name}: {e!r}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+        self._loop = None  # segundo shutdown (ex.: atexit depois do benchmark) não faz nada
+
+    def _na_fila(self):
+        return self.escalonador.qsize() if self.escalonador is not None else 0
+
+    def stats(self):
+        return {
+            'max_in_flight': self.max_in_flight,
+            'in_flight': self._em_andamento,
+            'queue_depth': self._na_fila(),
+            'peak_in_flight': self._pico,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+    def stats_tenants(self, top=20):
+        return self.escalonador.stats(top) if self.escalonador is not None else None
@@ -0,0 +1,427 @@
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, exists, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from ml_client import MLApiError
+
+# Campos do item usados no prompt e nos templates (contexto_item.py, intencoes.py)
+ATRIBUTOS = (
+    'id,seller_id,status,title,price,currency_id,permalink,available_quantity,'
+    'condition,shipping,warranty,attributes,last_updated'
+)
+CAMPOS = tuple(c for c in ATRIBUTOS.split(',') if c not in ('id', 'seller_id', 'status', 'last_updated'))
+
+MULTIGET_MAX = 20
+PAGINA_ANUNCIOS = 100
+
+
+def agora():
+    return datetime.utcnow()
+
+
+def em_lotes(ids, tamanho=MULTIGET_MAX):
+    return [ids[i:i + tamanho] for i in range(0, len(ids), tamanho)]
+
+
+class EstoqueItens:
+    """Cópia local dos anúncios (tabela `item_snapshots`), compartilhada entre processos.
+
+    Guarda só os campos de CAMPOS, em JSON, mais a descrição (buscada à parte,
+    sob demanda), o last_updated do ML, que decide o que o prefetch regrava, e
+    fetched_at, a última vez que o item foi conferido na API.
+    """
+
+    def __init__(self, app, db, model):
+        self.app = app
+        self.db = db
+        self.Item = model
+
+    def obter(self, seller_id, item_id):
+        # (dados, descrição, descrição_buscada) ou None
+        linha = self.db.session.get(self.Item, item_id)
+        if linha is None or (seller_id is not None and linha.seller_id != seller_id):
+            return None
+        return json.loads(linha.data), linha.description, linha.description_fetched
+
+    def versoes(self, seller_id):
+        # item_id -> (last_updated, fetched_at)
+        Item = self.Item
+        return {item_id: (last_updated, fetched_at) for item_id, last_updated, fetched_at in self.db.session.execute(
+            select(Item.item_id, Item.last_updated, Item.fetched_at).where(Item.seller_id == seller_id)
+        ).all()}
+
+    def _upsert(self):
+        # INSERT ... ON CONFLICT (item_id) DO UPDATE; None em bancos sem suporte
+        dialeto = self.db.engine.dialect.name
+        if dialeto == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as insert_dialeto
+        elif dialeto == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as insert_dialeto
+        else:
+            return None
+        stmt = insert_dialeto(self.Item)
+        colunas = [c.name for c in self.Item.__table__.columns if c.name != 'item_id']
+        return stmt.on_conflict_do_update(index_elements=['item_id'], set_={c: stmt.excluded[c] for c in colunas})
+
+    def gravar(self, seller_id, itens, lote=500):
+        # itens: corpos do multiget. Upsert: o item_id pode já existir com outro
+        # vendedor (anúncio transferido, linha velha) sem derrubar o lote inteiro.
+        now = agora()
+        linhas = [{
+            'item_id': item['id'],
+            'seller_id': seller_id,
+            'data': json.dumps({c: item.get(c) for c in CAMPOS}, ensure_ascii=False, separators=(',', ':')),
+            'description': None,
+            'description_fetched': False,
+            'last_updated': item.get('last_updated'),
+            'fetched_at': now,
+        } for item in itens]
+        session = self.db.session
+        stmt = self._upsert()
+        for parte in em_lotes(linhas, lote):
+            if stmt is not None:
+                session.execute(stmt, parte)
+            else:
+                for linha in parte:
+                    session.merge(self.Item(**linha))
+            session.commit()
+
+    def marcar_conferidos(self, item_ids, lote=500):
+        # Conferidos no multiget e sem mudança: só renova o fetched_at
+        now = agora()
+        for parte in em_lotes(list(item_ids), lote):
+            self.db.session.execute(update(self.Item).where(self.Item.item_id.in_(parte)).values(fetched_at=now))
+            self.db.session.commit()
+
+    def guardar_descricao(self, item_id, descricao):
+        self.db.session.execute(
+            update(self.Item).where(self.Item.item_id == item_id)
+            .values(description=descricao, description_fetched=True)
+        )
+        self.db.session.commit()
+
+    def remover(self, item_ids, lote=500):
+        ids = list(item_ids)
+        for parte in em_lotes(ids, lote):
+            self.db.session.execute(delete(self.Item).where(self.Item.item_id.in_(parte)))
+            self.db.session.commit()
+        return len(ids)
+
+    def stats(self):
+        Item = self.Item
+        itens, vendedores = self.db.session.execute(
+            select(func.count(), func.count(func.distinct(Item.seller_id)))
+        ).one()
+        return {'items': itens, 'sellers': vendedores}
+
+
+class PrefetchAnuncios:
+    """Carrega os anúncios ativos de cada vendedor no EstoqueItens antes das perguntas.
+
+    Por vendedor: lista os ids com /users/{id}/items/search (scan) e busca em
+    multiget (/items?ids=, 20 por chamada, `concorrencia` em paralelo) só os
+    ids novos e os conferidos há mais de `revalidar` segundos. Item alterado
+    chega pelo tópico items, que o tira do estoque: na execução seguinte ele
+    volta como novo. Dos buscados, só regrava o que mudou (last_updated) e,
+    se a listagem veio completa, apaga o que saiu da lista de ativos;
+    `ao_alterar(item_id, seller_id)` recebe cada item regravado/apagado
+    (invalidar o item_cache).
+
+    Cada vendedor tem uma linha em `item_prefetch_state` com a próxima execução
+    (a cada `intervalo` segundos). Uma thread por processo reivindica os
+    vendedores vencidos com lease, como a JobQueue: vários processos/nós
+    dividem o trabalho sem repetir vendedor. agendar() (instalação pelo
+    callback) põe o vendedor na frente e acorda a thread.
+    """
+
+    def __init__(self, app, db, estado_model, user_model, estoque, ml, obter_token, ao_alterar=None,
+                 intervalo=21600, intervalo_erro=900, revalidar=86400, concorrencia=4, vendedores_por_vez=2,
+                 poll_interval=60, lease_seconds=1800):
+        self.app = app
+        self.db = db
+        self.Estado = estado_model
+        self.User = user_model
+        self.estoque = estoque
+        self.ml = ml
+        self.obter_token = obter_token
+        self.ao_alterar = ao_alterar
+        self.intervalo = intervalo
+        self.intervalo_erro = intervalo_erro
+        self.revalidar = revalidar
+        self.concorrencia = max(1, int(concorrencia))
+        self.vendedores_por_vez = max(1, int(vendedores_por_vez))
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._parando = threading.Event()
+        self._acordar = threading.Event()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.runs = 0
+        self.failed_runs = 0
+        self.listings = 0
+        self.changed = 0
+        self.fetched = 0
+        self.removed = 0
+        self.partial_listings = 0
+        self.api_calls = 0
+        self.batch_errors = 0
+        self.ultima = None
+
+    def _skip_locked(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    # --- Estado por vendedor ---
+
+    def agendar(self, user_id):
+        # Vendedor instalado/reinstalado: prefetch já, sem esperar o intervalo
+        Estado = self.Estado
+        session = self.db.session
+        linha = session.get(Estado, user_id)
+        if linha is None:
+            session.add(Estado(user_id=user_id, next_run_at=agora(), updated_at=agora()))
+        else:
+            linha.next_run_at = agora()
+            linha.updated_at = agora()
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+        self.acordar()
+
+    def _semear(self):
+        # Vendedores ativos ainda sem estado (instalados antes do prefetch) entram na fila
+        Estado, User = self.Estado, self.User
+        session = self.db.session
+        faltando = session.execute(
+            select(User.user_id)
+            .where(User.is_active.is_(True), ~exists().where(Estado.user_id == User.user_id))
+            .limit(500)
+        ).scalars().all()
+        if not faltando:
+            return
+        now = agora()
+        try:
+            session.execute(insert(Estado), [{'user_id': u, 'next_run_at': now, 'updated_at': now} for u in faltando])
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+
+    def reivindicar(self, limite):
+        Estado = self.Estado
+        now = agora()
+        session = self.db.session
+        disponivel = and_(
+            Estado.next_run_at <= now,
+            or_(Estado.locked_until.is_(None), Estado.locked_until < now)
+        )
+        candidatos = select(Estado.user_id).where(disponivel).order_by(Estado.next_run_at).limit(limite)
+        if self._skip_locked():
+            candidatos = candidatos.with_for_update(skip_locked=True)
+        stmt = (
+            update(Estado)
+            .where(Estado.user_id.in_(candidatos.scalar_subquery()), disponivel)
+            .values(locked_by=self.worker_id, locked_until=now + timedelta(seconds=self.lease_seconds), updated_at=now)
+            .returning(Estado.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        vendedores = list(session.execute(stmt).scalars())
+        session.commit()
+        return vendedores
+
+    def _finalizar(self, user_id, resumo, erro=None):
+        now = agora()
+        valores = {
+            'locked_by': None,
+            'locked_until': None,
+            'last_run_at': now,
+            'next_run_at': now + timedelta(seconds=self.intervalo_erro if erro else self.intervalo),
+            'last_error': str(erro)[:1000] if erro else None,
+            'updated_at': now,
+        }
+        if resumo:
+            valores['items'] = resumo['listings']
+            valores['api_calls'] = resumo['api_calls']
+        self.db.session.execute(update(self.Estado).where(self.Estado.user_id == user_id).values(**valores))
+        self.db.session.commit()
+
+    # --- Prefetch de um vendedor ---
+
+    def listar_anuncios(self, seller_id, token):
+        # (ids, chamadas, completa). Incompleta (parada no meio ou menos ids que
+        # paging.total) não serve para decidir o que saiu da lista de ativos.
+        ids = []
+        chamadas = 0
+        scroll_id = None
+        total = None
+        while True:
+            if self._parando.is_set():
+                return list(dict.fromkeys(ids)), chamadas, False
+            pagina = self.ml.listar_anuncios(seller_id, token, scroll_id=scroll_id, limit=PAGINA_ANUNCIOS)
+            chamadas += 1
+            resultados = pagina.get('results') or []
+            ids.extend(resultados)
+            scroll_id = pagina.get('scroll_id')
+            total = (pagina.get('paging') or {}).get('total', total)
+            if not resultados or not scroll_id or (total is not None and len(ids) >= total):
+                break
+        # Sem duplicatas, na ordem da listagem
+        ids = list(dict.fromkeys(ids))
+        return ids, chamadas, total is None or len(ids) >= total
+
+    def _multiget(self, seller_id, token, lote):
+        try:
+            return [r['body'] for r in self.ml.obter_itens(lote, token, seller_id=seller_id, attributes=ATRIBUTOS)
+                    if r.get('code') == 200 and r.get('body')]
+        except Exception as e:
+            print(f"Erro no multiget de {len(lote)} itens do vendedor {seller_id}: {e}")
+            with self._lock:
+                self.batch_errors += 1
+            return None
+
+    def prefetch_vendedor(self, seller_id):
+        token = self.obter_token(seller_id)
+        if not token:
+            return None
+        inicio = time.perf_counter()
+        ids, chamadas, completa = self.listar_anuncios(seller_id, token)
+        conhecidos = self.estoque.versoes(seller_id)
+
+        # Novos e vencidos; o resto continua valendo (mudança chega pelo tópico items)
+        vencimento = agora() - timedelta(seconds=self.revalidar)
+        buscar = [i for i in ids if i not in conhecidos or conhecidos[i][1] < vencimento]
+        lotes = em_lotes(buscar)
+        with ThreadPoolExecutor(max_workers=self.concorrencia, thread_name_prefix='prefetch') as executor:
+            resultados = list(executor.map(lambda lote: self._multiget(seller_id, token, lote), lotes))
+        chamadas += len(lotes)
+
+        alterados = []
+        conferidos = []
+        for itens in resultados:
+            for item in itens or ():
+                if item.get('seller_id') not in (None, seller_id) or item.get('status', 'active') != 'active':
+                    continue
+                if item['id'] not in conhecidos or conhecidos[item['id']][0] != item.get('last_updated'):
+                    alterados.append(item)
+                else:
+                    conferidos.append(item['id'])
+        self.estoque.gravar(seller_id, alterados)
+        self.estoque.marcar_conferidos(conferidos)
+
+        # Só remove o que saiu de uma listagem completa; item de um lote que falhou fica como estava
+        removidos = set(conhecidos) - set(ids) if completa else set()
+        self.estoque.remover(removidos)
+
+        if self.ao_alterar:
+            for item_id in [i['id'] for i in alterados] + list(removidos):
+                self.ao_alterar(item_id, seller_id)
+
+        resumo = {
+            'seller_id': seller_id,
+            'listings': len(ids),
+            'complete_listing': completa,
+            'fetched': len(buscar),
+            'changed': len(alterados),
+            'removed': len(removidos),
+            'failed_batches': sum(1 for r in resultados if r is None),
+            'api_calls': chamadas,
+            'duration_s': round(time.perf_counter() - inicio, 2),
+        }
+        with self._lock:
+            self.listings += resumo['listings']
+            self.changed += resumo['changed']
+            self.fetched += resumo['fetched']
+            self.removed += resumo['removed']
+            self.partial_listings += not completa
+            self.api_calls += chamadas
+            self.ultima = resumo
+        return resumo
+
+    # --- Thread ---
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+            self._parando.clear()
+            self._thread = threading.Thread(target=self._loop, name='item-prefetch', daemon=True)
+            self._thread.start()
+
+    def acordar(self):
+        if self._pid != os.getpid():
+            self.start()
+        self._acordar.set()
+
+    def stop(self):
+        self._parando.set()
+        self._acordar.set()
+
+    def executar_pendentes(self):
+        # Um ciclo: semeia, reivindica e processa os vendedores vencidos. Retorna quantos processou.
+        with self.app.app_context():
+            self._semear()
+            vendedores = self.reivindicar(self.vendedores_por_vez)
+        if not vendedores:
+            return 0
+        with ThreadPoolExecutor(max_workers=len(vendedores), thread_name_prefix='prefetch-seller') as executor:
+            list(executor.map(self._executar_vendedor, vendedores))
+        return len(vendedores)
+
+    def _executar_vendedor(self, seller_id):
+        with self.app.app_context():
+            try:
+                resumo = self.prefetch_vendedor(seller_id)
+            except Exception as e:
+                self.db.session.rollback()
+                print(f"Erro no prefetch de anúncios do vendedor {seller_id}: {e}")
+                if isinstance(e, MLApiError) and e.body:
+                    print(f"Detalhes do erro: {e.body}")
+                with self._lock:
+                    self.failed_runs += 1
+                self._finalizar(seller_id, None, e)
+                return
+            with self._lock:
+                self.runs += 1
+            if resumo:
+                print(f"Prefetch do vendedor {seller_id}: {resumo['listings']} anúncios, {resumo['fetched']} buscados, "
+                      f"{resumo['changed']} alterados, {resumo['removed']} removidos em {resumo['api_calls']} chamadas"
+                      + ('' if resumo['complete_listing'] else ' (listagem incompleta)'))
+            self._finalizar(seller_id, resumo)
+
+    def _loop(self):
+        while not self._parando.is_set():
+            self._acordar.clear()
+            processados = 0
+            try:
+                processados = self.executar_pendentes()
+            except Exception as e:
+                print(f"Erro no ciclo de prefetch de anúncios: {e}")
+            # Pegou um lote cheio: provavelmente há mais vencidos
+            if processados < self.vendedores_por_vez:
+                self._acordar.wait(self.poll_interval)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'failed_runs': self.failed_runs,
+                'listings': self.listings,
+                'fetched': self.fetched,
+                'changed': self.changed,
+                'removed': self.removed,
+                'partial_listings': self.partial_listings,
+                'api_calls': self.api_calls,
+                'failed_batches': self.batch_errors,
+                'last_run': self.ultima,
+            }
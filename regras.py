@@ -0,0 +1,187 @@
+import re
+import threading
+import time
+from collections import deque, namedtuple
+
+from cache import TTLCache
+from respostas_cache import normalizar_pergunta
+
+# Regra de resposta automática do vendedor (linha ativa de auto_reply_rules)
+Regra = namedtuple('Regra', 'id palavras_chave resposta prioridade')
+
+_Compilado = namedtuple('_Compilado', 'regras automato verificado_em')
+
+
+def separar_palavras_chave(texto):
+    # "Nota fiscal, NF\nretirada" -> ['nota fiscal', 'nf', 'retirada']
+    chaves = []
+    for parte in re.split(r'[,;\n]+', texto or ''):
+        chave = normalizar_pergunta(parte)
+        if chave and chave not in chaves:
+            chaves.append(chave)
+    return chaves
+
+
+class Automato:
+    """Aho-Corasick sobre o texto normalizado, já determinizado.
+
+    Cada palavra-chave entra como " palavra chave " e o texto é percorrido
+    como " texto normalizado ", então só casa palavra inteira ("nf" não casa
+    em "nfe"). As transições de falha são resolvidas na compilação: a busca é
+    um dict.get por caractere, e o custo depende do tamanho da pergunta, não
+    de quantas regras o vendedor tem.
+    """
+
+    def __init__(self, padroes):
+        # padroes: [(texto normalizado, valor)]
+        transicoes = [{}]
+        saidas = [()]
+        for padrao, valor in padroes:
+            estado = 0
+            for c in f' {padrao} ':
+                proximo = transicoes[estado].get(c)
+                if proximo is None:
+                    proximo = transicoes[estado][c] = len(transicoes)
+                    transicoes.append({})
+                    saidas.append(())
+                estado = proximo
+            saidas[estado] += ((valor, len(padrao)),)
+
+        # BFS: a falha de um estado é sempre mais rasa, então já está completa
+        falha = [0] * len(transicoes)
+        fila = deque(transicoes[0].values())
+        while fila:
+            estado = fila.popleft()
+            for c, filho in list(transicoes[estado].items()):
+                if estado:
+                    falha[filho] = transicoes[falha[estado]].get(c, 0)
+                saidas[filho] += saidas[falha[filho]]
+                fila.append(filho)
+            if estado:
+                for c, destino in transicoes[falha[estado]].items():
+                    transicoes[estado].setdefault(c, destino)
+
+        self._transicoes = transicoes
+        self._saidas = saidas
+        self.padroes = len(padroes)
+
+    @property
+    def estados(self):
+        return len(self._transicoes)
+
+    def buscar(self, texto):
+        # [(valor, tamanho do padrão)] de todas as ocorrências
+        transicoes, saidas = self._transicoes, self._saidas
+        achados = []
+        estado = 0
+        for c in f' {texto} ':
+            estado = transicoes[estado].get(c, 0)
+            if saidas[estado]:
+                achados.extend(saidas[estado])
+        return achados
+
+
+def compilar(regras):
+    return Automato([(chave, regra) for regra in regras for chave in separar_palavras_chave(regra.palavras_chave)])
+
+
+class MotorRegras:
+    """Respostas automáticas por palavra-chave, por vendedor.
+
+    As regras ativas de cada vendedor viram um Automato guardado em memória.
+    A cada `intervalo` segundos (ou após invalidar()) as regras são relidas do
+    banco, mas o autômato só é recompilado se elas mudaram. `carregar(user_id)`
+    devolve as Regras ativas e roda com app context.
+
+    Várias regras casando: vence a de maior prioridade, depois a de
+    palavra-chave mais longa ("nota fiscal de servico" antes de "nota fiscal").
+    """
+
+    def __init__(self, carregar, intervalo=60, maxsize=10000):
+        self.carregar = carregar
+        self.intervalo = intervalo
+        self._cache = TTLCache(maxsize=maxsize, ttl=None, name='auto_reply_rules')
+        self._lock = threading.Lock()
+        self.compilacoes = 0
+        self.compilacao_segundos = 0.0
+        self.recargas = 0
+        self.erros = 0
+        self.buscas = 0
+        self.acertos = 0
+        self.busca_segundos = 0.0
+
+    def em_cache(self, user_id):
+        # Conjunto compilado ainda dentro do intervalo, ou None se precisa reler o banco
+        entrada = self._cache.get(user_id)
+        if entrada is None or time.monotonic() - entrada.verificado_em > self.intervalo:
+            return None
+        return entrada
+
+    def compilado(self, user_id):
+        return self.em_cache(user_id) or self._recarregar(user_id)
+
+    def _recarregar(self, user_id):
+        anterior = self._cache.get(user_id)
+        try:
+            regras = tuple(self.carregar(user_id))
+        except Exception as e:
+            # Banco indisponível: segue com o que já estava compilado (ou sem regras)
+            print(f"Erro ao carregar regras do usuário {user_id}: {e}")
+            with self._lock:
+                self.erros += 1
+            return anterior
+        if anterior is not None and anterior.regras == regras:
+            entrada = anterior._replace(verificado_em=time.monotonic())
+        else:
+            inicio = time.perf_counter()
+            entrada = _Compilado(regras, compilar(regras), time.monotonic())
+            with self._lock:
+                self.compilacoes += 1
+                self.compilacao_segundos += time.perf_counter() - inicio
+        with self._lock:
+            self.recargas += 1
+        self._cache.set(user_id, entrada)
+        return entrada
+
+    def responder(self, compilado, texto):
+        # Regra que responde a pergunta, ou None
+        if compilado is None or not compilado.regras:
+            return None
+        inicio = time.perf_counter()
+        achados = compilado.automato.buscar(normalizar_pergunta(texto))
+        regra = None
+        if achados:
+            regra, _ = max(achados, key=lambda a: (a[0].prioridade, a[1], -a[0].id))
+        with self._lock:
+            self.buscas += 1
+            self.acertos += regra is not None
+            self.busca_segundos += time.perf_counter() - inicio
+        return regra
+
+    def invalidar(self, user_id):
+        self._cache.invalidate(int(user_id))
+
+    def limpar(self):
+        self._cache.clear()
+
+    def stats(self):
+        tenants = regras = padroes = estados = 0
+        for entrada in self._cache.values():
+            tenants += 1
+            regras += len(entrada.regras)
+            padroes += entrada.automato.padroes
+            estados += entrada.automato.estados
+        with self._lock:
+            return {
+                'tenants': tenants,
+                'rules': regras,
+                'keywords': padroes,
+                'automaton_states': estados,
+                'reloads': self.recargas,
+                'compilations': self.compilacoes,
+                'avg_compile_ms': round(self.compilacao_segundos / self.compilacoes * 1000, 3) if self.compilacoes else None,
+                'load_errors': self.erros,
+                'lookups': self.buscas,
+                'hits': self.acertos,
+                'avg_match_us': round(self.busca_segundos / self.buscas * 1e6, 1) if self.buscas else None,
+            }
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import benchmark
+
+# Replay de webhooks gravados em produção (WEBHOOK_RECORD_PATH) contra o app.
+#
+#   python replay.py capturas/webhooks.jsonl                 # mesmo ritmo da captura (1×)
+#   python replay.py capturas/webhooks.jsonl --speed 10      # 10× mais rápido
+#   python replay.py capturas/webhooks.jsonl --speed max     # o mais rápido possível
+#   python replay.py cap.jsonl --anonymize --save-anonymized cap-anon.jsonl
+#   python replay.py cap.jsonl --target http://127.0.0.1:8000  # instância já no ar
+#
+# Sem --target, sobe o app em processo com o ML e a OpenAI falsos do
+# benchmark.py e cadastra os vendedores que aparecem na captura. Reporta a
+# taxa obtida contra a gravada (média e pico por segundo), o atraso em relação
+# ao horário previsto, status HTTP, erros e quantas perguntas foram respondidas.
+
+
+def ler_captura(caminho, limite=None):
+    eventos = []
+    with open(caminho) as f:
+        for numero, linha in enumerate(f, 1):
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                evento = json.loads(linha)
+                eventos.append((float(evento['t']), evento['p']))
+            except (ValueError, KeyError, TypeError):
+                print(f"Linha {numero} ignorada (inválida)")
+    # Vários workers gravando no mesmo arquivo: a ordem de escrita não é a de chegada
+    eventos.sort(key=lambda e: e[0])
+    return eventos[:limite] if limite else eventos
+
+
+class Anonimizador:
+    """Troca vendedores, perguntas, itens e ids de notificação por sequenciais.
+
+    O mapeamento é consistente dentro da captura: a mesma pergunta reenviada
+    pelo ML continua sendo a mesma pergunta (e deduplicada pelo app).
+    """
+
+    def __init__(self):
+        self.vendedores = {}
+        self.perguntas = {}
+        self.itens = {}
+        self.notificacoes = {}
+
+    @staticmethod
+    def _mapear(mapa, chave, novo):
+        if chave not in mapa:
+            mapa[chave] = novo(len(mapa) + 1)
+        return mapa[chave]
+
+    def _resource(self, topic, resource):
+        partes = (resource or '').rstrip('/').split('/')
+        if len(partes) < 3:
+            return resource
+        if topic == 'questions':
+            partes[2] = str(self._mapear(self.perguntas, partes[2], lambda n: n))
+        elif topic == 'items':
+            partes[2] = self._mapear(self.itens, partes[2], lambda n: f"MLB{n}")
+        return '/'.join(partes)
+
+    def __call__(self, payload):
+        topic = payload.get('topic')
+        anonimo = {'topic': topic, 'attempts': payload.get('attempts', 1)}
+        if payload.get('user_id') is not None:
+            anonimo['user_id'] = self._mapear(self.vendedores, str(payload['user_id']), lambda n: 1000 + n - 1)
+        if payload.get('resource'):
+            anonimo['resource'] = self._resource(topic, payload['resource'])
+        if payload.get('_id'):
+            anonimo['_id'] = self._mapear(self.notificacoes, payload['_id'], lambda n: f"replay-{n}")
+        return anonimo
+
+
+def salvar_captura(eventos, caminho):
+    with open(caminho, 'w') as f:
+        for t, payload in eventos:
+            f.write(json.dumps({'t': t, 'p': payload}, separators=(',', ':'), ensure_ascii=False) + '\n')
+
+
+def pico_por_segundo(instantes):
+    if not instantes:
+        return 0
+    base = min(instantes)
+    contagem = {}
+    for t in instantes:
+        segundo = int(t - base)
+        contagem[segundo] = contagem.get(segundo, 0) + 1
+    return max(contagem.values())
+
+
+def reproduzir(eventos, app_url, velocidade, clientes):
+    import requests
+
+    sessao = requests.Session()
+    sessao.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=clientes))
+
+    lock = threading.Lock()
+    status = {}
+    erros = {}
+    acks = []
+    atrasos = []
+    enviados_em = []
+
+    def enviar(payload, previsto):
+        inicio = time.time()
+        try:
+            resposta = sessao.post(f"{app_url}/notifications", json=payload, timeout=10)
+            chave_status, erro = str(resposta.status_code), None
+        except Exception as e:
+            chave_status, erro = None, type(e).__name__
+        fim = time.time()
+        with lock:
+            enviados_em.append(inicio)
+            acks.append(fim - inicio)
+            atrasos.append(max(0.0, inicio - previsto))
+            if chave_status:
+                status[chave_status] = status.get(chave_status, 0) + 1
+            if erro:
+                erros[erro] = erros.get(erro, 0) + 1
+
+    t0 = eventos[0][0]
+    inicio = time.time()
+    with ThreadPoolExecutor(max_workers=clientes) as executor:
+        for t, payload in eventos:
+            # Open-loop pelo relógio da captura (dividido pela velocidade)
+            previsto = inicio if velocidade is None else inicio + (t - t0) / velocidade
+            espera = previsto - time.time()
+            if espera > 0:
+                time.sleep(espera)
+            executor.submit(enviar, payload, previsto)
+    duracao = time.time() - inicio
+    return {
+        'duration_s': round(duracao, 2),
+        'achieved_rate': round(len(eventos) / duracao, 2) if duracao else None,
+        'achieved_peak_per_s': pico_por_segundo(enviados_em),
+        'status': status,
+        'errors': erros,
+        'ack': benchmark.percentis(acks),
+        'lag': benchmark.percentis(atrasos),
+    }
+
+
+def subir_local(eventos, args):
+    fake_ml = benchmark.FakeMercadoLivre(args.ml_latency, taxa_erro=args.ml_error_rate).start()
+    fake_openai = benchmark.FakeOpenAI(args.openai_latency, taxa_erro=args.openai_error_rate).start()
+    db_path = os.path.join(tempfile.mkdtemp(prefix='replay-'), 'replay.db')
+    benchmark.preparar_ambiente(fake_ml.url, fake_openai.url, db_path, args.pipeline_mode)
+    bot, servidor, app_url = benchmark.subir_app(0)
+
+    # Os vendedores da captura precisam existir (e estar ativos) no banco local
+    vendedores = {int(p['user_id']) for _, p in eventos if str(p.get('user_id', '')).isdigit()}
+    with bot.app.app_context():
+        for user_id in vendedores:
+            bot.db.session.merge(bot.User(
+                user_id=user_id,
+                access_token='replay-token',
+                refresh_token='replay-refresh',
+                is_active=True,
+                expires_at=datetime(2100, 1, 1)
+            ))
+        bot.db.session.commit()
+    return fake_ml, fake_openai, bot, servidor, app_url
+
+
+def perguntas_da_captura(eventos):
+    ids = set()
+    for _, payload in eventos:
+        if payload.get('topic') != 'questions':
+            continue
+        ultimo = (payload.get('resource') or '').rstrip('/').split('/')[-1]
+        if ultimo.isdigit():
+            ids.add(int(ultimo))
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay de webhooks gravados (WEBHOOK_RECORD_PATH)')
+    parser.add_argument('capture', help='arquivo JSONL gravado pelo app')
+    parser.add_argument('--speed', default='1', help="fator de velocidade (1, 10, 0.5...) ou 'max'")
+    parser.add_argument('--target', help='URL de uma instância já no ar (padrão: app local com backends falsos)')
+    parser.add_argument('--anonymize', action='store_true', help='troca vendedores, perguntas, itens e ids por sequenciais')
+    parser.add_argument('--save-anonymized', help='grava a captura anonimizada neste arquivo e sai')
+    parser.add_argument('--limit', type=int, help='reproduz só os N primeiros eventos')
+    parser.add_argument('--clients', type=int, default=64, help='conexões simultâneas do gerador de carga')
+    parser.add_argument('--ml-latency', default='lognormal:80,0.4')
+    parser.add_argument('--openai-latency', default='lognormal:900,0.5')
+    parser.add_argument('--ml-error-rate', type=float, default=0.0)
+    parser.add_argument('--openai-error-rate', type=float, default=0.0)
+    parser.add_argument('--pipeline-mode', choices=['sync', 'async'], help='PIPELINE_MODE do app local')
+    parser.add_argument('--drain-timeout', type=float, default=60, help='segundos para esperar as respostas após o replay')
+    parser.add_argument('--output', help='grava o relatório em JSON neste arquivo')
+    args = parser.parse_args()
+
+    velocidade = None if args.speed == 'max' else float(args.speed)
+    if velocidade is not None and velocidade <= 0:
+        parser.error("--speed deve ser positivo ou 'max'")
+
+    eventos = ler_captura(args.capture, args.limit)
+    if not eventos:
+        print("Captura vazia.")
+        return
+    if args.anonymize or args.save_anonymized:
+        anonimizar = Anonimizador()
+        eventos = [(t, anonimizar(p)) for t, p in eventos]
+    if args.save_anonymized:
+        salvar_captura(eventos, args.save_anonymized)
+        print(f"{len(eventos)} eventos anonimizados salvos em {args.save_anonymized}")
+        return
+
+    gravado = eventos[-1][0] - eventos[0][0]
+    print(f"{len(eventos)} eventos em {gravado:.1f}s gravados "
+          f"(média {len(eventos) / gravado if gravado else len(eventos):.1f}/s, "
+          f"pico {pico_por_segundo([t for t, _ in eventos])}/s) | velocidade {args.speed}")
+
+    local = None
+    app_url = args.target
+    if not app_url:
+        local = subir_local(eventos, args)
+        app_url = local[4]
+        print(f"App local em {app_url} | ML falso em {local[0].url} | OpenAI falsa em {local[1].url}")
+
+    # O app é verboso (print por etapa); durante o replay só o relatório interessa
+    stdout_original = sys.stdout
+    if local:
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        resultado = reproduzir(eventos, app_url, velocidade, args.clients)
+        if local:
+            perguntas = perguntas_da_captura(eventos)
+            faltando = benchmark.aguardar_respostas(local[0], perguntas, args.drain_timeout)
+            resultado['questions'] = len(perguntas)
+            resultado['answered'] = len(perguntas) - faltando
+            resultado['openai_calls'] = local[1].chamadas
+            resultado['ml_calls'] = dict(local[0].contagem)
+    finally:
+        if local:
+            sys.stdout.close()
+            sys.stdout = stdout_original
+
+    resultado = {
+        'events': len(eventos),
+        'recorded_duration_s': round(gravado, 2),
+        'recorded_rate': round(len(eventos) / gravado, 2) if gravado else None,
+        'recorded_peak_per_s': pico_por_segundo([t for t, _ in eventos]),
+        'speed': args.speed,
+    } | resultado
+
+    r = resultado
+    print(f"\nEnviados: {r['events']} em {r['duration_s']}s | taxa obtida {r['achieved_rate']}/s "
+          f"(gravada {r['recorded_rate']}/s × {args.speed}) | pico {r['achieved_peak_per_s']}/s")
+    print(f"Status HTTP: {r['status']} | Erros: {r['errors'] or 'nenhum'}")
+    print(f"ack p50/p95/p99: {r['ack']['p50']}/{r['ack']['p95']}/{r['ack']['p99']} ms | "
+          f"atraso p50/p99: {r['lag']['p50']}/{r['lag']['p99']} ms")
+    if 'questions' in r:
+        print(f"Perguntas: {r['questions']} | Respondidas: {r['answered']} | Chamadas OpenAI: {r['openai_calls']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(resultado, f, indent=2)
+        print(f"\nRelatório salvo em {args.output}")
+
+    if local:
+        local[2].pool.shutdown(5)
+        local[2].async_pool.shutdown(5)
+        local[3].shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Saudações e fórmulas de cortesia não mudam o sentido da pergunta
+SAUDACOES = re.compile(
+    r'\b(ola|oi|bom dia|boa tarde|boa noite|por favor|obrigad[oa]|grat[oa]|amigo|amiga|vendedor)\b'
+)
+
+
+def normalizar_pergunta(texto):
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = SAUDACOES.sub(' ', texto)
+    texto = re.sub(r'[^a-z0-9 ]+', ' ', texto)
+    return ' '.join(texto.split())
+
+
+class VetorizadorNgramas:
+    """Char n-grams com hashing trick: texto -> vetor TF (sublinear) de tamanho fixo."""
+
+    def __init__(self, dim=4096, n=3):
+        self.dim = dim
+        self.n = n
+
+    def __call__(self, texto):
+        vetor = np.zeros(self.dim, dtype=np.float32)
+        for palavra in texto.split():
+            palavra = f" {palavra} "
+            for i in range(max(1, len(palavra) - self.n + 1)):
+                vetor[zlib.crc32(palavra[i:i + self.n].encode()) % self.dim] += 1
+        np.log1p(vetor, out=vetor)
+        return vetor
+
+
+class _EntradaItem:
+    def __init__(self, fingerprint, dim):
+        self.fingerprint = fingerprint
+        self.exatas = {}                # pergunta normalizada -> índice
+        self.respostas = []
+        self.matriz = np.zeros((0, dim), dtype=np.float32)
+        self.criado_em = []
+
+
+class AnswerCache:
+    """Cache de respostas por item + pergunta normalizada.
+
+    Além do match exato, encontra perguntas quase idênticas no mesmo item por
+    similaridade de cosseno TF-IDF (char n-grams). As entradas de um item são
+    descartadas quando o título/preço do item muda.
+    """
+
+    def __init__(self, max_items=2000, max_per_item=50, ttl=86400, similarity_threshold=0.9, dim=4096):
+        self.max_items = max_items
+        self.max_per_item = max_per_item
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.vetorizar = VetorizadorNgramas(dim)
+        self._itens = OrderedDict()
+        self._df = np.zeros(dim, dtype=np.float32)  # document frequency global (IDF)
+        self._docs = 0
+        self._lock = threading.Lock()
+
+        self.hits_exact = 0
+        self.hits_similar = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.latency_saved = 0.0
+        self._latencia_geracao = None   # média móvel do tempo da IA
+        self._lookup_total = 0.0
+        self._lookups = 0
+
+    @staticmethod
+    def fingerprint(item_info):
+        return (item_info.get('title'), item_info.get('price'), item_info.get('currency_id'))
+
+    def _entrada_valida(self, item_id, item_info):
+        entrada = self._itens.get(item_id)
+        if entrada is None:
+            return None
+        if entrada.fingerprint != self.fingerprint(item_info):
+            # Título ou preço mudou: respostas antigas podem estar erradas
+            del self._itens[item_id]
+            self.invalidations += 1
+            return None
+        self._itens.move_to_end(item_id)
+        return entrada
+
+    def buscar(self, item_id, pergunta, item_info):
+        inicio = time.perf_counter()
+        normalizada = normalizar_pergunta(pergunta)
+        with self._lock:
+            try:
+                entrada = self._entrada_valida(item_id, item_info)
+                if entrada is None or not normalizada:
+                    self.misses += 1
+                    return None
+
+                limite = time.time() - self.ttl
+                idx = entrada.exatas.get(normalizada)
+                if idx is not None and entrada.criado_em[idx] >= limite:
+                    self.hits_exact += 1
+                    self._contar_economia()
+                    return entrada.respostas[idx]
+
+                if self.similarity_threshold and len(entrada.respostas):
+                    idf = np.log((1 + self._docs) / (1 + self._df)) + 1
+                    consulta = self.vetorizar(normalizada) * idf
+                    norma = np.linalg.norm(consulta)
+                    if norma:
+                        matriz = entrada.matriz * idf
+                        normas = np.linalg.norm(matriz, axis=1) * norma
+                        normas[normas == 0] = 1
+                        sims = (matriz @ consulta) / normas
+                        melhor = int(np.argmax(sims))
+                        if sims[melhor] >= self.similarity_threshold and entrada.criado_em[melhor] >= limite:
+                            self.hits_similar += 1
+                            self._contar_economia()
+                            return entrada.respostas[melhor]
+
+                self.misses += 1
+                return None
+            finally:
+                self._lookup_total += time.perf_counter() - inicio
+                self._lookups += 1
+
+    def guardar(self, item_id, pergunta, item_info, resposta):
+        normalizada = normalizar_pergunta(pergunta)
+        if not normalizada or not resposta:
+            return
+        vetor = self.vetorizar(normalizada)
+        with self._lock:
+            entrada = self._entrada_valida(item_id, item_info)
+            if entrada is None:
+                entrada = _EntradaItem(self.fingerprint(item_info), self.vetorizar.dim)
+                self._itens[item_id] = entrada
+                while len(self._itens) > self.max_items:
+                    self._itens.popitem(last=False)
+
+            if normalizada in entrada.exatas:
+                idx = entrada.exatas[normalizada]
+                entrada.respostas[idx] = resposta
+                entrada.criado_em[idx] = time.time()
+                return
+
+            if len(entrada.respostas) >= self.max_per_item:
+                # Descarta a mais antiga do item
+                entrada.respostas.pop(0)
+                entrada.criado_em.pop(0)
+                entrada.matriz = entrada.matriz[1:]
+                entrada.exatas = {p: i - 1 for p, i in entrada.exatas.items() if i > 0}
+
+            entrada.exatas[normalizada] = len(entrada.respostas)
+            entrada.respostas.append(resposta)
+            entrada.criado_em.append(time.time())
+            entrada.matriz = np.vstack([entrada.matriz, vetor])
+            self._df += vetor > 0
+            self._docs += 1
+
+    def invalidar_item(self, item_id):
+        with self._lock:
+            if self._itens.pop(item_id, None) is not None:
+                self.invalidations += 1
+
+    def registrar_geracao(self, segundos):
+        with self._lock:
+            if self._latencia_geracao is None:
+                self._latencia_geracao = segundos
+            else:
+                self._latencia_geracao = 0.9 * self._latencia_geracao + 0.1 * segundos
+
+    def _contar_economia(self):
+        if self._latencia_geracao is not None:
+            self.latency_saved += self._latencia_geracao
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits_exact + self.hits_similar
+            total = hits + self.misses
+            return {
+                'items': len(self._itens),
+                'hits_exact': self.hits_exact,
+                'hits_similar': self.hits_similar,
+                'misses': self.misses,
+                'hit_rate': round(hits / total, 4) if total else 0.0,
+                'invalidations': self.invalidations,
+                'latency_saved_seconds': round(self.latency_saved, 3),
+                'avg_generation_seconds': round(self._latencia_geracao or 0, 3),
+                'avg_lookup_us': round(self._lookup_total / self._lookups * 1e6, 1) if self._lookups else 0,
+            }
@@ -1,67 +1,304 @@
-import sqlite3
-import requests
+import argparse
+import asyncio
+import csv
+import json
 import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from dotenv import load_dotenv
-from app import gerar_resposta_ia
 
-# Carregar variáveis de ambiente (para garantir que a OpenAI Key esteja disponível se app não carregar)
+# Dry-run em lote: gera respostas para muitas perguntas (históricas ou
+# inventadas) sem publicar nada no Mercado Livre, para avaliar mudanças de
+# prompt em escala.
+#
+#   python simulador_interno.py perguntas.csv --output respostas.jsonl
+#   python simulador_interno.py perguntas.jsonl --concurrency 32 --mode async
+#   python simulador_interno.py                # a pergunta de exemplo de sempre
+#
+# Entrada: CSV com cabeçalho ou JSONL com item_id e question (aceita também
+# text/pergunta) e, opcionalmente, user_id (senão vale --user-id, cujo token
+# vem do banco do app). Cada item é buscado uma vez só, com o contexto do
+# prompt montado como no app, e passa pelo mesmo roteamento (template, modelo
+# rápido ou forte; --no-routing manda tudo para a IA). As respostas saem numa
+# linha JSON por pergunta, na ordem em que ficam prontas.
+
 load_dotenv()
 
-def get_token(user_id):
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT access_token FROM users WHERE user_id = ?', (str(user_id),))
-    row = cursor.fetchone()
-    conn.close()
-    if row:
-        return row[0]
-    return None
-
-def obter_item_ml(item_id, token):
-    url = f"https://api.mercadolibre.com/items/{item_id}"
-    headers = {'Authorization': f'Bearer {token}'}
-    
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return {
-            'title': data.get('title'),
-            'price': data.get('price'),
-            'currency_id': data.get('currency_id'),
-            'permalink': data.get('permalink')
+USER_ID_PADRAO = 71527835
+EXEMPLO = {'item_id': 'MLB5988627540', 'question': 'Olá! A ponta dela é fina ou média? Serve para desenho?'}
+
+# Preço por 1K tokens (gpt-3.5-turbo); ajuste com --price-in/--price-out
+PRECO_ENTRADA = float(os.getenv('OPENAI_PRICE_INPUT_PER_1K', '0.0005'))
+PRECO_SAIDA = float(os.getenv('OPENAI_PRICE_OUTPUT_PER_1K', '0.0015'))
+
+
+def ler_entrada(caminho, user_id_padrao, limite=None):
+    with open(caminho, newline='') as f:
+        if caminho.endswith('.jsonl') or caminho.endswith('.json'):
+            linhas = (json.loads(l) for l in f if l.strip())
+        else:
+            linhas = csv.DictReader(f)
+        perguntas = []
+        for linha in linhas:
+            texto = linha.get('question') or linha.get('text') or linha.get('pergunta')
+            if not linha.get('item_id') or not texto:
+                continue
+            perguntas.append({
+                'item_id': linha['item_id'].strip(),
+                'question': texto.strip(),
+                'user_id': int(linha.get('user_id') or linha.get('seller_id') or user_id_padrao),
+            })
+            if limite and len(perguntas) >= limite:
+                break
+    return perguntas
+
+
+class Saida:
+    """Grava um resultado por linha assim que fica pronto (várias threads)."""
+
+    def __init__(self, caminho):
+        self._f = open(caminho, 'w') if caminho else None
+        self._lock = threading.Lock()
+
+    def escrever(self, resultado):
+        if not self._f:
+            return
+        with self._lock:
+            self._f.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+            self._f.flush()
+
+    def fechar(self):
+        if self._f:
+            self._f.close()
+
+
+class Simulacao:
+    def __init__(self, bot, saida, concorrencia, rotear=True):
+        self.bot = bot
+        self.saida = saida
+        self.concorrencia = concorrencia
+        self.rotear = rotear
+        self.itens = {}
+        self.resultados = []
+        self._lock = threading.Lock()
+
+    def tokens_vendedores(self, perguntas):
+        tokens = {}
+        with self.bot.app.app_context():
+            for user_id in {p['user_id'] for p in perguntas}:
+                user = self.bot.db.session.get(self.bot.User, user_id)
+                if user:
+                    tokens[user_id] = user.access_token
+                else:
+                    print(f"Aviso: token não encontrado para o usuário {user_id}")
+        return tokens
+
+    def _decidir(self, pergunta, item_info):
+        if not self.rotear:
+            return 'fast', None, None
+        decisao = self.bot.roteador.decidir(pergunta['question'], item_info)
+        return decisao.rota, decisao.resposta, decisao.modelo
+
+    def _resultado(self, indice, pergunta, inicio, resposta=None, motivo=None, rota=None):
+        latencia = time.perf_counter() - inicio
+        item_info = self.itens.get((pergunta['user_id'], pergunta['item_id']))
+        resultado = {
+            'index': indice,
+            'user_id': pergunta['user_id'],
+            'item_id': pergunta['item_id'],
+            'question': pergunta['question'],
+            'status': 'ok' if resposta is not None else 'error',
+            'reason': motivo,
+            'route': rota,
+            'answer': resposta,
+            'latency_ms': round(latencia * 1000, 1),
         }
-    except Exception as e:
-        print(f"Erro ao obter item: {e}")
-        return None
+        if item_info and rota != 'template':
+            mensagens = self.bot._mensagens_ia(pergunta['question'], item_info)
+            resultado['prompt_tokens'] = sum(self.bot.estimar_tokens(m['content']) for m in mensagens)
+            resultado['completion_tokens'] = self.bot.estimar_tokens(resposta) if resposta else 0
+        with self._lock:
+            self.resultados.append(resultado)
+        self.saida.escrever(resultado)
 
-# 1. Recuperar Token
-user_id = '71527835'
-token = get_token(user_id)
+    # --- Threads ---
 
-if not token:
-    print(f"Erro: Token não encontrado para o usuário {user_id}")
-    exit()
+    def _buscar_item(self, chave, token):
+        user_id, item_id = chave
+        self.itens[chave] = self.bot.obter_item_ml(item_id, token, seller_id=user_id)
 
-print(f"Token recuperado com sucesso para User {user_id}")
+    def _gerar(self, indice, pergunta):
+        inicio = time.perf_counter()
+        item_info = self.itens.get((pergunta['user_id'], pergunta['item_id']))
+        if not item_info:
+            return self._resultado(indice, pergunta, inicio, motivo='item_fetch_failed')
+        rota, resposta, modelo = self._decidir(pergunta, item_info)
+        if resposta is None:
+            try:
+                resposta = self.bot.gerar_resposta_ia(pergunta['question'], item_info, modelo)
+            except self.bot.GeracaoIndisponivel as e:
+                return self._resultado(indice, pergunta, inicio, motivo=f"generation_{e.motivo}", rota=rota)
+        self._resultado(indice, pergunta, inicio, resposta, rota=rota)
 
-# 2. Consultar Produto
-item_id = 'MLB5988627540'
-print(f"\nConsultando item {item_id}...")
-item_info = obter_item_ml(item_id, token)
+    def rodar_threads(self, perguntas, tokens):
+        chaves = {(p['user_id'], p['item_id']) for p in perguntas if p['user_id'] in tokens}
+        with ThreadPoolExecutor(max_workers=self.concorrencia) as executor:
+            # Itens deduplicados antes: cada um é buscado uma vez, depois é só cache
+            list(executor.map(lambda c: self._buscar_item(c, tokens[c[0]]), chaves))
+            list(executor.map(lambda ip: self._gerar(*ip), enumerate(perguntas)))
 
-if item_info:
-    print(f"Produto: {item_info['title']}")
-    print(f"Preço: {item_info['currency_id']} {item_info['price']}")
-else:
-    print("Erro ao consultar produto.")
-    exit()
+    # --- Asyncio ---
+
+    async def _buscar_item_async(self, semaforo, chave, token):
+        async with semaforo:
+            user_id, item_id = chave
+            self.itens[chave] = await self.bot.obter_item_ml_async(item_id, token, seller_id=user_id)
+
+    async def _gerar_async(self, semaforo, indice, pergunta):
+        async with semaforo:
+            inicio = time.perf_counter()
+            item_info = self.itens.get((pergunta['user_id'], pergunta['item_id']))
+            if not item_info:
+                return self._resultado(indice, pergunta, inicio, motivo='item_fetch_failed')
+            rota, resposta, modelo = self._decidir(pergunta, item_info)
+            if resposta is None:
+                try:
+                    resposta = await self.bot.gerar_resposta_ia_async(pergunta['question'], item_info, modelo)
+                except self.bot.GeracaoIndisponivel as e:
+                    return self._resultado(indice, pergunta, inicio, motivo=f"generation_{e.motivo}", rota=rota)
+            self._resultado(indice, pergunta, inicio, resposta, rota=rota)
+
+    async def _rodar_async(self, perguntas, tokens):
+        semaforo = asyncio.Semaphore(self.concorrencia)
+        chaves = {(p['user_id'], p['item_id']) for p in perguntas if p['user_id'] in tokens}
+        try:
+            await asyncio.gather(*(self._buscar_item_async(semaforo, c, tokens[c[0]]) for c in chaves))
+            await asyncio.gather(*(self._gerar_async(semaforo, i, p) for i, p in enumerate(perguntas)))
+        finally:
+            await self.bot._fechar_clientes_async()
+
+    def rodar_async(self, perguntas, tokens):
+        asyncio.run(self._rodar_async(perguntas, tokens))
+
+
+def _tokens_reportados(bot, tipo):
+    # Uso informado pela própria OpenAI (contador do app), quando disponível
+    return bot.OPENAI_TOKENS.snapshot()['series'].get(json.dumps([tipo]), 0)
+
+
+def relatorio(sim, duracao, precos, antes):
+    from benchmark import percentis
+
+    resultados = sim.resultados
+    ok = [r for r in resultados if r['status'] == 'ok']
+    motivos = {}
+    rotas = {}
+    for r in resultados:
+        if r['reason']:
+            motivos[r['reason']] = motivos.get(r['reason'], 0) + 1
+        if r['route']:
+            rotas[r['route']] = rotas.get(r['route'], 0) + 1
+    prompt = sum(r.get('prompt_tokens', 0) for r in ok)
+    completion = sum(r.get('completion_tokens', 0) for r in ok)
+    prompt_api = _tokens_reportados(sim.bot, 'prompt') - antes[0]
+    completion_api = _tokens_reportados(sim.bot, 'completion') - antes[1]
+    if prompt_api:
+        # Prefere o uso real (inclui tentativas de hedge) à estimativa local
+        prompt, completion = prompt_api, completion_api
+    custo = prompt / 1000 * precos[0] + completion / 1000 * precos[1]
+    return {
+        'questions': len(resultados),
+        'answered': len(ok),
+        'errors': motivos,
+        'unique_items': len(sim.itens),
+        'item_fetch_failed': sum(1 for v in sim.itens.values() if not v),
+        'duration_s': round(duracao, 2),
+        'throughput_per_s': round(len(resultados) / duracao, 2) if duracao else None,
+        'latency': percentis([r['latency_ms'] / 1000 for r in ok]),
+        'routes': rotas,
+        'latency_by_route': {
+            rota: percentis([r['latency_ms'] / 1000 for r in ok if r['route'] == rota]) for rota in rotas
+        },
+        'prompt_tokens': prompt,
+        'completion_tokens': completion,
+        'tokens_source': 'api' if prompt_api else 'estimate',
+        'estimated_cost_usd': round(custo, 4),
+        'cost_per_1k_questions_usd': round(custo / len(ok) * 1000, 4) if ok else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dry-run em lote: gera respostas sem publicar no Mercado Livre')
+    parser.add_argument('input', nargs='?', help='CSV ou JSONL com item_id e question (padrão: pergunta de exemplo)')
+    parser.add_argument('--user-id', type=int, default=USER_ID_PADRAO, help='vendedor das linhas sem user_id')
+    parser.add_argument('--output', help='JSONL com uma resposta por linha (padrão: só o relatório)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mode', choices=['thread', 'async'], default='thread')
+    parser.add_argument('--limit', type=int, help='processa só as N primeiras perguntas')
+    parser.add_argument('--no-routing', action='store_true', help='sem templates nem modelo forte: tudo para a IA')
+    parser.add_argument('--price-in', type=float, default=PRECO_ENTRADA, help='US$ por 1K tokens de prompt')
+    parser.add_argument('--price-out', type=float, default=PRECO_SAIDA, help='US$ por 1K tokens de resposta')
+    parser.add_argument('--report', help='grava o relatório em JSON neste arquivo')
+    args = parser.parse_args()
+
+    # Antes do import do app: o pool interno do gerador (hedge) acompanha a concorrência
+    os.environ.setdefault('OPENAI_MAX_PARALLEL', str(max(32, args.concurrency * 2)))
+    os.environ.setdefault('ENABLE_ADMIN', '0')
+    import app as bot
+
+    if args.input:
+        perguntas = ler_entrada(args.input, args.user_id, args.limit)
+    else:
+        perguntas = [EXEMPLO | {'user_id': args.user_id}]
+    if not perguntas:
+        print("Nenhuma pergunta na entrada.")
+        return
+
+    sim = Simulacao(bot, Saida(args.output), max(1, args.concurrency), rotear=not args.no_routing)
+    tokens = sim.tokens_vendedores(perguntas)
+    if not tokens:
+        print("Erro: nenhum vendedor da entrada tem token no banco.")
+        sys.exit(1)
+
+    print(f"Simulando {len(perguntas)} perguntas ({args.mode}, concorrência {sim.concorrencia})...")
+    antes = (_tokens_reportados(bot, 'prompt'), _tokens_reportados(bot, 'completion'))
+    stdout_original = sys.stdout
+    if len(perguntas) > 1:
+        sys.stdout = open(os.devnull, 'w')  # o app imprime cada etapa
+    inicio = time.perf_counter()
+    try:
+        if args.mode == 'async':
+            sim.rodar_async(perguntas, tokens)
+        else:
+            sim.rodar_threads(perguntas, tokens)
+    finally:
+        if sys.stdout is not stdout_original:
+            sys.stdout.close()
+            sys.stdout = stdout_original
+        sim.saida.fechar()
+    r = relatorio(sim, time.perf_counter() - inicio, (args.price_in, args.price_out), antes)
 
-# 3. Simular Pergunta e Gerar Resposta
-pergunta = 'Olá! A ponta dela é fina ou média? Serve para desenho?'
-print(f"\nPergunta Simulada: '{pergunta}'")
+    if len(perguntas) == 1 and sim.resultados:
+        unico = sim.resultados[0]
+        print(f"\nPergunta: '{unico['question']}'")
+        print(f"\n--- Resposta Final da IA ---\n{unico['answer'] or unico['reason']}\n----------------------------")
+    print(f"\nPerguntas: {r['questions']} | Respondidas: {r['answered']} | Erros: {r['errors'] or 'nenhum'}")
+    print(f"Itens distintos: {r['unique_items']} (falhas: {r['item_fetch_failed']}) | "
+          f"{r['duration_s']}s | {r['throughput_per_s']} perguntas/s")
+    print(f"Latência p50/p95/p99: {r['latency']['p50']}/{r['latency']['p95']}/{r['latency']['p99']} ms")
+    for rota, lat in r['latency_by_route'].items():
+        print(f"  {rota:<10}{r['routes'][rota]:>6} perguntas | p50 {lat['p50']} ms | p95 {lat['p95']} ms")
+    print(f"Tokens ({r['tokens_source']}): {r['prompt_tokens']} prompt + {r['completion_tokens']} resposta | "
+          f"custo estimado US$ {r['estimated_cost_usd']} (US$ {r['cost_per_1k_questions_usd']} por 1K perguntas)")
+    if args.output:
+        print(f"Respostas em {args.output}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(r, f, indent=2)
 
-print("Gerando resposta com IA...")
-resposta = gerar_resposta_ia(pergunta, item_info)
 
-print(f"\n--- Resposta Final da IA ---\n{resposta}\n----------------------------")
+if __name__ == '__main__':
+    main()
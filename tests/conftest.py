@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+
+# ML/OpenAI falsos do benchmark e SQLite temporário. Sobe antes de qualquer
+# teste importar ml_client/app: a configuração é lida no import.
+_ML = benchmark.FakeMercadoLivre('fixed:0', itens=10).start()
+_OPENAI = benchmark.FakeOpenAI('fixed:0').start()
+benchmark.preparar_ambiente(_ML.url, _OPENAI.url, os.path.join(tempfile.mkdtemp(), 'bot.db'), 'sync')
+os.environ.setdefault('ENABLE_ADMIN', '0')
+
+
+@pytest.fixture(scope='session')
+def fake_ml():
+    return _ML
+
+
+@pytest.fixture(scope='session')
+def bot():
+    import app as bot
+    bot.init_db()
+    return bot
@@ -0,0 +1,77 @@
+from despacho import ControleAIMD, Despachante
+
+
+class OutboxFalsa:
+    def __init__(self):
+        self.concluidas = []
+        self.reagendadas = []
+
+    def concluir(self, outbox_id):
+        self.concluidas.append(outbox_id)
+
+    def reagendar(self, outbox_id, atraso, erro, status_code=None, gastar_tentativa=True):
+        self.reagendadas.append((outbox_id, status_code))
+        return 'pending'
+
+    def descartar(self, outbox_id, erro, status_code=None):
+        raise AssertionError('não deveria descartar')
+
+
+def _despachante(ja_publicada):
+    envios, conferidas = [], []
+
+    def conferir(linha):
+        conferidas.append(linha['id'])
+        return ja_publicada
+
+    outbox = OutboxFalsa()
+    despachante = Despachante(outbox, envios.append, ControleAIMD(), conferir=conferir)
+    return despachante, outbox, envios, conferidas
+
+
+def _linha(attempts, last_status):
+    from datetime import datetime
+    return {'id': 1, 'user_id': 1000, 'question_id': 7, 'answer': 'ok', 'attempts': attempts,
+            'last_status': last_status, 'created_at': datetime.utcnow()}
+
+
+def test_envio_incerto_ja_publicado_nao_repete_o_post():
+    # 5xx/timeout na tentativa anterior e a pergunta já aparece respondida
+    for status in (None, 503):
+        despachante, outbox, envios, conferidas = _despachante(ja_publicada=True)
+        despachante._tentar(_linha(2, status))
+        assert envios == []
+        assert conferidas == [1]
+        assert outbox.concluidas == [1]
+        assert despachante.stats()['confirmed_after_uncertain'] == 1
+
+
+def test_envio_incerto_nao_publicado_reenvia():
+    despachante, outbox, envios, conferidas = _despachante(ja_publicada=False)
+    despachante._tentar(_linha(2, 504))
+    assert conferidas == [1]
+    assert len(envios) == 1
+    assert outbox.concluidas == [1]
+
+
+def test_primeira_tentativa_e_429_nao_consultam_a_pergunta():
+    # 429: o ML recusou antes de processar, não há o que conferir
+    for linha in (_linha(1, None), _linha(3, 429)):
+        despachante, outbox, envios, conferidas = _despachante(ja_publicada=True)
+        despachante._tentar(linha)
+        assert conferidas == []
+        assert len(envios) == 1
+
+
+def test_falha_ao_conferir_reagenda_sem_post():
+    from ml_client import MLApiError
+
+    def conferir(linha):
+        raise MLApiError('GET /questions/{id} retornou 503', status_code=503)
+
+    envios = []
+    outbox = OutboxFalsa()
+    despachante = Despachante(outbox, envios.append, ControleAIMD(), conferir=conferir)
+    despachante._tentar(_linha(2, None))
+    assert envios == []
+    assert outbox.reagendadas == [(1, 503)]
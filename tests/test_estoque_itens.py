@@ -0,0 +1,61 @@
+import json
+
+from flask import has_app_context
+
+
+def _guardar(bot, item_id, seller_id, titulo, descricao='Descrição guardada'):
+    with bot.app.app_context():
+        bot.db.session.merge(bot.ItemSnapshot(
+            item_id=item_id,
+            seller_id=seller_id,
+            data=json.dumps({'title': titulo, 'price': 10.0, 'currency_id': 'BRL'}),
+            description=descricao,
+            description_fetched=True,
+            last_updated='v1'
+        ))
+        bot.db.session.commit()
+
+
+def test_obter_item_ml_fora_de_contexto_le_do_estoque(bot, fake_ml):
+    # simulador_interno (modo thread) chama obter_item_ml sem request nem app context
+    _guardar(bot, 'MLB900', 1000, 'Guardado no estoque')
+    antes = fake_ml.contagem.get('items', 0)
+    assert not has_app_context()
+
+    item = bot.obter_item_ml('MLB900', 'token', seller_id=1000)
+
+    assert item['title'] == 'Guardado no estoque'
+    assert fake_ml.contagem.get('items', 0) == antes
+
+
+def test_obter_item_ml_fora_de_contexto_sem_estoque_vai_na_api(bot, fake_ml):
+    antes = fake_ml.contagem.get('items', 0)
+
+    item = bot.obter_item_ml('MLB901', 'token', seller_id=1000)
+
+    assert item['title'] == 'Produto de teste MLB901'
+    assert fake_ml.contagem.get('items', 0) == antes + 1
+
+
+def test_estoque_de_outro_vendedor_nao_e_usado(bot, fake_ml):
+    _guardar(bot, 'MLB902', 2000, 'De outro vendedor')
+
+    item = bot.obter_item_ml('MLB902', 'token', seller_id=1000)
+
+    assert item['title'] == 'Produto de teste MLB902'
+
+
+def test_gravar_item_que_ja_existe_com_outro_vendedor(bot):
+    # Anúncio transferido (ou linha velha): não derruba o lote do novo vendedor
+    estoque = bot.estoque_itens
+    with bot.app.app_context():
+        estoque.gravar(3000, [{'id': 'MLB950', 'title': 'Do vendedor antigo', 'last_updated': 'v1'}])
+        estoque.gravar(3001, [
+            {'id': 'MLB950', 'title': 'Transferido', 'last_updated': 'v2'},
+            {'id': 'MLB951', 'title': 'Novo', 'last_updated': 'v1'},
+        ])
+
+        assert estoque.obter(3000, 'MLB950') is None
+        assert estoque.obter(3001, 'MLB950')[0]['title'] == 'Transferido'
+        assert estoque.obter(3001, 'MLB951')[0]['title'] == 'Novo'
+        assert set(estoque.versoes(3001)) == {'MLB950', 'MLB951'}
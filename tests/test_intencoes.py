@@ -0,0 +1,44 @@
+import pytest
+
+from intencoes import ClassificadorIntencoes, Roteador
+
+ITEM = {
+    'price': 99.9, 'currency_id': 'BRL', 'available_quantity': 10, 'condition': 'new',
+    'free_shipping': True, 'warranty': '90 dias',
+}
+
+
+@pytest.fixture(scope='module')
+def classificador():
+    return ClassificadorIntencoes()
+
+
+@pytest.mark.parametrize('pergunta, intencao', [
+    ('Ainda tem esse produto?', 'stock'),
+    ('Tem pronta entrega?', 'stock'),
+    ('Qual o preço?', 'price'),
+    ('Qual o valor à vista?', 'price'),
+    ('Tem frete grátis?', 'free_shipping'),
+    ('É novo ou usado?', 'condition'),
+    ('Tem garantia?', 'warranty'),
+])
+def test_perguntas_respondiveis_por_template(classificador, pergunta, intencao):
+    assert classificador.classificar(pergunta)[0] == intencao
+
+
+@pytest.mark.parametrize('pergunta', [
+    # Quantidade: o preço unitário não responde
+    'Quanto fica pra 10?',
+    # Preço de atacado não é o preço do anúncio
+    'Qual o preço no atacado?',
+    # Retirada no local não é "pronta entrega"
+    'Está disponível para retirada?',
+    'Tem na cor azul?',
+    'Quanto custa o frete?',
+    'Tem garantia de 12 meses?',
+])
+def test_palavra_desconhecida_ou_numero_vai_para_a_ia(classificador, pergunta):
+    assert classificador.classificar(pergunta)[0] is None
+    decisao = Roteador(classificador, 'rapido').decidir(pergunta, ITEM)
+    assert decisao.rota == 'fast'
+    assert decisao.resposta is None
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+from jobs import JobRunner
+
+
+class PoolFalso:
+    concurrency = 1
+
+    def submit(self, fn, *args, tenant=None):
+        fn(*args)
+        return True
+
+
+def _job(bot, resource, status, dias):
+    bot.db.session.add(bot.Job(user_id=1, topic='questions', resource=resource, status=status,
+                               updated_at=datetime.utcnow() - timedelta(days=dias)))
+    bot.db.session.commit()
+
+
+def test_purgar_apaga_so_done_e_dead_antigos(bot):
+    with bot.app.app_context():
+        _job(bot, '/questions/p1', 'done', 30)
+        _job(bot, '/questions/p2', 'dead', 30)
+        _job(bot, '/questions/p3', 'done', 1)
+        _job(bot, '/questions/p4', 'pending', 30)
+
+        assert bot.job_queue.purgar(7) == 2
+        restantes = {j.resource for j in bot.Job.query.filter(bot.Job.resource.like('/questions/p%'))}
+        assert restantes == {'/questions/p3', '/questions/p4'}
+
+
+def test_job_descartado_leva_o_notification_id_ao_ao_descartar(bot):
+    descartados = []
+    runner = JobRunner(bot.job_queue, PoolFalso(), lambda job: {'status': 'error', 'reason': 'falhou'},
+                       ao_descartar=descartados.append, retencao_dias=0)
+    with bot.app.app_context():
+        bot.job_queue.max_attempts = 1
+        try:
+            assert bot.job_queue.enfileirar(1000, 'questions', '/questions/j1', 'notif-j1')
+        finally:
+            bot.job_queue.max_attempts = bot.JOB_MAX_ATTEMPTS
+        job, = [j for j in bot.job_queue.reivindicar(10, 'teste') if j['resource'] == '/questions/j1']
+    assert job['notification_id'] == 'notif-j1'
+
+    runner._despachar(job)
+
+    assert [d['id'] for d in descartados] == [job['id']]
+    with bot.app.app_context():
+        assert bot.db.session.get(bot.Job, job['id']).status == 'dead'
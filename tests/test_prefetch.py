@@ -0,0 +1,148 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from prefetch import PrefetchAnuncios
+
+
+class EstoqueFalso:
+    def __init__(self, versoes=None):
+        self.itens = dict(versoes or {})  # item_id -> (last_updated, fetched_at)
+        self.gravados = []
+        self.removidos = set()
+
+    def versoes(self, seller_id):
+        return dict(self.itens)
+
+    def gravar(self, seller_id, itens):
+        self.gravados.extend(i['id'] for i in itens)
+        for item in itens:
+            self.itens[item['id']] = (item['last_updated'], datetime.utcnow())
+
+    def marcar_conferidos(self, item_ids):
+        for item_id in item_ids:
+            self.itens[item_id] = (self.itens[item_id][0], datetime.utcnow())
+
+    def remover(self, item_ids):
+        self.removidos.update(item_ids)
+        for item_id in item_ids:
+            self.itens.pop(item_id, None)
+
+
+class MLFalso:
+    """Listagem em páginas de 2; `paginas` limita quantas o scan entrega."""
+
+    def __init__(self, ids, total=None, paginas=None, ao_listar=None):
+        self.ids = ids
+        self.total = len(ids) if total is None else total
+        self.paginas = paginas
+        self.ao_listar = ao_listar
+        self.multiget = []
+
+    def listar_anuncios(self, seller_id, token, status='active', scroll_id=None, limit=100):
+        pagina = int(scroll_id or 0)
+        if self.ao_listar:
+            self.ao_listar(pagina)
+        resultados = [] if self.paginas is not None and pagina >= self.paginas else self.ids[pagina * 2:pagina * 2 + 2]
+        return {'results': resultados, 'scroll_id': str(pagina + 1), 'paging': {'total': self.total}}
+
+    def obter_itens(self, item_ids, token, seller_id=None, attributes=None):
+        self.multiget.extend(item_ids)
+        return [{'code': 200, 'body': {'id': i, 'seller_id': seller_id, 'status': 'active', 'last_updated': 'v1'}}
+                for i in item_ids]
+
+
+def _prefetch(estoque, ml, **kwargs):
+    alterados = []
+    prefetch = PrefetchAnuncios(None, None, None, None, estoque, ml, obter_token=lambda uid: 'token',
+                                ao_alterar=lambda item_id, seller_id: alterados.append(item_id), **kwargs)
+    return prefetch, alterados
+
+
+def _conhecidos(*ids, idade=0):
+    return {i: ('v1', datetime.utcnow() - timedelta(seconds=idade)) for i in ids}
+
+
+def test_listagem_completa_remove_o_que_saiu():
+    estoque = EstoqueFalso(_conhecidos('MLB1', 'MLB2', 'MLB9'))
+    prefetch, alterados = _prefetch(estoque, MLFalso(['MLB1', 'MLB2', 'MLB3']))
+
+    resumo = prefetch.prefetch_vendedor(1)
+
+    assert resumo['complete_listing'] is True
+    assert estoque.removidos == {'MLB9'}
+    assert sorted(alterados) == ['MLB3', 'MLB9']
+
+
+def test_listagem_menor_que_o_total_nao_remove_nada():
+    # O scan parou antes de paging.total: o que não veio não saiu necessariamente da loja
+    estoque = EstoqueFalso(_conhecidos('MLB1', 'MLB2', 'MLB3', 'MLB4'))
+    prefetch, _ = _prefetch(estoque, MLFalso(['MLB1', 'MLB2', 'MLB3', 'MLB4'], paginas=1))
+
+    resumo = prefetch.prefetch_vendedor(1)
+
+    assert resumo['listings'] == 2
+    assert resumo['complete_listing'] is False
+    assert estoque.removidos == set()
+    assert set(estoque.itens) == {'MLB1', 'MLB2', 'MLB3', 'MLB4'}
+    assert prefetch.stats()['partial_listings'] == 1
+
+
+def test_listagem_interrompida_no_desligamento_nao_remove_nada():
+    estoque = EstoqueFalso(_conhecidos('MLB1', 'MLB2', 'MLB3', 'MLB4'))
+    parando = threading.Event()
+    ml = MLFalso(['MLB1', 'MLB2', 'MLB3', 'MLB4'], ao_listar=lambda pagina: parando.set())
+    prefetch, _ = _prefetch(estoque, ml)
+    prefetch._parando = parando
+
+    resumo = prefetch.prefetch_vendedor(1)
+
+    assert resumo['complete_listing'] is False
+    assert estoque.removidos == set()
+
+
+def test_erro_na_listagem_nao_remove_nada():
+    estoque = EstoqueFalso(_conhecidos('MLB1', 'MLB2'))
+    ml = MLFalso(['MLB1', 'MLB2', 'MLB3'])
+
+    def falha(pagina):
+        if pagina == 1:
+            raise RuntimeError('503')
+
+    ml.ao_listar = falha
+    prefetch, _ = _prefetch(estoque, ml)
+
+    with pytest.raises(RuntimeError):
+        prefetch.prefetch_vendedor(1)
+    assert estoque.removidos == set()
+
+
+def test_multiget_so_de_novos_e_vencidos():
+    conhecidos = _conhecidos('MLB1', 'MLB2') | _conhecidos('MLB3', idade=7200)
+    estoque = EstoqueFalso(conhecidos)
+    ml = MLFalso(['MLB1', 'MLB2', 'MLB3', 'MLB4'])
+    prefetch, alterados = _prefetch(estoque, ml, revalidar=3600)
+
+    resumo = prefetch.prefetch_vendedor(1)
+
+    assert sorted(ml.multiget) == ['MLB3', 'MLB4']
+    assert resumo['fetched'] == 2
+    # MLB3 foi conferido e não mudou: só renova o fetched_at
+    assert estoque.gravados == ['MLB4']
+    assert alterados == ['MLB4']
+    assert estoque.itens['MLB3'][1] > conhecidos['MLB3'][1]
+
+
+def test_segunda_execucao_sem_mudancas_nao_faz_multiget():
+    estoque = EstoqueFalso()
+    ml = MLFalso(['MLB1', 'MLB2', 'MLB3'])
+    prefetch, _ = _prefetch(estoque, ml)
+
+    prefetch.prefetch_vendedor(1)
+    ml.multiget.clear()
+    resumo = prefetch.prefetch_vendedor(1)
+
+    assert ml.multiget == []
+    assert resumo['changed'] == 0
+    assert resumo['api_calls'] == 2  # só as páginas da listagem
@@ -0,0 +1,137 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select
+
+
+class TokenRefresher:
+    """Renova access tokens do ML usando o refresh_token salvo.
+
+    - renovar_expirando(): renovação em lote, antes de expirar, com concorrência limitada
+    - renovar_apos_401(): caminho do request; chamadas concorrentes para o mesmo
+      vendedor são agrupadas numa única renovação (single-flight)
+
+    A linha do usuário é travada (FOR UPDATE) durante a renovação e o token é
+    relido depois do lock: se outro processo já renovou, reaproveita o novo
+    token em vez de gastar o refresh_token de novo (o ML os invalida após o uso).
+    """
+
+    def __init__(self, app, db, model, ml, credenciais, ao_renovar=None,
+                 janela=1800, concorrencia=4, lote=200):
+        self.app = app
+        self.db = db
+        self.User = model
+        self.ml = ml
+        self.credenciais = credenciais
+        self.ao_renovar = ao_renovar
+        self.janela = janela
+        self.concorrencia = concorrencia
+        self.lote = lote
+        self._em_voo = {}
+        self._lock = threading.Lock()
+        self.renovados = 0
+        self.falhas = 0
+        self.coalescidos = 0
+
+    def _coalescer(self, user_id, fn):
+        with self._lock:
+            voo = self._em_voo.get(user_id)
+            dono = voo is None
+            if dono:
+                voo = {'evento': threading.Event(), 'token': None}
+                self._em_voo[user_id] = voo
+            else:
+                self.coalescidos += 1
+
+        if not dono:
+            voo['evento'].wait(30)
+            return voo['token']
+
+        try:
+            voo['token'] = fn()
+            return voo['token']
+        finally:
+            with self._lock:
+                self._em_voo.pop(user_id, None)
+            voo['evento'].set()
+
+    def renovar_apos_401(self, user_id, token_rejeitado):
+        return self._coalescer(user_id, lambda: self._renovar(user_id, token_rejeitado=token_rejeitado))
+
+    def renovar(self, user_id):
+        return self._coalescer(user_id, lambda: self._renovar(user_id))
+
+    def _renovar(self, user_id, token_rejeitado=None):
+        User = self.User
+        with self.app.app_context():
+            session = self.db.session
+            try:
+                user = session.execute(
+                    select(User).where(User.user_id == user_id).with_for_update()
+                ).scalar_one_or_none()
+                if not user or not user.refresh_token:
+                    session.rollback()
+                    return None
+
+                # Outro processo pode ter renovado enquanto esperávamos o lock
+                limite = datetime.utcnow() + timedelta(seconds=self.janela)
+                atual = user.access_token
+                if token_rejeitado is not None and atual != token_rejeitado:
+                    session.rollback()
+                    return atual
+                if token_rejeitado is None and user.expires_at and user.expires_at > limite:
+                    session.rollback()
+                    return atual
+
+                client_id, client_secret = self.credenciais()
+                dados = self.ml.renovar_token(client_id, client_secret, user.refresh_token)
+
+                novo_token = dados.get('access_token')
+                user.access_token = novo_token
+                user.refresh_token = dados.get('refresh_token') or user.refresh_token
+                user.expires_at = datetime.utcnow() + timedelta(seconds=int(dados.get('expires_in') or 21600))
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                with self._lock:
+                    self.falhas += 1
+                print(f"Erro ao renovar token do usuário {user_id}: {e}")
+                return None
+
+        with self._lock:
+            self.renovados += 1
+        print(f"Token do usuário {user_id} renovado.")
+        if self.ao_renovar:
+            self.ao_renovar(user_id)
+        return novo_token
+
+    def renovar_expirando(self):
+        User = self.User
+        limite = datetime.utcnow() + timedelta(seconds=self.janela)
+        with self.app.app_context():
+            ids = self.db.session.execute(
+                select(User.user_id)
+                .where(
+                    User.is_active.is_(True),
+                    User.refresh_token.isnot(None),
+                    or_(User.expires_at.is_(None), User.expires_at < limite)
+                )
+                .order_by(User.expires_at)
+                .limit(self.lote)
+            ).scalars().all()
+
+        if not ids:
+            return 0
+        print(f"Renovando {len(ids)} tokens próximos de expirar...")
+        with ThreadPoolExecutor(max_workers=self.concorrencia) as executor:
+            resultados = list(executor.map(self.renovar, ids))
+        return sum(1 for r in resultados if r)
+
+    def stats(self):
+        return {
+            'refreshed': self.renovados,
+            'failed': self.falhas,
+            'coalesced': self.coalescidos,
+            'in_flight': len(self._em_voo),
+        }
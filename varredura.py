@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('ENABLE_ADMIN', '0')
+
+from app import (
+    app, db, User, ml, init_db, obter_tenant, processar_pergunta,
+    idempotencia, chaves_idempotencia
+)
+
+# Varredura de recuperação: responde todas as perguntas UNANSWERED de todos os
+# vendedores ativos. Cobre o que se perdeu enquanto o dyno dormia ou caiu (o
+# webhook é a única outra porta de entrada).
+#
+#   python varredura.py --global-concurrency 16 --per-seller 2
+#   python varredura.py --loop 1800          # modo agendado (a cada 30 min)
+#
+# É retomável: o progresso vai para o arquivo de checkpoint e uma nova execução
+# pula vendedores já concluídos e perguntas já respondidas. Perguntas em
+# andamento pelo webhook são puladas pelo índice de idempotência.
+
+PAGINA = 50
+
+
+class Checkpoint:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self.sellers_done = set()
+        self.questions_done = set()
+        self._ultimo_salvamento = 0
+        if os.path.exists(caminho):
+            with open(caminho) as f:
+                dados = json.load(f)
+            self.sellers_done = set(dados.get('sellers_done', []))
+            self.questions_done = set(dados.get('questions_done', []))
+            print(f"Retomando varredura: {len(self.sellers_done)} vendedores e {len(self.questions_done)} perguntas já concluídos.")
+
+    def pergunta_concluida(self, question_id):
+        with self._lock:
+            self.questions_done.add(question_id)
+        self.salvar()
+
+    def vendedor_concluido(self, seller_id):
+        with self._lock:
+            self.sellers_done.add(seller_id)
+        self.salvar(forcar=True)
+
+    def salvar(self, forcar=False):
+        with self._lock:
+            if not forcar and time.monotonic() - self._ultimo_salvamento < 5:
+                return
+            self._ultimo_salvamento = time.monotonic()
+            temporario = f"{self.caminho}.tmp"
+            with open(temporario, 'w') as f:
+                json.dump({'sellers_done': sorted(self.sellers_done), 'questions_done': sorted(self.questions_done)}, f)
+            os.replace(temporario, self.caminho)
+
+    def remover(self):
+        if os.path.exists(self.caminho):
+            os.remove(self.caminho)
+
+
+class Varredura:
+    def __init__(self, checkpoint, global_concurrency=16, per_seller=2, sellers_parallel=4):
+        self.checkpoint = checkpoint
+        self.executor = ThreadPoolExecutor(max_workers=global_concurrency, thread_name_prefix='varredura')
+        # Limita o que fica enfileirado no executor (além do que está rodando)
+        self.vagas_globais = threading.BoundedSemaphore(global_concurrency * 2)
+        self.per_seller = per_seller
+        self.sellers_parallel = sellers_parallel
+        self.parar = threading.Event()
+        self._lock = threading.Lock()
+        self.contagem = {}
+
+    def _contar(self, chave):
+        with self._lock:
+            self.contagem[chave] = self.contagem.get(chave, 0) + 1
+
+    def listar_pendentes(self, seller_id, token):
+        # Lista tudo antes de responder: responder remove a pergunta da busca e
+        # bagunçaria a paginação por offset
+        perguntas = []
+        offset = 0
+        while not self.parar.is_set():
+            pagina = ml.buscar_perguntas(seller_id, token, offset=offset, limit=PAGINA)
+            itens = pagina.get('questions', [])
+            perguntas.extend(itens)
+            offset += len(itens)
+            if not itens or offset >= pagina.get('total', 0):
+                break
+        return perguntas
+
+    def _processar(self, seller_id, token, pergunta, vaga_vendedor):
+        try:
+            question_id = pergunta.get('id')
+            chaves = chaves_idempotencia(f"/questions/{question_id}")
+            with app.app_context():
+                if not idempotencia.reservar(chaves):
+                    self._contar('skipped_in_flight')
+                    return
+                try:
+                    resultado = processar_pergunta(seller_id, token, pergunta)
+                except Exception:
+                    idempotencia.liberar(chaves)
+                    raise
+                if resultado.get('status') == 'error':
+                    idempotencia.liberar(chaves)
+                else:
+                    idempotencia.concluir(chaves)
+            self._contar(resultado.get('reason') or resultado.get('status'))
+            if resultado.get('status') != 'error':
+                self.checkpoint.pergunta_concluida(question_id)
+        except Exception as e:
+            self._contar('exception')
+            print(f"Erro na varredura da pergunta {pergunta.get('id')}: {e}")
+        finally:
+            vaga_vendedor.release()
+            self.vagas_globais.release()
+
+    def varrer_vendedor(self, seller_id):
+        if seller_id in self.checkpoint.sellers_done or self.parar.is_set():
+            return
+        with app.app_context():
+            tenant = obter_tenant(seller_id)
+        if not tenant or not tenant.is_active:
+            return
+
+        try:
+            perguntas = self.listar_pendentes(seller_id, tenant.access_token)
+        except Exception as e:
+            print(f"Erro ao listar perguntas do vendedor {seller_id}: {e}")
+            self._contar('list_failed')
+            return
+
+        pendentes = [p for p in perguntas if p.get('id') not in self.checkpoint.questions_done]
+        if pendentes:
+            print(f"Vendedor {seller_id}: {len(pendentes)} perguntas pendentes.")
+
+        vaga_vendedor = threading.BoundedSemaphore(self.per_seller)
+        futuros = []
+        for pergunta in pendentes:
+            if self.parar.is_set():
+                break
+            vaga_vendedor.acquire()
+            self.vagas_globais.acquire()
+            futuros.append(self.executor.submit(self._processar, seller_id, tenant.access_token, pergunta, vaga_vendedor))
+        for futuro in futuros:
+            futuro.result()
+
+        if not self.parar.is_set():
+            self.checkpoint.vendedor_concluido(seller_id)
+
+    def executar(self, sellers=None):
+        inicio = time.monotonic()
+        with app.app_context():
+            if not sellers:
+                sellers = db.session.execute(
+                    db.select(User.user_id).where(User.is_active.is_(True)).order_by(User.user_id)
+                ).scalars().all()
+        print(f"Varrendo {len(sellers)} vendedores...")
+
+        with ThreadPoolExecutor(max_workers=self.sellers_parallel, thread_name_prefix='vendedor') as vendedores:
+            list(vendedores.map(self.varrer_vendedor, sellers))
+        self.executor.shutdown(wait=True)
+
+        completa = not self.parar.is_set()
+        self.checkpoint.salvar(forcar=True)
+        if completa:
+            # Varredura completa: a próxima começa do zero
+            self.checkpoint.remover()
+        print(f"Varredura {'concluída' if completa else 'interrompida'} em {time.monotonic() - inicio:.1f}s: {self.contagem}")
+        return completa
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Responde o backlog de perguntas UNANSWERED de todos os vendedores ativos')
+    parser.add_argument('--global-concurrency', type=int, default=16, help='perguntas em processamento ao mesmo tempo (total)')
+    parser.add_argument('--per-seller', type=int, default=2, help='perguntas em processamento ao mesmo tempo por vendedor')
+    parser.add_argument('--sellers-parallel', type=int, default=4, help='vendedores listados/varridos em paralelo')
+    parser.add_argument('--seller', type=int, action='append', help='varre só este vendedor (pode repetir)')
+    parser.add_argument('--checkpoint', default=os.getenv('SWEEP_CHECKPOINT', 'varredura_checkpoint.json'))
+    parser.add_argument('--loop', type=float, help='repete a cada N segundos (modo agendado)')
+    args = parser.parse_args()
+
+    init_db()
+    parar = threading.Event()
+    varredura_atual = {}
+
+    def interromper(*_):
+        print("Interrompendo: terminando as perguntas em andamento e salvando checkpoint...")
+        parar.set()
+        if varredura_atual.get('v'):
+            varredura_atual['v'].parar.set()
+
+    signal.signal(signal.SIGTERM, interromper)
+    signal.signal(signal.SIGINT, interromper)
+
+    while not parar.is_set():
+        varredura = Varredura(
+            Checkpoint(args.checkpoint),
+            global_concurrency=args.global_concurrency,
+            per_seller=args.per_seller,
+            sellers_parallel=args.sellers_parallel
+        )
+        varredura_atual['v'] = varredura
+        varredura.executar(args.seller)
+        if not args.loop:
+            break
+        parar.wait(args.loop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import os
+import signal
+import threading
+
+# Sem painel no worker: não carrega flask-admin
+os.environ.setdefault('ENABLE_ADMIN', '0')
+
+from app import init_db, iniciar_background, pool, job_runner, WORKER_DRAIN_TIMEOUT
+
+# Processo dedicado à fila durável (QUEUE_BACKEND=database).
+# Rode quantos quiser, em quantos nós quiser: cada um reivindica jobs com
+# SKIP LOCKED, então a vazão cresce com o número de workers.
+
+parar = threading.Event()
+
+def encerrar(*_):
+    parar.set()
+
+if __name__ == '__main__':
+    init_db()
+    signal.signal(signal.SIGTERM, encerrar)
+    signal.signal(signal.SIGINT, encerrar)
+
+    print(f"Worker {job_runner.worker_id} iniciado (concorrência {pool.concurrency}).")
+    iniciar_background()
+    job_runner.start()
+    while not parar.is_set():
+        parar.wait(1)
+
+    print("Encerrando worker: parando de reivindicar jobs...")
+    job_runner.stop()
+    pool.shutdown(WORKER_DRAIN_TIMEOUT)
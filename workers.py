@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+
+from escalonador import ESPERA_FILA, FairScheduler
+
+
+class WorkerPool:
+    """Pool limitado de threads que executa tarefas fora do ciclo do request.
+
+    A fila tem tamanho máximo: quando está cheia, submit() recusa a tarefa
+    (load shedding) em vez de bloquear o worker do gunicorn. Por baixo é um
+    FairScheduler: com submit(..., tenant=user_id) cada vendedor tem sua
+    sub-fila e os workers alternam entre eles.
+    """
+
+    def __init__(self, concurrency=4, max_queue=500, name='worker', escalonador=None):
+        self.concurrency = max(1, int(concurrency))
+        self.name = name
+        self._fila = escalonador or FairScheduler(max_queue=max_queue)
+        self.max_queue = self._fila.max_queue
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._parando = threading.Event()
+        self._ativos = 0
+
+        # Contadores simples (lidos pela rota /stats)
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        # As threads são criadas sob demanda e por processo: depois de um fork
+        # (gunicorn) o filho precisa subir as suas próprias threads.
+        with self._lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._parando.clear()
+            self._threads = []
+            for i in range(self.concurrency):
+                t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, fn, *args, tenant=None, **kwargs):
+        if self._parando.is_set():
+            with self._lock:
+                self.rejected += 1
+            return False
+        self.start()
+        if not self._fila.put_nowait(tenant, (fn, args, kwargs)):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _run(self):
+        while True:
+            proximo = self._fila.get(timeout=0.5)
+            if proximo is None:
+                if self._parando.is_set():
+                    return
+                continue
+            tenant, (fn, args, kwargs), espera = proximo
+
+            with self._lock:
+                self._ativos += 1
+            ok = False
+            marca = ESPERA_FILA.set(espera)
+            try:
+                fn(*args, **kwargs)
+                ok = True
+            except Exception as e:
+                print(f"Erro no worker {threading.current_thread().name}: {e}")
+            finally:
+                ESPERA_FILA.reset(marca)
+                with self._lock:
+                    self._ativos -= 1
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+                self._fila.concluir(tenant)
+
+    def shutdown(self, timeout=25):
+        # Para de aceitar tarefas e espera a fila esvaziar (drain) até o timeout.
+        self._parando.set()
+        if self._pid != os.getpid():
+            return
+        pendentes = self._fila.qsize()
+        if pendentes or self._ativos:
+            print(f"Drenando {self.name}: {pendentes} na fila, {self._ativos} em execução...")
+        prazo = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0, prazo - time.monotonic()))
+        restantes = self._fila.qsize()
+        if restantes:
+            print(f"Aviso: {restantes} tarefas descartadas no desligamento de {self.name}.")
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'max_queue': self.max_queue,
+            'queue_depth': self._fila.qsize(),
+            'active': self._ativos,
+            'submitted': self.submitted,
+            'rejected': self.rejected,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+    def stats_tenants(self, top=20):
+        return self._fila.stats(top)